@@ -0,0 +1,67 @@
+"""Клиент управляющего сокета сервера для скриптов и массовой модерации.
+
+Примеры:
+    python adminctl.py online
+    python adminctl.py ban spammer1 spammer2
+    python adminctl.py ban --file spammers.txt        # по одному имени в строке
+    python adminctl.py mute --minutes 30 --file flood.txt
+    python adminctl.py broadcast "Перезапуск через 5 минут"
+    python adminctl.py restart                        # без потери состояния и сессий
+
+Ответ сервера печатается одной строкой JSON; код выхода 1, если ok = false.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messenger.sock')
+USER_COMMANDS = ('ban', 'unban', 'kick', 'mute', 'unmute', 'kill')
+
+
+def read_usernames(path):
+    """Имена из файла: по одному в строке, пустые строки и # комментарии пропускаются"""
+    with open(path, encoding='utf-8') as names:
+        return [line.strip() for line in names if line.strip() and not line.lstrip().startswith('#')]
+
+
+def send_command(path, command):
+    """Отправить один запрос и вернуть ответ"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(command, ensure_ascii=False).encode('utf-8') + b'\n')
+        with connection.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Управление сервером мессенджера')
+    parser.add_argument('cmd', choices=('ping', 'online', 'broadcast', 'restart') + USER_COMMANDS)
+    parser.add_argument('args', nargs='*', help='имена пользователей или текст объявления')
+    parser.add_argument('--file', help='файл с именами, по одному в строке')
+    parser.add_argument('--minutes', type=int, help='длительность мута')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='путь к управляющему сокету')
+    args = parser.parse_args()
+
+    command = {'cmd': args.cmd}
+    if args.cmd == 'broadcast':
+        command['text'] = ' '.join(args.args)
+    elif args.cmd in USER_COMMANDS:
+        command['users'] = args.args + (read_usernames(args.file) if args.file else [])
+        if args.cmd == 'mute':
+            command['minutes'] = args.minutes
+    elif args.args or args.file:
+        parser.error(f'{args.cmd} не принимает аргументов')
+
+    try:
+        response = send_command(args.socket, command)
+    except OSError as e:
+        print(f'Нет связи с сервером ({args.socket}): {e}', file=sys.stderr)
+        return 2
+    print(json.dumps(response, ensure_ascii=False))
+    return 0 if response.get('ok') else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Микробенчмарки горячих путей сервера на синтетических данных реального масштаба.
+
+Данные (пользователи, сообщения, личные чаты, группы, онлайн-сессии) кладутся
+прямо в структуры server.py, минуя сокеты. Обработчики вызываются напрямую в
+контексте запроса от имени одного подключённого тестового клиента, поэтому
+в замер входят логика обработчика и кодирование ответов, но не сеть.
+
+Запуск:
+    python benchmarks/bench_core.py                          # 100k / 1M / 100k / 10k
+    python benchmarks/bench_core.py --scale 0.1 --repeat 50  # быстрый прогон
+    python benchmarks/bench_core.py --json > core.json       # для сравнения коммитов
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import request
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ('привет', 'как', 'дела', 'сегодня', 'завтра', 'встреча', 'код', 'релиз', 'ошибка',
+         'тест', 'сервер', 'клиент', 'обед', 'ок', 'спасибо', 'готово', 'посмотри', 'ссылка')
+
+
+def seed(users, messages, dms, groups, group_size, online):
+    """Заполнить состояние сервера; вернуть время каждого этапа в секундах"""
+    timings = {}
+    rng = random.Random(42)
+
+    started = time.perf_counter()
+    usernames = [f'user{index}' for index in range(users)]
+    for index, username in enumerate(usernames):
+        server.users_db[username] = {
+            'password_hash': '',
+            'user_id': f'{index:06d}',
+            'created_at': '2026-01-01T00:00:00',
+            'banned': False,
+            'muted_until': None,
+            'admin': False
+        }
+        server.usernames_by_id[f'{index:06d}'] = username
+    timings['users'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    dm_ids = []
+    for index in range(dms):
+        first, second = rng.sample(range(users), 2)
+        chat_id = f'dm{index:07d}'
+        server.private_chats[chat_id] = {
+            'name': usernames[second],
+            'users': [f'{first:06d}', f'{second:06d}'],
+            'creator_id': f'{first:06d}',
+            'created_at': '2026-01-01T00:00:00',
+            'type': 'private'
+        }
+        dm_ids.append(chat_id)
+    group_ids = []
+    for index in range(groups):
+        members = [f'{member:06d}' for member in rng.sample(range(users), group_size)]
+        chat_id = f'gr{index:07d}'
+        server.group_chats[chat_id] = {
+            'name': f'group {index}',
+            'users': members,
+            'creator_id': members[0],
+            'created_at': '2026-01-01T00:00:00',
+            'type': 'group'
+        }
+        group_ids.append(chat_id)
+    for chat_id, chat_data in list(server.private_chats.items()) + list(server.group_chats.items()):
+        for user_id in chat_data['users']:
+            server.user_chats.setdefault(user_id, {})[chat_id] = None
+    timings['chats'] = time.perf_counter() - started
+
+    # Половина сообщений в публичных каналах, остальное в личных чатах и группах
+    started = time.perf_counter()
+    public_ids = [channel['id'] for channel in server.channels]
+    for _ in range(messages):
+        roll = rng.random()
+        if roll < 0.5 or not (dm_ids or group_ids):
+            channel = rng.choice(public_ids)
+        elif roll < 0.8 and dm_ids or not group_ids:
+            channel = rng.choice(dm_ids)
+        else:
+            channel = rng.choice(group_ids)
+        text = ' '.join(rng.choices(WORDS, k=rng.randint(2, 8)))
+        message = server.store_message({
+            'username': usernames[rng.randrange(users)],
+            'message': text,
+            'timestamp': 1767225600000,
+            'channel': channel
+        })
+        server.index_message(message)
+    timings['messages'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Через add_session, как при входе: рассылка идёт по user_sessions
+    for index in range(online):
+        server.add_session(f'seed-sid-{index}', usernames[rng.randrange(users)])
+    timings['online'] = time.perf_counter() - started
+    return timings, dm_ids, group_ids
+
+
+def measure(client, sid, call, inputs):
+    """Вызвать call(input) для каждого входа в контексте запроса sid; вернуть времена в мкс"""
+    times = []
+    with server.app.test_request_context('/'):
+        request.sid = sid
+        request.namespace = '/'
+        for item in inputs:
+            started = time.perf_counter()
+            call(item)
+            times.append((time.perf_counter() - started) * 1e6)
+            client.get_received()
+    return times
+
+
+def summarize(times):
+    ordered = sorted(times)
+    return {
+        'calls': len(ordered),
+        'mean_us': round(statistics.fmean(ordered), 1),
+        'p50_us': round(ordered[len(ordered) // 2], 1),
+        'p99_us': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 1),
+        'max_us': round(ordered[-1], 1)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки горячих путей сервера')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--dms', type=int, default=100000)
+    parser.add_argument('--groups', type=int, default=10000)
+    parser.add_argument('--group-size', type=int, default=10)
+    parser.add_argument('--online', type=int, default=5000, help='сессий, добавленных через add_session')
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель для всех объёмов')
+    parser.add_argument('--repeat', type=int, default=200, help='вызовов на каждый замер')
+    parser.add_argument('--json', action='store_true', help='одна строка JSON вместо таблицы')
+    args = parser.parse_args()
+
+    sizes = {name: max(int(getattr(args, name) * args.scale), 2)
+             for name in ('users', 'messages', 'dms', 'groups', 'online')}
+    server.LOG_LEVEL = 'WARNING'
+    server.setup_logging()
+    timings, dm_ids, group_ids = seed(group_size=min(args.group_size, sizes['users']), **sizes)
+
+    # Единственный настоящий сокет: от его имени вызываются обработчики
+    client = server.socketio.test_client(server.app)
+    sid = next(sid for sid in server.socketio.server.manager.rooms['/'][None])
+    rng = random.Random(7)
+    server.add_session(sid, 'user0')
+    bench_user = server.online_users[sid]
+    server.users_db['user0']['admin'] = True
+    server.users_db['bench'] = dict(server.users_db['user0'], user_id='bench0')
+    server.usernames_by_id['bench0'] = 'bench'
+
+    repeat = args.repeat
+    all_ids = [message['id'] for message in server.messages]
+    victims = rng.sample(all_ids, min(repeat, len(all_ids)))
+    deleted = set(victims)
+    edits = rng.sample([message_id for message_id in all_ids if message_id not in deleted],
+                       min(repeat, len(all_ids) - len(victims)))
+    user_ids = [f'{rng.randrange(sizes["users"]):06d}' for _ in range(repeat)]
+    member_ids = [rng.choice(server.group_chats[chat_id]['users'])
+                  for chat_id in rng.choices(group_ids, k=repeat)]
+
+    def join(channel):
+        server.handle_join_channel({'channel_id': channel, 'channel_type': 'public'})
+
+    def join_private(chat_id):
+        bench_user['user_id'] = server.private_chats[chat_id]['users'][0]
+        server.handle_join_channel({'channel_id': chat_id, 'channel_type': 'private'})
+
+    def delete(message_id):
+        message = server.find_message(message_id)
+        server.handle_delete_message({'message_id': message_id, 'channel': message['channel']})
+
+    def edit(message_id):
+        message = server.find_message(message_id)
+        bench_user['username'] = message['username']
+        server.handle_edit_message({'message_id': message_id, 'channel': message['channel'],
+                                    'message': 'исправлено ' + message['message']})
+
+    def create_private_chat(target_user_id):
+        bench_user['user_id'] = 'bench0'
+        server.handle_create_private_chat({'target_user_id': target_user_id})
+
+    def chat_list(user_id):
+        bench_user['user_id'] = user_id
+        server.send_chat_list(sid)
+
+    # Путь в ответе - то, что раньше было send_groups_to_user: список чатов пользователя
+    cases = [
+        ('join_channel: public history', join, ['general'] * repeat),
+        ('join_channel: private history', join_private, rng.choices(dm_ids, k=repeat)),
+        ('delete_message', delete, victims),
+        ('edit_message', edit, edits),
+        ('create_private_chat', create_private_chat, user_ids),
+        ('send_chat_list', chat_list, member_ids),
+        ('update_online_users', lambda _: server.update_online_users(), range(max(repeat // 10, 1))),
+        ('get_user_by_id', server.get_user_by_id, user_ids),
+    ]
+
+    results = {}
+    for name, call, inputs in cases:
+        bench_user.update(username='user0', user_id='000000')
+        results[name] = summarize(measure(client, sid, call, list(inputs)))
+    client.disconnect()
+
+    report = {
+        'revision': git_revision(),
+        'sizes': dict(sizes, group_size=args.group_size),
+        'seed_s': {name: round(value, 2) for name, value in timings.items()},
+        'cases': results
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    print(f"revision {report['revision']}  " + '  '.join(f'{name}={size}' for name, size in report['sizes'].items()))
+    print('seed, s: ' + '  '.join(f'{name} {value}' for name, value in report['seed_s'].items()))
+    print(f"{'case':<32} {'calls':>6} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10}")
+    for name, row in results.items():
+        print(f"{name:<32} {row['calls']:>6} {row['mean_us']:>10} {row['p50_us']:>10} "
+              f"{row['p99_us']:>10} {row['max_us']:>10}")
+
+
+if __name__ == '__main__':
+    main()
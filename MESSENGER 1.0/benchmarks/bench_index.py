@@ -0,0 +1,66 @@
+"""Бенчмарк отдачи главной страницы: рендер на каждый запрос против предсобранного ответа.
+
+Вариант «до» рендерит исходную страницу со встроенными стилями и скриптом
+(fixtures/index_baseline.html - шаблон HTML из базовой версии server.py), как
+это делал сервер до предсборки; текущая страница - небольшая оболочка, и
+рендерить её для сравнения было бы нечестно.
+
+Запуск: python benchmarks/bench_index.py [число запросов]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template_string
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'index_baseline.html')
+with open(BASELINE_PATH, encoding='utf-8') as baseline:
+    BASELINE_HTML = baseline.read()
+
+
+@server.app.route('/__bench_legacy_index')
+def legacy_index():
+    """Старое поведение: исходная страница через Jinja на каждый запрос"""
+    return render_template_string(BASELINE_HTML)
+
+
+def measure(client, path, headers, count):
+    """Сделать count запросов и вернуть (запросов в секунду, байт в ответе, статус)"""
+    response = client.get(path, headers=headers)
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get(path, headers=headers)
+    elapsed = time.perf_counter() - started
+    return count / elapsed, len(response.get_data()), response.status_code
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    client = server.app.test_client()
+    etag = client.get('/', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+
+    cases = [
+        ('before: render_template_string', '/__bench_legacy_index', {}),
+        ('after: identity', '/', {}),
+        ('after: gzip', '/', {'Accept-Encoding': 'gzip'}),
+        ('after: br', '/', {'Accept-Encoding': 'br, gzip'}),
+        ('after: 304 Not Modified', '/', {'Accept-Encoding': 'gzip', 'If-None-Match': etag}),
+    ]
+
+    print(f"{'case':<34} {'req/s':>10} {'bytes':>8} {'status':>6}")
+    for name, path, headers in cases:
+        rps, size, status = measure(client, path, headers, count)
+        print(f"{name:<34} {rps:>10.0f} {size:>8} {status:>6}")
+    if server.brotli is None:
+        print("(brotli не установлен: вариант br отдаётся как gzip)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Нагрузка от индикатора набора при 10k одновременно печатающих пользователей.
+
+Обработчик typing вызывается в контексте запроса от имени одного сокета, по
+очереди для каждого печатающего. Печатающий и зрители каналов - сокеты Engine.IO
+без сети с настоящими исходящими очередями сервера: тестовый клиент Flask-SocketIO
+подменяет отправку для всех сокетов и исказил бы замер.
+
+Замеряются принятый и отброшенный троттлингом вызов, рассылка одного окна склейки
+по всем каналам и, для сравнения, принятый вызов без склейки и send_message.
+Из них - доля одного ядра при устойчивой нагрузке: с троттлингом на клиенте
+(раз в TYPING_THROTTLE_MS) и с наивным клиентом, который шлёт событие на
+каждое нажатие клавиши.
+
+Запуск:
+    python benchmarks/bench_typing.py                     # 10k печатающих в 100 каналах по 50 зрителей
+    python benchmarks/bench_typing.py --channels 1 --viewers 500 --json
+"""
+import argparse
+import json
+import time
+
+from engineio import socket as engineio_socket
+
+from bench_core import git_revision, measure, seed, server, summarize
+
+KEYSTROKES_PER_SECOND = 5       # наивный клиент: событие на каждое нажатие
+
+
+class Audience:
+    """Очереди печатающего и зрителей его канала разбираются после каждого вызова, вне замера"""
+
+    def __init__(self, typer_socket, viewers):
+        self.typer_socket = typer_socket
+        self.viewers = viewers          # канал: [сокеты зрителей]
+        self.channel = None             # канал последнего вызова
+        self.delivered = 0
+
+    def drain(self, sockets):
+        for eio_socket in sockets:
+            while not eio_socket.queue.empty():
+                if server.outbound_event(eio_socket.queue.get_nowait()) == 'typing':
+                    self.delivered += 1
+
+    def get_received(self):
+        self.drain([self.typer_socket] + self.viewers.get(self.channel, []))
+
+    def drain_all(self):
+        self.drain([self.typer_socket])
+        for sockets in self.viewers.values():
+            self.drain(sockets)
+
+
+def open_socket(channel_id):
+    """Подключённый к пространству имён сокет без сети, открывший канал; вернуть (sid, сокет)"""
+    eio = server.socketio.server.eio
+    eio_sid = eio.generate_id()
+    eio_socket = eio.sockets[eio_sid] = engineio_socket.Socket(eio, eio_sid)
+    eio_socket.connected = True
+    sid = server.socketio.server.manager.connect(eio_sid, '/')
+    server.set_viewing(sid, channel_id)
+    return sid, eio_socket
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузка от индикатора набора')
+    parser.add_argument('--typers', type=int, default=10000, help='одновременно печатающих пользователей')
+    parser.add_argument('--channels', type=int, default=100, help='каналов, между которыми они распределены')
+    parser.add_argument('--viewers', type=int, default=50, help='зрителей в каждом канале')
+    parser.add_argument('--json', action='store_true', help='одна строка JSON вместо таблицы')
+    args = parser.parse_args()
+
+    server.LOG_LEVEL = 'WARNING'
+    server.setup_logging()
+    server.RATE_LIMITS.clear()
+    server.DEFAULT_RATE_LIMIT = {}
+    # Рассылку окна вызывает сам бенчмарк, фоновый поток не запускается
+    server.typing_flusher_started = True
+    seed(users=args.typers, messages=0, dms=0, groups=0, group_size=0, online=0)
+
+    # Сокет, от имени которого печатают все, и зрители каналов
+    channel_ids = [f'typing{index}' for index in range(args.channels)]
+    sid, typer_socket = open_socket(channel_ids[0])
+    typer = {'username': 'user0', 'user_id': '000000', 'joined_at': '2026-01-01T00:00:00'}
+    server.online_users[sid] = typer
+    audience = Audience(typer_socket, {channel_id: [open_socket(channel_id)[1] for _ in range(args.viewers)]
+                                       for channel_id in channel_ids})
+
+    def as_typer(index):
+        # Печатающий смотрит свой канал; комнату менять не нужно - рассылку он не получает
+        typer.update(username=f'user{index}', user_id=f'{index:06d}')
+        server.viewing[sid] = audience.channel = channel_ids[index % args.channels]
+        return audience.channel
+
+    def typing(index):
+        server.handle_typing({'channel': as_typer(index)})
+
+    def send(index):
+        server.handle_send_message({'channel': as_typer(index), 'channel_type': 'public', 'message': 'привет'})
+
+    stored_before = len(server.messages)
+    # Каждый печатающий дважды подряд: первый вызов принимается, повтор в окне отбрасывается
+    calls = measure(audience, sid, typing, [index for index in range(args.typers) for _ in range(2)])
+    accepted, throttled = calls[0::2], calls[1::2]
+    pending = sum(len(names) for names in server.pending_typing.values())
+    started = time.perf_counter()
+    server.send_typing()
+    flush_us = (time.perf_counter() - started) * 1e6
+    audience.drain_all()
+    stored = len(server.messages) - stored_before
+    delivered = audience.delivered
+    state_size = len(server.typing_state)
+
+    # Устойчивая нагрузка: каждый принимается раз в окно троттлинга, рассылка - раз в окно склейки
+    accepted_per_s = args.typers / (server.TYPING_THROTTLE_MS / 1000)
+    naive_per_s = args.typers * KEYSTROKES_PER_SECOND
+    coalesced_us = (accepted_per_s * summarize(accepted)['mean_us']
+                    + 1000 / server.TYPING_WINDOW_MS * flush_us)
+    throttled_us = (naive_per_s - accepted_per_s) * summarize(throttled)['mean_us']
+
+    # Для сравнения: без склейки каждый принятый вызов сразу рассылается зрителям канала
+    window_ms = server.TYPING_WINDOW_MS
+    server.typing_state.clear()
+    server.TYPING_WINDOW_MS = 0
+    immediate = measure(audience, sid, typing, range(min(args.typers, 2000)))
+    server.TYPING_WINDOW_MS = window_ms
+    # Сообщение в публичный канал уходит всем сокетам - вызовов меньше
+    sent = measure(audience, sid, send, range(min(args.typers, 200)))
+
+    load = {
+        'throttled client': {'calls_per_s': round(accepted_per_s), 'core_share': round(coalesced_us / 1e6, 3)},
+        'naive client': {'calls_per_s': naive_per_s, 'core_share': round((coalesced_us + throttled_us) / 1e6, 3)},
+        'throttled client, no coalescing': {
+            'calls_per_s': round(accepted_per_s),
+            'core_share': round(accepted_per_s * summarize(immediate)['mean_us'] / 1e6, 3)},
+    }
+    report = {
+        'revision': git_revision(),
+        'typers': args.typers,
+        'channels': args.channels,
+        'viewers_per_channel': args.viewers,
+        'throttle_ms': server.TYPING_THROTTLE_MS,
+        'window_ms': window_ms,
+        'cases': {
+            'typing: accepted': summarize(accepted),
+            'typing: throttled': summarize(throttled),
+            'typing: no coalescing': summarize(immediate),
+            'send_message (для сравнения)': summarize(sent),
+        },
+        'flush': {'pending_typers': pending, 'us': round(flush_us, 1)},
+        'steady_load': load,
+        'stored_in_messages': stored,
+        'typing_packets_delivered': delivered,
+        'typing_state_entries': state_size,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    print(f"revision {report['revision']}  typers={args.typers}  channels={args.channels}  "
+          f"viewers/channel={args.viewers}  throttle={report['throttle_ms']} ms  window={window_ms} ms")
+    print(f"{'case':<32} {'calls':>6} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10}")
+    for name, row in report['cases'].items():
+        print(f"{name:<32} {row['calls']:>6} {row['mean_us']:>10} {row['p50_us']:>10} "
+              f"{row['p99_us']:>10} {row['max_us']:>10}")
+    print(f"flush of {pending} typers in {args.channels} channels: {report['flush']['us']} us")
+    for name, row in load.items():
+        print(f"steady load, {name:<32} {row['calls_per_s']:>6} calls/s  {row['core_share']:.1%} of one core")
+    print(f"stored in messages: {stored}  typing packets delivered: {delivered}  "
+          f"typing_state entries: {state_size}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Бенчмарк размера пакета new_message и времени его кодирования для JSON и MessagePack.
+
+Сравниваются старая схема сообщения (все поля и ISO-время) и компактная
+(без полей по умолчанию, время в миллисекундах).
+
+Запуск: python benchmarks/bench_wire.py [число итераций]
+"""
+import datetime
+import sys
+import time
+
+from socketio import packet
+
+try:
+    from socketio import msgpack_packet
+except ImportError:
+    msgpack_packet = None
+
+
+def legacy_message(message_id):
+    """Сообщение в прежнем формате"""
+    return {
+        'id': message_id,
+        'username': 'alice',
+        'message': 'Привет! Как дела?',
+        'timestamp': datetime.datetime.now().isoformat(),
+        'type': 'message',
+        'channel': 'general',
+        'is_private': False,
+        'is_group': False,
+        'edited': False
+    }
+
+
+def compact_message(message_id):
+    """Сообщение в компактном формате"""
+    return {
+        'id': message_id,
+        'username': 'alice',
+        'message': 'Привет! Как дела?',
+        'timestamp': int(time.time() * 1000),
+        'channel': 'general'
+    }
+
+
+def measure(packet_class, message, count):
+    """Вернуть (байт на пакет, микросекунд на кодирование)"""
+    pkt = packet_class(packet.EVENT, data=['new_message', message])
+    size = len(pkt.encode())
+    started = time.perf_counter()
+    for _ in range(count):
+        packet_class(packet.EVENT, data=['new_message', message]).encode()
+    return size, (time.perf_counter() - started) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    serializers = [('json', packet.Packet)]
+    if msgpack_packet is not None:
+        serializers.append(('msgpack', msgpack_packet.MsgPackPacket))
+
+    print(f"{'serializer':<10} {'schema':<8} {'bytes':>6} {'us/msg':>8}")
+    for name, packet_class in serializers:
+        for schema, factory in (('legacy', legacy_message), ('compact', compact_message)):
+            size, micros = measure(packet_class, factory(123456), count)
+            print(f"{name:<10} {schema:<8} {size:>6} {micros:>8.2f}")
+    if msgpack_packet is None:
+        print("(msgpack не установлен: pip install msgpack)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""Нагрузочный тест: много клиентов python-socketio против локально запущенного server.py.
+
+Каждый виртуальный пользователь подключается, регистрируется, входит, заходит
+в публичный канал; часть пользователей создаёт личные чаты и группы. Затем все
+пишут сообщения с заданной частотой. Задержка считается от отправки до получения
+каждой копии сообщения (send -> receive), поэтому генератор лучше запускать на
+свободных ядрах: перегруженный клиент завышает цифры.
+
+Запуск:
+    python benchmarks/loadtest.py --users 200 --rate 0.5 --duration 30
+    python benchmarks/loadtest.py --users 500 --json > run.json   # для сравнения коммитов
+    python benchmarks/loadtest.py --url http://host:5000 --server-pid 1234
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUBLIC_CHANNELS = ['general', 'games', 'music', 'memes']
+
+# Сервер в отдельном процессе без админ-консоли и браузера; лимиты частоты
+# по умолчанию снимаются - все клиенты приходят с одного IP
+SERVER_BOOTSTRAP = '''
+import server
+server.LOG_LEVEL = 'WARNING'
+server.setup_logging()
+if {no_limits}:
+    server.RATE_LIMITS.clear()
+    server.DEFAULT_RATE_LIMIT = {{}}
+server.socketio.run(server.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)
+'''
+
+
+def percentile(values, share):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(share * len(values)))
+    return values[index]
+
+
+def read_rss(pid):
+    """Резидентная память процесса в МБ (Linux /proc, иначе psutil, если есть)"""
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 2 ** 20
+    except Exception:
+        return None
+
+
+class VirtualUser:
+    """Один подключённый пользователь и его входящие сообщения"""
+
+    def __init__(self, index, run, stats):
+        self.index = index
+        self.username = f'load{run}_{index}'
+        self.user_id = None
+        self.channel = random.choice(PUBLIC_CHANNELS)
+        self.chats = []             # (chat_id, channel_type) личных чатов и групп
+        self.stats = stats
+        self.registered = threading.Event()
+        self.authorized = threading.Event()
+        self.client = socketio.Client(reconnection=False)
+
+        self.client.on('register_success', lambda data: self.registered.set())
+        self.client.on('register_error', lambda data: self.registered.set())
+        self.client.on('auth_success', self.on_auth)
+        self.client.on('login_queued', self.on_queued)
+        self.client.on('new_message', self.on_message)
+        self.client.on('messages_batch', lambda data: [self.on_message(msg) for msg in data['messages']])
+        self.client.on('private_chat_created', lambda data: self.chats.append((data['chat_id'], 'private')))
+        self.client.on('group_created', lambda data: self.chats.append((data['chat_id'], 'group')))
+
+    def on_auth(self, data):
+        self.user_id = data['user_id']
+        self.authorized.set()
+
+    def on_queued(self, data):
+        # Запрос раньше паузы после входа - сервер вернул его, повторяем
+        if 'event' in data:
+            threading.Timer(data['retry_after_ms'] / 1000, self.client.emit, (data['event'], data['data'])).start()
+            return
+        # Сервер не допустил вход - повторяем через назначенную паузу
+        self.stats.count_queued()
+        credentials = {'username': self.username, 'password': 'load-test', 'attempt': data['attempt']}
+        threading.Timer(data['retry_after_ms'] / 1000, self.client.emit, ('login', credentials)).start()
+
+    def on_message(self, message):
+        parts = message.get('message', '').split()
+        if len(parts) == 3 and parts[0] == 'load':
+            self.stats.record(time.perf_counter() - float(parts[2]))
+
+    def connect(self, url, timeout):
+        """Подключиться, зарегистрироваться и войти; вернуть время в секундах"""
+        started = time.perf_counter()
+        self.client.connect(url, transports=['websocket'], wait_timeout=timeout)
+        credentials = {'username': self.username, 'password': 'load-test'}
+        self.client.emit('register', credentials)
+        self.registered.wait(timeout)
+        self.client.emit('login', credentials)
+        if not self.authorized.wait(timeout):
+            raise TimeoutError(f'{self.username}: нет auth_success')
+        self.client.emit('join_channel', {'channel_id': self.channel, 'channel_type': 'public'})
+        return time.perf_counter() - started
+
+    def send(self, dm_share):
+        """Отправить сообщение в публичный канал или в один из своих чатов"""
+        if self.chats and random.random() < dm_share:
+            channel, channel_type = random.choice(self.chats)
+        else:
+            channel, channel_type = self.channel, 'public'
+        self.client.emit('send_message', {
+            'channel': channel,
+            'channel_type': channel_type,
+            'message': f'load {self.index} {time.perf_counter()!r}'
+        })
+        self.stats.count_sent()
+
+
+class Stats:
+    """Счётчики прогона; пишутся из потоков клиентов"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.sent = 0
+        self.queued = 0
+        self.recording = False
+
+    def record(self, latency):
+        if self.recording:
+            with self.lock:
+                self.latencies.append(latency)
+
+    def count_sent(self):
+        with self.lock:
+            self.sent += 1
+
+    def count_queued(self):
+        with self.lock:
+            self.queued += 1
+
+
+def start_server(port, no_limits):
+    """Запустить server.py в дочернем процессе и дождаться ответа на /"""
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_BOOTSTRAP.format(port=port, no_limits=no_limits)],
+        cwd=SERVER_DIR, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('сервер завершился при запуске')
+        try:
+            urllib.request.urlopen(url + '/', timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('сервер не ответил за 30 секунд')
+
+
+def setup_chats(users, dm_users, group_users, group_size, timeout):
+    """Создать личные чаты и группы между уже вошедшими пользователями"""
+    for user in users[:dm_users]:
+        peer = random.choice(users)
+        if peer is not user:
+            user.client.emit('create_private_chat', {'target_user_id': peer.user_id})
+    for start in range(0, group_users, group_size):
+        members = users[start:start + group_size]
+        if len(members) > 1:
+            members[0].client.emit('create_group', {
+                'group_name': f'load{start}',
+                'members': [member.user_id for member in members[1:]]
+            })
+    # Ответы приходят асинхронно, ждём их недолго
+    deadline = time.time() + min(timeout, 5)
+    expected = min(dm_users, len(users)) + min(group_users, len(users))
+    while time.time() < deadline and sum(bool(user.chats) for user in users) < expected:
+        time.sleep(0.05)
+
+
+def sender(users, rate, dm_share, stop):
+    """Отправлять сообщения от группы пользователей с общей частотой rate * len(users)"""
+    if not users or rate <= 0:
+        return
+    interval = 1 / (rate * len(users))
+    next_send = time.perf_counter()
+    position = 0
+    while not stop.is_set():
+        users[position % len(users)].send(dm_share)
+        position += 1
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            stop.wait(delay)
+
+
+def disconnect(user):
+    try:
+        user.client.disconnect()
+    except Exception:
+        pass
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест мессенджера')
+    parser.add_argument('--users', type=int, default=100, help='число виртуальных пользователей')
+    parser.add_argument('--rate', type=float, default=0.5, help='сообщений в секунду на пользователя')
+    parser.add_argument('--duration', type=float, default=20, help='длительность отправки, секунд')
+    parser.add_argument('--dm-share', type=float, default=0.3, help='доля сообщений в личные чаты и группы')
+    parser.add_argument('--dm-users', type=int, default=None, help='сколько пользователей создают личный чат')
+    parser.add_argument('--group-size', type=int, default=10, help='участников в группе')
+    parser.add_argument('--connect-workers', type=int, default=20, help='параллельных подключений')
+    parser.add_argument('--senders', type=int, default=4, help='потоков-отправителей')
+    parser.add_argument('--url', default=None, help='адрес уже запущенного сервера')
+    parser.add_argument('--server-pid', type=int, default=None, help='PID внешнего сервера для замера памяти')
+    parser.add_argument('--port', type=int, default=5055, help='порт для локального сервера')
+    parser.add_argument('--keep-limits', action='store_true', help='не снимать лимиты частоты')
+    parser.add_argument('--timeout', type=float, default=15, help='таймаут входа, секунд')
+    parser.add_argument('--json', action='store_true', help='вывести результат одной JSON-строкой')
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        url, server_pid = args.url, args.server_pid
+    else:
+        process, url = start_server(args.port, not args.keep_limits)
+        server_pid = process.pid
+
+    stats = Stats()
+    run = random.randrange(10 ** 6)
+    users = [VirtualUser(index, run, stats) for index in range(args.users)]
+    rss_start = read_rss(server_pid)
+    rss_peak = rss_start or 0
+    try:
+        connected_at = time.perf_counter()
+        with ThreadPoolExecutor(args.connect_workers) as pool:
+            setup_times = sorted(pool.map(lambda user: user.connect(url, args.timeout), users))
+        connect_total = time.perf_counter() - connected_at
+
+        dm_users = args.users // 4 if args.dm_users is None else args.dm_users
+        setup_chats(users, dm_users, args.users // 2, args.group_size, args.timeout)
+
+        stop = threading.Event()
+        stats.recording = True
+        started = time.perf_counter()
+        slices = [users[index::args.senders] for index in range(args.senders)]
+        threads = [threading.Thread(target=sender, args=(chunk, args.rate, args.dm_share, stop),
+                                    daemon=True) for chunk in slices]
+        for thread in threads:
+            thread.start()
+        while time.perf_counter() - started < args.duration:
+            time.sleep(0.5)
+            rss_peak = max(rss_peak, read_rss(server_pid) or 0)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        # Даём долететь сообщениям, отправленным в последний момент
+        time.sleep(1)
+        stats.recording = False
+        elapsed = time.perf_counter() - started
+    finally:
+        rss_end = read_rss(server_pid)
+        # Закрытие сокета ждёт ответа сервера, поэтому отключаемся параллельно
+        with ThreadPoolExecutor(args.connect_workers) as pool:
+            list(pool.map(disconnect, users))
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+
+    latencies = sorted(stats.latencies)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    result = {
+        'revision': git_revision(),
+        'users': args.users,
+        'rate_per_user': args.rate,
+        'duration_s': round(elapsed, 2),
+        'sent': stats.sent,
+        'received': len(latencies),
+        'sent_per_s': round(stats.sent / elapsed, 1),
+        'received_per_s': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 0.5)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'p999': ms(percentile(latencies, 0.999)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+        'connect_ms': {
+            'p50': ms(percentile(setup_times, 0.5)),
+            'p99': ms(percentile(setup_times, 0.99)),
+            'mean': ms(statistics.mean(setup_times)),
+            'total_s': round(connect_total, 2),
+            'login_queued': stats.queued,
+        },
+        'server_rss_mb': {
+            'start': rss_start and round(rss_start, 1),
+            'peak': rss_peak and round(rss_peak, 1),
+            'end': rss_end and round(rss_end, 1),
+        },
+    }
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    print(f"Пользователей: {result['users']}, ревизия: {result['revision']}")
+    print(f"Подключение+вход: p50 {result['connect_ms']['p50']} мс, p99 {result['connect_ms']['p99']} мс, "
+          f"все за {result['connect_ms']['total_s']} с, повторов входа {result['connect_ms']['login_queued']}")
+    print(f"Отправлено: {result['sent']} ({result['sent_per_s']}/с), "
+          f"доставлено копий: {result['received']} ({result['received_per_s']}/с)")
+    latency = result['latency_ms']
+    print(f"Задержка send->receive: p50 {latency['p50']} мс, p99 {latency['p99']} мс, "
+          f"p999 {latency['p999']} мс, max {latency['max']} мс")
+    rss = result['server_rss_mb']
+    print(f"Память сервера (RSS): {rss['start']} -> пик {rss['peak']} -> {rss['end']} МБ")
+
+
+if __name__ == '__main__':
+    main()
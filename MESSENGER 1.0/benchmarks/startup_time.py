@@ -0,0 +1,115 @@
+"""Время запуска сервера: от старта процесса до первого принятого подключения.
+
+Сервер запускается в дочернем процессе так же, как в продакшене (python server.py
+с параметрами), и опрашивается, пока не ответит. Замеряются три момента:
+первое принятое TCP-подключение, первый ответ 200 на / и первое подключение
+Socket.IO по WebSocket. Запуск повторяется несколько раз, в отчёте медиана и максимум.
+
+Запуск:
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --runs 10 --json
+    python benchmarks/startup_time.py -- --async-mode threading --ping-interval 10
+Всё после -- передаётся серверу.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import socketio
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def poll(check, timeout):
+    """Повторять check, пока он не пройдёт; вернуть момент успеха или None"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if check():
+                return time.perf_counter()
+        except (OSError, http.client.HTTPException, socketio.exceptions.ConnectionError):
+            pass
+        time.sleep(0.002)
+    return None
+
+
+def tcp_accepts(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+        return True
+
+
+def http_ok(url):
+    with urllib.request.urlopen(url + '/', timeout=1) as response:
+        response.read()
+        return response.status == 200
+
+
+def socketio_connects(url, connected):
+    # Отключение клиента python-socketio бывает медленным - оно вне замера
+    client = socketio.Client(reconnection=False)
+    client.connect(url, transports=['websocket'], wait_timeout=2)
+    connected.append(client)
+    return True
+
+
+def run_once(port, server_args, timeout):
+    """Один запуск; вернуть миллисекунды до каждого из трёх моментов"""
+    url = f'http://127.0.0.1:{port}'
+    command = [sys.executable, 'server.py', '--host', '127.0.0.1', '--port', str(port),
+               '--no-console', '--control-socket', 'off', '--log-level', 'WARNING'] + server_args
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=SERVER_DIR, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    connected = []
+    try:
+        moments = {
+            'tcp_accept_ms': poll(lambda: tcp_accepts(port), timeout),
+            'http_ok_ms': poll(lambda: http_ok(url), timeout),
+            'socketio_connect_ms': poll(lambda: socketio_connects(url, connected), timeout),
+        }
+    finally:
+        for client in connected:
+            client.disconnect()
+        process.kill()
+        process.wait()
+    if None in moments.values():
+        raise RuntimeError(f'сервер не ответил за {timeout} с: {" ".join(command)}')
+    return {name: (moment - started) * 1000 for name, moment in moments.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время запуска сервера до первого подключения')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5097)
+    parser.add_argument('--timeout', type=float, default=30, help='секунд на один запуск')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER, help='параметры server.py после --')
+    args = parser.parse_args()
+    server_args = args.server_args[1:] if args.server_args[:1] == ['--'] else args.server_args
+
+    runs = [run_once(args.port, server_args, args.timeout) for _ in range(args.runs)]
+    report = {
+        'runs': args.runs,
+        'server_args': server_args,
+        'results': {name: {'median_ms': round(statistics.median(run[name] for run in runs), 1),
+                           'max_ms': round(max(run[name] for run in runs), 1)}
+                    for name in runs[0]}
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    print(f"runs {report['runs']}  server args: {' '.join(server_args) or '-'}")
+    print(f"{'moment':<22} {'median ms':>10} {'max ms':>10}")
+    for name, row in report['results'].items():
+        print(f"{name:<22} {row['median_ms']:>10} {row['max_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
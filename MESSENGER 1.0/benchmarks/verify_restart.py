@@ -0,0 +1,244 @@
+"""Проверка перезапуска без потерь: состояние до и после /restart совпадает.
+
+Скрипт запускает server.py в дочернем процессе с управляющим сокетом, наполняет
+состояние через настоящих клиентов (регистрация, личные чаты, группы, сообщения,
+правки, удаления, очистка канала, отметки о прочтении), снимает контрольные суммы,
+перезапускает сервер командой restart и сравнивает суммы после того, как клиенты
+переподключились по токену. Заодно измеряется время недоступности по HTTP.
+
+Запуск:
+    python benchmarks/verify_restart.py
+    python benchmarks/verify_restart.py --users 50 --messages 2000 --json
+Код выхода 1, если состояние не совпало или клиенты не восстановили сессии.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import socketio
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Этот же код выполнит и новый процесс после exec, уже с MESSENGER_RESTORE
+SERVER_BOOTSTRAP = '''
+import server
+server.LOG_LEVEL = 'WARNING'
+server.setup_logging()
+server.RATE_LIMITS.clear()
+server.DEFAULT_RATE_LIMIT = {{}}
+server.CONTROL_SOCKET = {control!r}
+server.SNAPSHOT_PATH = {snapshot!r}
+server.restore_from_env()
+server.start_control_socket()
+server.socketio.run(server.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)
+'''
+
+
+def control(path, command):
+    """Один запрос к управляющему сокету"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(command).encode() + b'\n')
+        with connection.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
+def wait_for(predicate, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class User:
+    """Клиент, который запоминает токен и переподключается с ним"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.token = None
+        self.user_id = None
+        self.resumed = threading.Event()
+        self.registered = threading.Event()
+        self.authorized = threading.Event()
+        self.chats = []             # (chat_id, channel_type)
+        self.received = []
+        self.client = socketio.Client(reconnection_delay=0.1, reconnection_delay_max=0.5)
+        self.client.on('auth_success', self.on_auth)
+        self.client.on('register_success', lambda data: self.registered.set())
+        self.client.on('private_chat_created', lambda data: self.chats.append((data['chat_id'], 'private')))
+        self.client.on('group_created', lambda data: self.chats.append((data['chat_id'], 'group')))
+        self.client.on('new_message', self.received.append)
+        self.client.on('login_queued', self.on_queued)
+
+    def on_auth(self, data):
+        self.token = data['session_token']
+        self.user_id = data['user_id']
+        if data['resumed']:
+            self.resumed.set()
+        self.authorized.set()
+
+    def on_queued(self, data):
+        # Вход по токену ждёт допуска, как и по паролю
+        if data.get('resume'):
+            threading.Timer(data['retry_after_ms'] / 1000, self.client.emit,
+                            ('resume_session', {'token': self.token, 'attempt': data['attempt']})).start()
+
+    def start(self):
+        self.client.connect(self.url, transports=['websocket'],
+                            auth=lambda: {'token': self.token} if self.token else {})
+        credentials = {'username': self.name, 'password': 'restart-test'}
+        # Обработчики выполняются параллельно - вход только после ответа на регистрацию
+        self.client.emit('register', credentials)
+        if not self.registered.wait(10):
+            raise TimeoutError(f'{self.name}: нет register_success')
+        self.client.emit('login', credentials)
+        if not self.authorized.wait(10):
+            raise TimeoutError(f'{self.name}: нет auth_success')
+
+    def send(self, channel, channel_type, text):
+        self.client.emit('send_message', {'channel': channel, 'channel_type': channel_type, 'message': text})
+
+
+def populate(users, message_count, rng):
+    """Наполнить состояние сервера разнообразными изменениями"""
+    for user, peer in zip(users, users[1:]):
+        user.client.emit('create_private_chat', {'target_user_id': peer.user_id})
+    users[0].client.emit('create_group', {'group_name': 'restart', 'members': [user.user_id for user in users[1:]]})
+    wait_for(lambda: all(user.chats for user in users), 5)
+
+    for index in range(message_count):
+        user = rng.choice(users)
+        if user.chats and rng.random() < 0.4:
+            chat, channel_type = rng.choice(user.chats)
+            user.send(chat, channel_type, f'личное {index}')
+        else:
+            user.send(rng.choice(['general', 'games', 'music']), 'public', f'сообщение {index} {rng.random()}')
+    time.sleep(1)
+
+    # Правки, удаления, отметки о прочтении и очистка канала
+    own = [(user, message) for user in users for message in user.received
+           if message['username'] == user.name and message['channel'] == 'general']
+    for user, message in own[:20]:
+        user.client.emit('edit_message', {'message_id': message['id'], 'channel': 'general', 'message': 'правка'})
+    for user, message in own[20:30]:
+        user.client.emit('delete_message', {'message_id': message['id'], 'channel': 'general'})
+    for user in users:
+        last = [message for message in user.received if message['channel'] == 'games']
+        if last:
+            user.client.emit('mark_read', {'cursors': {'games': last[-1]['id']}})
+    users[0].client.emit('clear_history', {'channel': 'music'})
+    time.sleep(1)
+
+
+def http_ok(url):
+    try:
+        with urllib.request.urlopen(url + '/', timeout=1) as response:
+            response.read()
+            return response.status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+def measure_downtime(url, stop, result):
+    """Самый длинный промежуток между успешными ответами на / во время перезапуска"""
+    last_ok = time.perf_counter()
+    longest = 0
+    while not stop.is_set():
+        if http_ok(url):
+            now = time.perf_counter()
+            longest = max(longest, now - last_ok)
+            last_ok = now
+        time.sleep(0.005)
+    result['downtime_s'] = longest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка перезапуска без потери состояния')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='messenger-restart-')
+    control_path = os.path.join(workdir, 'control.sock')
+    bootstrap = SERVER_BOOTSTRAP.format(control=control_path, snapshot=os.path.join(workdir, 'state.snapshot'),
+                                        port=args.port)
+    process = subprocess.Popen([sys.executable, '-c', bootstrap], cwd=SERVER_DIR,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{args.port}'
+    users = []
+    try:
+        if not wait_for(lambda: os.path.exists(control_path), 30):
+            raise RuntimeError('сервер не запустился')
+        if not wait_for(lambda: http_ok(url), 10):
+            raise RuntimeError('сервер не отвечает по HTTP')
+
+        users = [User(f'restart{index}', url) for index in range(max(args.users, 2))]
+        for user in users:
+            user.start()
+        populate(users, args.messages, random.Random(1))
+        before = control(control_path, {'cmd': 'state_digest'})
+
+        stop, downtime = threading.Event(), {}
+        watcher = threading.Thread(target=measure_downtime, args=(url, stop, downtime))
+        watcher.start()
+        started = time.perf_counter()
+        control(control_path, {'cmd': 'restart'})
+        resumed = wait_for(lambda: all(user.resumed.is_set() for user in users), 30)
+        resume_s = time.perf_counter() - started
+        time.sleep(0.5)
+        stop.set()
+        watcher.join()
+
+        after = control(control_path, {'cmd': 'state_digest'})
+        mismatched = sorted(name for name in before['digest'] if before['digest'][name] != after['digest'].get(name))
+
+        # После перезапуска сообщения доставляются, нумерация продолжается
+        count = len(users[1].received)
+        users[0].send('general', 'public', 'после перезапуска')
+        delivered = wait_for(lambda: len(users[1].received) > count, 5)
+
+        report = {
+            'users': len(users),
+            'messages': args.messages,
+            'same_pid': before['pid'] == after['pid'],
+            'state_equal': not mismatched,
+            'mismatched': mismatched,
+            'sessions_resumed': resumed,
+            'delivered_after_restart': delivered,
+            'downtime_ms': round(downtime.get('downtime_s', 0) * 1000, 1),
+            'all_resumed_ms': round(resume_s * 1000, 1),
+        }
+    finally:
+        for user in users:
+            try:
+                user.client.disconnect()
+            except Exception:
+                pass
+        process.kill()
+
+    ok = report['state_equal'] and report['sessions_resumed'] and report['delivered_after_restart']
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for name, value in report.items():
+            print(f'{name}: {value}')
+        print('OK' if ok else 'FAIL')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,246 @@
-from flask import Flask, render_template_string, request
+from flask import Flask, Response, abort, render_template_string, request
 from flask_socketio import SocketIO, emit, disconnect
+import argparse
+import atexit
+import bisect
+import contextlib
 import datetime
+import gzip
 import hashlib
+import heapq
+import itertools
+import json
+import logging
+import logging.handlers
+import math
+import os
+import pickle
+import queue
+import re
 import secrets
+import socketserver
 import threading
 import webbrowser
 import sys
 import time
 import random
 import string
+from collections import OrderedDict, deque
+
+try:
+    import brotli  # необязательная зависимость: pip install brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack  # нужен только для SOCKETIO_SERIALIZER = 'msgpack'
+except ImportError:
+    msgpack = None
+
+try:
+    import simple_websocket.ws
+    from wsproto.extensions import PerMessageDeflate
+    from wsproto.frame_protocol import Opcode
+except ImportError:
+    PerMessageDeflate = None
+
+from engineio import packet as engineio_packet
+
+# ==================== КОНФИГУРАЦИЯ ЗАПУСКА ====================
+# Параметры берутся из командной строки, затем из переменных окружения MESSENGER_*,
+# затем из значений по умолчанию. При импорте модуля (бенчмарки, тесты) командная
+# строка не читается - только окружение
+# Отсчёт после импортов; полное время до первого подключения - benchmarks/startup_time.py
+PROCESS_STARTED = time.perf_counter()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+def parse_config(argv):
+    """Разобрать параметры запуска сервера"""
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description='Сервер MessengerProsto')
+    parser.add_argument('--host', default=env('MESSENGER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(env('MESSENGER_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(env('MESSENGER_WORKERS', 1)),
+                        help='процессов; состояние живёт в памяти, поэтому поддерживается только 1')
+    parser.add_argument('--async-mode', choices=ASYNC_MODES, default=env('MESSENGER_ASYNC_MODE', 'threading'))
+    parser.add_argument('--log-level', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        default=env('MESSENGER_LOG_LEVEL', 'INFO').upper())
+    parser.add_argument('--log-file', default=env('MESSENGER_LOG_FILE'), help='по умолчанию stderr')
+    parser.add_argument('--ping-interval', type=float, default=float(env('MESSENGER_PING_INTERVAL', 25)),
+                        help='секунд между проверками соединения')
+    parser.add_argument('--ping-timeout', type=float, default=float(env('MESSENGER_PING_TIMEOUT', 20)),
+                        help='секунд ожидания ответа на проверку')
+    parser.add_argument('--snapshot', default=env('MESSENGER_SNAPSHOT', os.path.join(BASE_DIR, 'state.snapshot')),
+                        help='файл снимка состояния для /restart')
+    parser.add_argument('--control-socket', default=env('MESSENGER_CONTROL_SOCKET', os.path.join(BASE_DIR, 'messenger.sock')),
+                        help="Unix-сокет для adminctl.py; 'off' - выключен")
+    parser.add_argument('--console', action=argparse.BooleanOptionalAction, default=None,
+                        help='админ-панель в терминале; по умолчанию - если stdin терминал')
+    parser.add_argument('--dev', action='store_true', default=env('MESSENGER_DEV') == '1',
+                        help='режим разработки: debug Flask и открытие браузера')
+    config = parser.parse_args(argv)
+    
+    # Пользователи, чаты и история - в памяти процесса: второй процесс видел бы своё состояние
+    if config.workers != 1:
+        parser.error('--workers: поддерживается только 1 процесс, состояние хранится в памяти')
+    if config.async_mode != 'threading':
+        try:
+            __import__(config.async_mode)
+        except ImportError:
+            parser.error(f'--async-mode {config.async_mode}: пакет не установлен (pip install {config.async_mode})')
+    if config.control_socket.lower() in ('', 'off', 'none'):
+        config.control_socket = None
+    if config.console is None:
+        config.console = sys.stdin is not None and sys.stdin.isatty()
+    return config
+
+CONFIG = parse_config(sys.argv[1:] if __name__ == '__main__' else [])
+
+# eventlet и gevent заменяют потоки и блокировки зелёными; это нужно сделать
+# до создания блокировок ниже
+if CONFIG.async_mode == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif CONFIG.async_mode == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
 
 # ==================== НАСТРОЙКА ====================
-app = Flask(__name__)
+# Статика клиента отдаётся через /assets с хэшем в имени, встроенный /static не нужен
+app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = secrets.token_hex(32)
 
-# Используем threading для Python 3.12
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+class MessengerSocketIO(SocketIO):
+    """SocketIO с общей точкой входа для всех событий"""
+
+    def _handle_event(self, handler, message, namespace, sid, *args):
+        # Во время перезапуска состояние уже сохраняется - события не принимаются
+        if restart_state['draining'] and message not in ('connect', 'disconnect'):
+            return None
+        # Лимиты проверяются до создания контекста запроса и до логики обработчика
+        if not check_rate_limit(message, sid, self.server.get_environ(sid, namespace=namespace)):
+            return None
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super()._handle_event(handler, message, namespace, sid, *args)
+            failed = False
+            return result
+        finally:
+            observe_event(message, time.perf_counter() - started, failed)
+
+    def emit(self, event, *args, **kwargs):
+        # Размер рассылки: все сокеты пространства имён или участники комнаты
+        room = kwargs.get('to') or kwargs.get('room')
+        rooms = self.server.manager.rooms.get(kwargs.get('namespace') or '/', {})
+        observe_fanout(event, len(rooms.get(room, ())))
+        return super().emit(event, *args, **kwargs)
+
+# Формат пакетов: 'json' или 'msgpack' (нужен pip install msgpack)
+SOCKETIO_SERIALIZER = 'json'
+
+# Сжатие: кадры WebSocket и ответы long-polling меньше порога уходят без сжатия
+WS_COMPRESSION_ENABLED = True
+WS_COMPRESSION_THRESHOLD = 1024  # байт
+
+socketio = MessengerSocketIO(app, cors_allowed_origins="*", async_mode=CONFIG.async_mode,
+                             ping_interval=CONFIG.ping_interval, ping_timeout=CONFIG.ping_timeout,
+                             serializer='msgpack' if SOCKETIO_SERIALIZER == 'msgpack' else 'default',
+                             http_compression=WS_COMPRESSION_ENABLED,
+                             compression_threshold=WS_COMPRESSION_THRESHOLD)
+
+# ==================== ЛОГИРОВАНИЕ ====================
+# Обработчики только кладут запись в очередь, в файл/stderr пишет фоновый поток.
+# Формат - JSON-строки; текст сообщений пользователей в лог не попадает
+LOG_LEVEL = CONFIG.log_level    # DEBUG включает записи о частых событиях
+LOG_FILE = CONFIG.log_file      # None - писать в stderr
+LOG_QUEUE_SIZE = 10000          # при переполнении записи отбрасываются, обработчик не ждёт
+LOG_SAMPLE_EVERY = {            # частые события: писать каждое N-е
+    'send_message': 100,
+    'join_channel': 10,
+}
+
+logger = logging.getLogger('messenger')
+log_stats = {'dropped': 0}
+log_counters = {event: itertools.count(1) for event in LOG_SAMPLE_EVERY}
+log_listener = None
+
+class JsonLinesFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': getattr(record, 'event', record.getMessage()),
+            'thread': record.threadName
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Очередь без ожидания: форматирование - в фоновом потоке, лишние записи отбрасываются"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # Очередь без предела, чтобы при остановке всегда влезал сигнал завершения
+        if self.queue.qsize() >= LOG_QUEUE_SIZE:
+            log_stats['dropped'] += 1
+            return
+        self.queue.put_nowait(record)
+
+def setup_logging():
+    """Подключить очередь логов и запустить фоновую запись"""
+    global log_listener
+    if LOG_FILE:
+        output = logging.FileHandler(LOG_FILE, encoding='utf-8')
+    else:
+        output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonLinesFormatter())
+    
+    log_queue = queue.Queue()
+    logger.handlers[:] = [DroppingQueueHandler(log_queue)]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    
+    stop_logging()
+    log_listener = logging.handlers.QueueListener(log_queue, output)
+    log_listener.start()
+
+@atexit.register
+def stop_logging():
+    """Дописать оставшиеся записи и остановить фоновый поток"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+def log_event(level, event, **fields):
+    """Записать событие; при выключенном уровне почти ничего не стоит"""
+    if not logger.isEnabledFor(level):
+        return
+    every = LOG_SAMPLE_EVERY.get(event)
+    if every:
+        if next(log_counters[event]) % every:
+            return
+        fields['sample_every'] = every
+    logger.log(level, event, extra={'event': event, 'fields': fields})
+
+setup_logging()
 
 # ==================== БАЗА ДАННЫХ ====================
 users_db = {}           # username: {password_hash, user_id, created_at, banned, muted_until, admin}
 online_users = {}       # socket_id: {username, user_id}
-messages = []           # все сообщения с id, username, message, timestamp, channel, type, is_private
+user_sessions = {}      # username: {socket_id: None} - все устройства, с которых вошёл пользователь
+usernames_by_id = {}    # user_id: username
+presence_hold = {'depth': 0, 'pending': False}  # отложенная рассылка присутствия при массовых действиях
+presence_lock = threading.Lock()
+messages = []           # сообщения: id, username, message, timestamp (мс), channel; type/is_private/is_group/edited - только не по умолчанию
 private_chats = {}      # chat_id: {name: str, users: [user_id1, user_id2], created_at: str, creator_id: str, type: 'private'}
 group_chats = {}        # chat_id: {name: str, users: [user_id1, ...], creator_id: str, created_at: str, type: 'group'}
 
@@ -37,7 +257,7 @@ def generate_user_id():
     """Генерация уникального ID пользователя (6 цифр)"""
     while True:
         user_id = ''.join(random.choices(string.digits, k=6))
-        if not any(user['user_id'] == user_id for user in users_db.values()):
+        if user_id not in usernames_by_id:
             return user_id
 
 def generate_chat_id():
@@ -71,19 +291,17 @@ def is_user_muted(username):
 
 def broadcast_system_message(message):
     """Отправка системного сообщения всем"""
-    system_msg = {
-        'id': len(messages) + 1,
+    system_msg = store_message({
         'username': 'SYSTEM',
         'message': message,
-        'timestamp': datetime.datetime.now().isoformat(),
+        'timestamp': now_ms(),
         'type': 'system',
         'channel': 'general'
-    }
-    messages.append(system_msg)
-    socketio.emit('new_message', system_msg, broadcast=True)
+    })
+    deliver_message(system_msg)
 
-def update_online_users():
-    """Обновить список онлайн пользователей для всех клиентов"""
+def update_online_users(to=None):
+    """Обновить список онлайн пользователей для всех клиентов или одного сокета"""
     users_list = []
     for sid, user_data in online_users.items():
         users_list.append({
@@ -91,552 +309,1399 @@ def update_online_users():
             'user_id': user_data['user_id'],
             'socket_id': sid
         })
-    socketio.emit('users_update', {'users': users_list}, broadcast=True)
+    socketio.emit('users_update', {'users': users_list}, to=to)
+
+@contextlib.contextmanager
+def presence_batch():
+    """Копить объявления и обновления списка онлайн внутри блока, отправить одно в конце"""
+    with presence_lock:
+        presence_hold['depth'] += 1
+    try:
+        yield
+    finally:
+        with presence_lock:
+            presence_hold['depth'] -= 1
+            flush = presence_hold['depth'] == 0 and presence_hold['pending']
+            if flush:
+                presence_hold['pending'] = False
+        if flush:
+            send_presence()
 
 def get_user_by_id(user_id):
     """Найти пользователя по ID"""
-    for username, data in users_db.items():
-        if data.get('user_id') == user_id:
-            return username, data
-    return None, None
+    username = usernames_by_id.get(user_id)
+    if username is None:
+        return None, None
+    return username, users_db[username]
+
+def add_session(sid, username):
+    """Запомнить подключение пользователя; вернуть True, если это его первое устройство"""
+    remove_session(sid)
+    online_users[sid] = {
+        'username': username,
+        'user_id': users_db[username]['user_id'],
+        'joined_at': datetime.datetime.now().isoformat()
+    }
+    sessions = user_sessions.setdefault(username, {})
+    sessions[sid] = None
+    return len(sessions) == 1
+
+def remove_session(sid):
+    """Забыть подключение; вернуть (имя, остались ли у пользователя другие устройства)"""
+    user_data = online_users.pop(sid, None)
+    if user_data is None:
+        return None, False
+    stop_viewing(sid)
+    username = user_data['username']
+    sessions = user_sessions.get(username, {})
+    sessions.pop(sid, None)
+    if not sessions:
+        user_sessions.pop(username, None)
+    return username, bool(sessions)
+
+def get_sessions(username):
+    """Все подключения пользователя по имени"""
+    return list(user_sessions.get(username, ()))
 
-def get_next_message_id():
-    """Получить следующий ID сообщения"""
-    return len(messages) + 1
+def now_ms():
+    """Текущее время в миллисекундах для меток сообщений"""
+    return int(time.time() * 1000)
 
 def is_user_admin(username):
     """Проверка, является ли пользователь админом"""
     return username in users_db and users_db[username].get('admin', False)
 
-# ==================== HTML ШАБЛОН ====================
-HTML = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>MessengerProsto</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Arial, sans-serif;
-        }
-        
-        body {
-            background: #1a1a1a;
-            color: #fff;
-            height: 100vh;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            padding: 20px;
-        }
-        
-        .container {
-            width: 100%;
-            max-width: 1200px;
-            height: 95vh;
-            background: #2d2d2d;
-            border-radius: 10px;
-            overflow: hidden;
-            display: flex;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-        }
-        
-        /* Сайдбар */
-        .sidebar {
-            width: 250px;
-            background: #252525;
-            padding: 20px;
-            overflow-y: auto;
-        }
-        
-        .logo {
-            text-align: center;
-            margin-bottom: 30px;
-            padding-bottom: 20px;
-            border-bottom: 1px solid #444;
-        }
-        
-        .logo h1 {
-            font-size: 24px;
-            color: #7289da;
-            margin-bottom: 5px;
-        }
-        
-        .logo p {
-            color: #999;
-            font-size: 14px;
-        }
-        
-        .user-info {
-            text-align: center;
-            margin-bottom: 20px;
-            padding: 10px;
-            background: #363636;
-            border-radius: 5px;
-        }
-        
-        .user-id {
-            font-size: 12px;
-            color: #43b581;
-            margin-top: 5px;
-        }
-        
-        .section {
-            margin-bottom: 25px;
-        }
-        
-        .section h3 {
-            color: #888;
-            font-size: 12px;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-            margin-bottom: 10px;
-        }
-        
-        .channel {
-            padding: 10px;
-            margin: 5px 0;
-            border-radius: 5px;
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            transition: background 0.2s;
-        }
-        
-        .channel:hover {
-            background: #363636;
-        }
-        
-        .channel.active {
-            background: #363636;
-            border-left: 3px solid #7289da;
-        }
-        
-        .channel-icon {
-            margin-right: 10px;
-            font-size: 18px;
-        }
-        
-        .channel-private {
-            color: #f04747;
-        }
-        
-        .channel-group {
-            color: #faa61a;
-        }
-        
-        .channel-actions {
-            display: flex;
-            gap: 5px;
-        }
-        
-        .channel-btn {
-            background: none;
-            border: none;
-            color: #999;
-            cursor: pointer;
-            padding: 2px 5px;
-            border-radius: 3px;
-            font-size: 12px;
-        }
-        
-        .channel-btn:hover {
-            background: #40444b;
-        }
-        
-        .user-list {
-            margin-top: 20px;
-        }
-        
-        .user-item {
-            padding: 8px;
-            margin: 3px 0;
-            border-radius: 5px;
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-        }
-        
-        .user-status {
-            width: 8px;
-            height: 8px;
-            border-radius: 50%;
-            margin-right: 10px;
-        }
-        
-        .user-status.online {
-            background: #43b581;
-        }
-        
-        .user-status.offline {
-            background: #747f8d;
-        }
-        
-        .user-id-badge {
-            font-size: 10px;
-            background: #7289da;
-            padding: 2px 6px;
-            border-radius: 10px;
-            color: white;
-        }
-        
-        /* Основная область */
-        .main-area {
-            flex: 1;
-            display: flex;
-            flex-direction: column;
-        }
-        
-        /* Заголовок чата */
-        .chat-header {
-            padding: 20px;
-            background: #363636;
-            border-bottom: 1px solid #444;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        
-        .chat-header h2 {
-            font-size: 18px;
-        }
-        
-        .chat-info {
-            color: #999;
-            font-size: 14px;
-        }
-        
-        .chat-actions {
-            display: flex;
-            gap: 10px;
-        }
-        
-        /* Сообщения */
-        .messages-container {
-            flex: 1;
-            padding: 20px;
-            overflow-y: auto;
-            background: #2d2d2d;
-        }
-        
-        .message {
-            margin-bottom: 20px;
-            padding: 10px;
-            border-radius: 5px;
-            background: #363636;
-            position: relative;
-        }
-        
-        .message:hover {
-            background: #3a3a3a;
-        }
-        
-        .message.system {
-            background: #3a3a3a;
-            border-left: 3px solid #7289da;
-        }
-        
-        .message.private {
-            background: #3a2e3a;
-            border-left: 3px solid #f04747;
-        }
-        
-        .message.group {
-            background: #3a3a2e;
-            border-left: 3px solid #faa61a;
-        }
-        
-        .message-header {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 5px;
-            font-size: 14px;
-        }
-        
-        .message-username {
-            font-weight: bold;
-            color: #7289da;
-        }
-        
-        .message.system .message-username {
-            color: #f04747;
-        }
-        
-        .message.private .message-username {
-            color: #ff73fd;
-        }
-        
-        .message.group .message-username {
-            color: #ffcc00;
-        }
-        
-        .message-time {
-            color: #999;
-            font-size: 12px;
-        }
-        
-        .message-text {
-            line-height: 1.4;
-            word-wrap: break-word;
-            padding-right: 30px;
-        }
-        
-        .message-edited {
-            font-size: 11px;
-            color: #999;
-            font-style: italic;
-            margin-left: 5px;
-        }
-        
-        .message-actions {
-            position: absolute;
-            top: 5px;
-            right: 5px;
-            display: none;
-            gap: 5px;
-        }
-        
-        .message:hover .message-actions {
-            display: flex;
-        }
-        
-        .message-btn {
-            background: #40444b;
-            border: none;
-            color: #fff;
-            cursor: pointer;
-            padding: 3px 6px;
-            border-radius: 3px;
-            font-size: 11px;
-        }
-        
-        .message-btn:hover {
-            background: #7289da;
-        }
-        
-        .message-btn.delete {
-            background: #f04747;
-        }
-        
-        .message-btn.delete:hover {
-            background: #d84040;
-        }
-        
-        /* Поле ввода */
-        .input-area {
-            padding: 20px;
-            background: #363636;
-            border-top: 1px solid #444;
-        }
-        
-        .input-container {
-            display: flex;
-            gap: 10px;
-        }
-        
-        #message-input {
-            flex: 1;
-            padding: 15px;
-            background: #40444b;
-            border: none;
-            border-radius: 5px;
-            color: white;
-            font-size: 16px;
-            resize: none;
-            min-height: 50px;
-            max-height: 150px;
-        }
-        
-        #message-input:focus {
-            outline: none;
-        }
-        
-        #message-input:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-        }
-        
-        #send-btn {
-            padding: 0 25px;
-            background: #7289da;
-            color: white;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            font-weight: bold;
-            transition: background 0.2s;
-        }
-        
-        #send-btn:hover {
-            background: #677bc4;
-        }
-        
-        #send-btn:disabled {
-            background: #4a4f5c;
-            cursor: not-allowed;
-        }
-        
-        /* Экран входа */
-        .login-screen {
-            width: 100%;
-            max-width: 400px;
-            background: #2d2d2d;
-            padding: 40px;
-            border-radius: 10px;
-            text-align: center;
-        }
-        
-        .login-screen h1 {
-            color: #7289da;
-            margin-bottom: 30px;
-        }
-        
-        .login-input {
-            width: 100%;
-            padding: 15px;
-            margin-bottom: 15px;
-            background: #40444b;
-            border: none;
-            border-radius: 5px;
-            color: white;
-            font-size: 16px;
-        }
-        
-        .login-btn {
-            width: 100%;
-            padding: 15px;
-            background: #7289da;
-            color: white;
-            border: none;
-            border-radius: 5px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            margin-bottom: 10px;
-        }
-        
-        .login-btn:hover {
-            background: #677bc4;
-        }
-        
-        .btn-green {
-            background: #43b581 !important;
-        }
-        
-        .btn-green:hover {
-            background: #3ca374 !important;
-        }
-        
-        .btn-red {
-            background: #f04747 !important;
-        }
-        
-        .btn-red:hover {
-            background: #d84040 !important;
-        }
-        
-        .btn-orange {
-            background: #faa61a !important;
-        }
-        
-        .btn-orange:hover {
-            background: #e69518 !important;
-        }
-        
-        .btn-purple {
-            background: #9b59b6 !important;
-        }
-        
-        .btn-purple:hover {
-            background: #8e44ad !important;
-        }
-        
-        .error-message {
-            color: #f04747;
-            margin-top: 10px;
-            font-size: 14px;
-        }
-        
-        .success-message {
-            color: #43b581;
-            margin-top: 10px;
-            font-size: 14px;
-        }
-        
-        .hidden {
-            display: none !important;
-        }
-        
-        /* Модальное окно */
-        .modal {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0,0,0,0.8);
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            z-index: 1000;
-        }
-        
-        .modal-content {
-            background: #2d2d2d;
-            padding: 30px;
-            border-radius: 10px;
-            width: 90%;
-            max-width: 400px;
-        }
-        
-        .modal-title {
-            margin-bottom: 20px;
-            color: #7289da;
-        }
-        
-        .modal-input {
-            width: 100%;
-            padding: 12px;
-            margin-bottom: 15px;
-            background: #40444b;
-            border: none;
-            border-radius: 5px;
-            color: white;
-            font-size: 16px;
-        }
-        
-        .modal-buttons {
-            display: flex;
-            gap: 10px;
-            margin-top: 20px;
-        }
-        
-        /* Полоса прокрутки */
-        ::-webkit-scrollbar {
-            width: 8px;
-        }
-        
-        ::-webkit-scrollbar-track {
-            background: #2d2d2d;
-        }
-        
-        ::-webkit-scrollbar-thumb {
-            background: #202225;
-            border-radius: 4px;
-        }
+def can_read_channel(user_id, channel_id):
+    """Может ли пользователь читать историю канала"""
+    if channel_id in private_chats:
+        return user_id in private_chats[channel_id]['users']
+    if channel_id in group_chats:
+        return user_id in group_chats[channel_id]['users']
+    return any(channel['id'] == channel_id for channel in channels)
+
+# ==================== СИНХРОНИЗАЦИЯ ИСТОРИИ ====================
+# ID сообщений и номера правок/удалений берутся из одной возрастающей
+# последовательности, поэтому клиенту достаточно помнить последний номер
+HISTORY_LIMIT = 50              # сообщений в полной истории канала
+SYNC_SCAN_LIMIT = 5000          # сообщений, просматриваемых при поиске дельты
+HISTORY_CHANGES_LIMIT = 10000   # сколько последних правок/удалений помнит сервер
+SERVER_EPOCH = secrets.token_hex(8)  # номера из другого запуска сервера недействительны
+
+last_seq = 0
+history_changes = deque()       # {seq, channel, kind: edit/delete/clear, message_id, message}
+changes_floor = 0               # seq последнего забытого изменения
+history_lock = threading.Lock()
+
+def store_message(message):
+    """Присвоить сообщению ID и сохранить его"""
+    global last_seq
+    with history_lock:
+        last_seq += 1
+        message['id'] = last_seq
+        messages.append(message)
+        channel_message_ids.setdefault(message['channel'], []).append(last_seq)
+    return message
+
+def record_change(channel, kind, message_id=None, text=None):
+    """Записать правку, удаление или очистку канала; вернуть её номер"""
+    with history_lock:
+        return append_change(channel, kind, message_id, text)
+
+def append_change(channel, kind, message_id=None, text=None):
+    """Добавить изменение в журнал; под history_lock"""
+    global last_seq, changes_floor
+    last_seq += 1
+    if len(history_changes) >= HISTORY_CHANGES_LIMIT:
+        changes_floor = history_changes.popleft()['seq']
+    change = {'seq': last_seq, 'channel': channel, 'kind': kind}
+    if message_id is not None:
+        change['message_id'] = message_id
+    if text is not None:
+        change['message'] = text
+    history_changes.append(change)
+    return last_seq
+
+def remove_message(message):
+    """Удалить сообщение из истории и записать удаление; вернуть номер или None, если его уже нет"""
+    with history_lock:
+        position = bisect.bisect_left(messages, message['id'], key=lambda msg: msg['id'])
+        if position == len(messages) or messages[position] is not message:
+            return None
+        del messages[position]
+        forget_channel_message(message['channel'], message['id'])
+        return append_change(message['channel'], 'delete', message['id'])
+
+def clear_channel_messages(channel):
+    """Удалить все сообщения канала и записать очистку; вернуть её номер"""
+    with history_lock:
+        # Список фильтруется на месте и под блокировкой, как и добавление в него, -
+        # сообщение, сохранённое в это же время, не потеряется
+        messages[:] = [msg for msg in messages if msg.get('channel') != channel]
+        clear_read_counters(channel)
+        seq = append_change(channel, 'clear')
+    drop_search_index(channel)
+    return seq
+
+def get_history_delta(channel, cursor):
+    """Новые сообщения и изменения канала после cursor; None - нужна полная история"""
+    with history_lock:
+        if cursor > last_seq or cursor < changes_floor:
+            return None
+        
+        new_messages = []
+        for scanned, msg in enumerate(reversed(messages)):
+            if msg['id'] <= cursor:
+                break
+            if scanned >= SYNC_SCAN_LIMIT:
+                return None
+            if msg.get('channel') == channel:
+                new_messages.append(msg)
+                if len(new_messages) > HISTORY_LIMIT:
+                    return None
+        
+        changes = []
+        for change in reversed(history_changes):
+            if change['seq'] <= cursor:
+                break
+            if change['channel'] == channel:
+                if change['kind'] == 'clear':
+                    return None
+                changes.append(change)
+        
+        new_messages.reverse()
+        changes.reverse()
+        return new_messages, changes, last_seq
+
+def get_older_messages(channel, before_id):
+    """Страница сообщений канала с ID меньше before_id; вернуть (сообщения, ID для следующей страницы или None)"""
+    with history_lock:
+        # ID сообщений канала хранятся по возрастанию - конец страницы и каждое сообщение
+        # ищутся двоичным поиском, сколько бы чужих сообщений ни лежало между ними
+        channel_ids = channel_message_ids.get(channel, [])
+        end = index = bisect.bisect_left(channel_ids, before_id)
+        page = []
+        while index > 0 and len(page) < HISTORY_LIMIT:
+            if end - index >= SYNC_SCAN_LIMIT:
+                # Подряд слишком много удалённых - следующую страницу клиент запросит отсюда
+                break
+            index -= 1
+            position = bisect.bisect_left(messages, channel_ids[index], key=lambda msg: msg['id'])
+            if position < len(messages) and messages[position]['id'] == channel_ids[index]:
+                page.append(messages[position])
+        return page[::-1], channel_ids[index] if index > 0 else None
+
+def find_message(message_id):
+    """Найти сообщение по ID двоичным поиском"""
+    with history_lock:
+        position = bisect.bisect_left(messages, message_id, key=lambda msg: msg['id'])
+        if position < len(messages) and messages[position]['id'] == message_id:
+            return messages[position]
+    return None
+
+# ==================== ПОИСК ПО СООБЩЕНИЯМ ====================
+# Инвертированный индекс по каждому каналу: слово -> {id сообщения: сколько раз встречается}.
+# Обновляется при отправке, правке, удалении и очистке, поэтому поиск не просматривает историю
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_TERMS = 8
+SEARCH_CANDIDATE_LIMIT = 1000   # совпадений на канал, которые ранжируются; остальные, более старые, не ищутся
+SEARCH_SCAN_LIMIT = 50000       # ID самого короткого списка, просматриваемых в канале
+TOKEN_RE = re.compile(r'\w+')
+
+search_postings = {}            # channel: {слово: {message_id: частота}}
+search_doc_counts = {}          # channel: сколько сообщений проиндексировано
+search_lock = threading.Lock()
+
+def tokenize(text):
+    """Разбить текст на слова без учёта регистра (ё и е не различаются)"""
+    return TOKEN_RE.findall(text.casefold().replace('ё', 'е'))
+
+def index_message(message):
+    """Добавить сообщение в поисковый индекс его канала"""
+    terms = {}
+    for term in tokenize(message['message']):
+        terms[term] = terms.get(term, 0) + 1
+    channel = message['channel']
+    with search_lock:
+        postings = search_postings.setdefault(channel, {})
+        for term, count in terms.items():
+            postings.setdefault(term, {})[message['id']] = count
+        search_doc_counts[channel] = search_doc_counts.get(channel, 0) + 1
+
+def unindex_message(message):
+    """Убрать сообщение из поискового индекса"""
+    channel = message['channel']
+    with search_lock:
+        postings = search_postings.get(channel)
+        if postings is None:
+            return
+        for term in set(tokenize(message['message'])):
+            posting = postings.get(term)
+            if posting is not None:
+                posting.pop(message['id'], None)
+                if not posting:
+                    del postings[term]
+        search_doc_counts[channel] = max(search_doc_counts.get(channel, 1) - 1, 0)
+
+def drop_search_index(channel):
+    """Забыть индекс очищенного или удалённого канала"""
+    with search_lock:
+        search_postings.pop(channel, None)
+        search_doc_counts.pop(channel, None)
+
+def search_channels(channel_ids, query, offset=0, limit=SEARCH_PAGE_SIZE):
+    """Найти сообщения со всеми словами запроса; вернуть (страница, всего найдено среди ранжируемых)"""
+    terms = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_TERMS]
+    if not terms:
+        return [], 0
+    
+    scored = []
+    with search_lock:
+        for channel in channel_ids:
+            postings = search_postings.get(channel)
+            if not postings:
+                continue
+            term_postings = [postings.get(term) for term in terms]
+            if not all(term_postings):
+                continue
+            
+            # Идём по самому короткому списку от недавно проиндексированных к старым
+            # и проверяем остальные слова по словарю. Время не зависит от того, насколько
+            # слово частое: ранжируются только последние SEARCH_CANDIDATE_LIMIT совпадений
+            term_postings.sort(key=len)
+            recent = itertools.islice(reversed(term_postings[0]), SEARCH_SCAN_LIMIT)
+            for posting in term_postings[1:]:
+                recent = filter(posting.__contains__, recent)
+            candidates = list(itertools.islice(recent, SEARCH_CANDIDATE_LIMIT))
+            
+            # TF-IDF: редкие в канале слова весят больше частых
+            total = search_doc_counts.get(channel, 1)
+            weights = [(posting, math.log(1 + total / len(posting))) for posting in term_postings]
+            for message_id in candidates:
+                score = sum(posting[message_id] * weight for posting, weight in weights)
+                scored.append((score, message_id))
+    
+    # При равном счёте выше новые сообщения
+    top = heapq.nlargest(offset + limit, scored)[offset:]
+    page = [message for message in (find_message(message_id) for _, message_id in top) if message]
+    return page, len(scored)
+
+# ==================== ПРОЧИТАННЫЕ СООБЩЕНИЯ ====================
+# ID сообщений каждого канала хранятся по возрастанию, курсор пользователя помнит
+# последний прочитанный ID - непрочитанных = ID после курсора, двоичный поиск
+READ_CURSORS_PER_REQUEST = 100  # курсоров в одном mark_read
+
+channel_message_ids = {}        # channel: ID живых сообщений после последней очистки, по возрастанию
+read_cursors = {}               # user_id: {channel: message_id}
+read_lock = threading.Lock()
+
+def unread_count(user_id, channel):
+    """Число непрочитанных сообщений канала за O(log n)"""
+    channel_ids = channel_message_ids.get(channel, ())
+    return len(channel_ids) - bisect.bisect_right(channel_ids, read_cursors.get(user_id, {}).get(channel, 0))
+
+def set_read_cursor(user_id, channel, message_id):
+    """Сдвинуть курсор прочтения вперёд; False - курсор уже дальше"""
+    with read_lock:
+        # Курсор не уходит дальше последнего сообщения канала: иначе неверный ID
+        # от клиента заблокирует все настоящие отметки после него
+        channel_ids = channel_message_ids.get(channel)
+        message_id = min(message_id, channel_ids[-1] if channel_ids else 0)
+        cursors = read_cursors.setdefault(user_id, {})
+        if channel in cursors and cursors[channel] >= message_id:
+            return False
+        cursors[channel] = message_id
+        return True
+
+def forget_channel_message(channel, message_id):
+    """Удалённое сообщение больше не считается непрочитанным; под history_lock"""
+    channel_ids = channel_message_ids.get(channel)
+    if channel_ids:
+        position = bisect.bisect_left(channel_ids, message_id)
+        if position < len(channel_ids) and channel_ids[position] == message_id:
+            del channel_ids[position]
+
+def clear_read_counters(channel):
+    """После очистки канала всё, что было до неё, не считается непрочитанным; под history_lock"""
+    channel_message_ids.pop(channel, None)
+
+def send_initial_unread_counts(sid):
+    """Счётчики непрочитанного после входа; в публичных каналах новичку старая история не нужна"""
+    user_id = online_users[sid]['user_id']
+    public_ids = [channel['id'] for channel in channels]
+    for channel_id in public_ids:
+        if channel_id not in read_cursors.get(user_id, {}):
+            channel_ids = channel_message_ids.get(channel_id)
+            set_read_cursor(user_id, channel_id, channel_ids[-1] if channel_ids else 0)
+    send_unread_counts(sid, public_ids + list(user_chats.get(user_id, ())))
+
+def send_unread_counts(sid, channel_ids):
+    """Отправить счётчики непрочитанного и курсоры по списку каналов"""
+    user_id = online_users[sid]['user_id']
+    counts = {}
+    cursors = {}
+    for channel in channel_ids:
+        count = unread_count(user_id, channel)
+        if count:
+            counts[channel] = count
+        cursor = read_cursors.get(user_id, {}).get(channel)
+        if cursor:
+            cursors[channel] = cursor
+    socketio.emit('unread_counts', {'counts': counts, 'cursors': cursors}, to=sid)
+
+# ==================== СПИСКИ ЧАТОВ ====================
+# У каждого пользователя своя версия списка приватных чатов и групп.
+# Изменения рассылаются дельтами add/remove/rename, клиент подтверждает версию
+CHAT_LIST_PAGE_SIZE = 200       # чатов в одном кадре начального списка
+CHAT_LIST_LOG_LIMIT = 100       # сколько последних дельт помнится для догоняющих клиентов
+
+user_chats = {}                 # user_id: {chat_id: None} - чаты пользователя в порядке добавления
+chat_list_versions = {}         # user_id: текущая версия списка
+chat_list_logs = {}             # user_id: deque дельт {version, op, chat}
+chat_list_lock = threading.Lock()
+
+def get_user_sids(user_id):
+    """Все подключения пользователя"""
+    return get_sessions(usernames_by_id.get(user_id))
+
+def chat_list_entry(chat_id, user_id):
+    """Элемент списка чатов глазами пользователя"""
+    if chat_id in private_chats:
+        chat_data = private_chats[chat_id]
+        # Приватный чат называется именем собеседника
+        other_ids = [uid for uid in chat_data['users'] if uid != user_id]
+        other_username = get_user_by_id(other_ids[0])[0] if other_ids else None
+        name = other_username if other_username else 'Неизвестный'
+    else:
+        chat_data = group_chats[chat_id]
+        name = chat_data['name']
+    return {
+        'id': chat_id,
+        'kind': chat_data['type'],
+        'name': name,
+        'is_creator': chat_data['creator_id'] == user_id
+    }
+
+def push_chat_list_change(user_ids, op, chat_id, kind):
+    """Записать изменение в списки чатов пользователей и разослать его дельтой"""
+    for user_id in user_ids:
+        if op == 'remove':
+            chat = {'id': chat_id, 'kind': kind}
+        else:
+            chat = chat_list_entry(chat_id, user_id)
         
-        ::-webkit-scrollbar-thumb:hover {
-            background: #40444b;
-        }
-    </style>
+        with chat_list_lock:
+            chats = user_chats.setdefault(user_id, {})
+            if op == 'remove':
+                chats.pop(chat_id, None)
+            else:
+                chats[chat_id] = None
+            version = chat_list_versions.get(user_id, 0) + 1
+            chat_list_versions[user_id] = version
+            delta = {'version': version, 'op': op, 'chat': chat}
+            chat_list_logs.setdefault(user_id, deque(maxlen=CHAT_LIST_LOG_LIMIT)).append(delta)
+        
+        for sid in get_user_sids(user_id):
+            socketio.emit('chat_list_delta', delta, to=sid)
+            # Вышедший из чата больше не видит, кто в нём печатает
+            if op == 'remove':
+                stop_viewing(sid, chat_id)
+
+def send_chat_list(sid, client_version=None):
+    """Догнать клиента пропущенными дельтами или отправить список целиком по страницам"""
+    user_id = online_users[sid]['user_id']
+    with chat_list_lock:
+        version = chat_list_versions.get(user_id, 0)
+        missed = None
+        if isinstance(client_version, int) and client_version <= version:
+            missed = [delta for delta in chat_list_logs.get(user_id, ()) if delta['version'] > client_version]
+            if len(missed) != version - client_version:
+                missed = None
+        chat_ids = list(user_chats.get(user_id, ()))
+    
+    if missed is not None:
+        # Пометка повтора: разрыв в нём значит, что догнать не вышло и нужно просить снова
+        for delta in missed:
+            socketio.emit('chat_list_delta', dict(delta, replay=True), to=sid)
+        return
+    
+    chats = [chat_list_entry(chat_id, user_id) for chat_id in chat_ids
+             if chat_id in private_chats or chat_id in group_chats]
+    for start in range(0, max(len(chats), 1), CHAT_LIST_PAGE_SIZE):
+        socketio.emit('chat_list_page', {
+            'version': version,
+            'chats': chats[start:start + CHAT_LIST_PAGE_SIZE],
+            'first': start == 0,
+            'done': start + CHAT_LIST_PAGE_SIZE >= len(chats)
+        }, to=sid)
+
+def trim_chat_list_log(user_id):
+    """Забыть дельты, которые подтвердили все подключения пользователя"""
+    acked = [online_users[sid].get('chat_list_version', 0) for sid in get_user_sids(user_id)]
+    if not acked:
+        return
+    with chat_list_lock:
+        log = chat_list_logs.get(user_id)
+        while log and log[0]['version'] <= min(acked):
+            log.popleft()
+
+# ==================== ПАКЕТНАЯ ДОСТАВКА СООБЩЕНИЙ ====================
+# Окно склейки new_message в один messages_batch; 0 - отправлять сразу
+MESSAGE_BATCH_WINDOW_MS = 0
+
+pending_batches = {}    # room (None - всем): [сообщения, ожидающие отправки]
+batch_lock = threading.Lock()
+batch_send_lock = threading.Lock()  # отправка пакетов и событий об изменениях идёт по очереди
+batch_ready = threading.Event()
+batch_flusher_started = False
+
+def deliver_message(message, room=None):
+    """Отправить сообщение сразу или поставить в пакет для комнаты"""
+    global batch_flusher_started
+    if not MESSAGE_BATCH_WINDOW_MS:
+        socketio.emit('new_message', message, to=room)
+        return
+    
+    with batch_lock:
+        pending_batches.setdefault(room, []).append(message)
+        if not batch_flusher_started:
+            batch_flusher_started = True
+            socketio.start_background_task(flush_message_batches)
+    batch_ready.set()
+
+def flush_message_batches():
+    """Фоновая отправка накопленных пакетов раз в окно"""
+    while True:
+        batch_ready.wait()
+        socketio.sleep(MESSAGE_BATCH_WINDOW_MS / 1000)
+        with batch_send_lock:
+            send_pending_batches()
+
+def send_pending_batches():
+    """Отправить все накопленные пакеты; под batch_send_lock"""
+    with batch_lock:
+        batches = dict(pending_batches)
+        pending_batches.clear()
+        batch_ready.clear()
+    
+    for room, batch in batches.items():
+        if len(batch) == 1:
+            socketio.emit('new_message', batch[0], to=room)
+        else:
+            socketio.emit('messages_batch', {'messages': batch}, to=room)
+
+def deliver_change(event, data):
+    """Разослать правку, удаление или очистку всем после ожидающих пакетов"""
+    if not MESSAGE_BATCH_WINDOW_MS:
+        socketio.emit(event, data)
+        return
+    
+    # Иначе событие обгонит сообщение, к которому относится, и клиент его не применит
+    with batch_send_lock:
+        send_pending_batches()
+        socketio.emit(event, data)
+
+# ==================== ОБЪЯВЛЕНИЯ О ВХОДЕ И ВЫХОДЕ ====================
+# Входы и выходы за окно склеиваются в одно событие presence_changed и одну
+# рассылку users_update. В историю general объявления не попадают
+PRESENCE_WINDOW_MS = 1000       # 0 - рассылать каждое изменение сразу
+PRESENCE_ANNOUNCE_LIMIT = 100   # больше изменений за окно - без объявления, только список онлайн; None - без ограничения
+PRESENCE_NAMES_LIMIT = 20       # сколько имён передавать в объявлении
+
+pending_presence = {}           # username: 'joined' / 'left'
+presence_changes_lock = threading.Lock()
+presence_ready = threading.Event()
+presence_flusher_started = False
+
+def announce_presence(username=None, change=None):
+    """Запомнить вход или выход; без change - только обновить список онлайн"""
+    global presence_flusher_started
+    with presence_changes_lock:
+        if change is not None:
+            # Выход и повторный вход за одно окно взаимно гасятся
+            if pending_presence.get(username, change) != change:
+                del pending_presence[username]
+            else:
+                pending_presence[username] = change
+        if PRESENCE_WINDOW_MS and not presence_flusher_started:
+            presence_flusher_started = True
+            socketio.start_background_task(flush_presence)
+    if PRESENCE_WINDOW_MS:
+        presence_ready.set()
+    else:
+        send_presence()
+
+def send_presence():
+    """Разослать накопленное: одно объявление и один список онлайн"""
+    with presence_lock:
+        if presence_hold['depth']:
+            presence_hold['pending'] = True
+            return
+    with presence_changes_lock:
+        changes = dict(pending_presence)
+        pending_presence.clear()
+        presence_ready.clear()
+    
+    if changes and (PRESENCE_ANNOUNCE_LIMIT is None or len(changes) <= PRESENCE_ANNOUNCE_LIMIT):
+        joined = [username for username, change in changes.items() if change == 'joined']
+        left = [username for username, change in changes.items() if change == 'left']
+        socketio.emit('presence_changed', {
+            'joined': joined[:PRESENCE_NAMES_LIMIT],
+            'joined_count': len(joined),
+            'left': left[:PRESENCE_NAMES_LIMIT],
+            'left_count': len(left)
+        })
+    update_online_users()
+
+def flush_presence():
+    """Фоновая рассылка изменений присутствия раз в окно"""
+    while True:
+        presence_ready.wait()
+        socketio.sleep(PRESENCE_WINDOW_MS / 1000)
+        send_presence()
+
+# ==================== ИНДИКАТОР НАБОРА ====================
+# Событие typing нигде не хранится. От пользователя в канале принимается не чаще
+# раза в TYPING_THROTTLE_MS; принятые за окно склеиваются в одно событие на канал,
+# которое уходит только устройствам, где канал сейчас открыт (комната
+# view:<канал>). Индикатор гаснет сам через expires_ms или с приходом сообщения
+# от того, кто печатал
+TYPING_THROTTLE_MS = 8000       # клиент отправляет typing не чаще, сервер отбрасывает лишние
+TYPING_EXPIRE_MS = 10000        # сколько индикатор живёт без подтверждения
+TYPING_WINDOW_MS = 500          # окно склейки; 0 - рассылать каждое событие сразу
+TYPING_NAMES_LIMIT = 5          # сколько имён передавать, остальные - только числом
+TYPING_STATE_LIMIT = 100000     # записей (пользователь, канал) в памяти
+
+viewing = {}                    # socket_id: канал, открытый на этом устройстве
+typing_state = OrderedDict()    # (user_id, канал): когда индикатор истекает, мс; по возрастанию
+pending_typing = {}             # канал: {username: None} - начали печатать за окно
+typing_stats = {'accepted': 0, 'throttled': 0}
+typing_lock = threading.Lock()
+typing_ready = threading.Event()
+typing_flusher_started = False
+
+def view_room(channel_id):
+    """Комната устройств, на которых канал открыт"""
+    return f'view:{channel_id}'
+
+def set_viewing(sid, channel_id):
+    """Перевести устройство в комнату открытого канала"""
+    previous = viewing.get(sid)
+    if previous == channel_id:
+        return
+    if previous is not None:
+        socketio.server.leave_room(sid, view_room(previous), namespace='/')
+    socketio.server.enter_room(sid, view_room(channel_id), namespace='/')
+    viewing[sid] = channel_id
+
+def stop_viewing(sid, channel_id=None):
+    """Убрать устройство из комнаты канала (любого, если channel_id не задан)"""
+    current = viewing.get(sid)
+    if current is None or channel_id is not None and current != channel_id:
+        return
+    del viewing[sid]
+    socketio.server.leave_room(sid, view_room(current), namespace='/')
+
+def claim_typing(user_id, channel_id, now):
+    """Вернуть True, если typing пора принять, и продлить индикатор"""
+    key = (user_id, channel_id)
+    with typing_lock:
+        expires = typing_state.get(key)
+        if expires is not None and now < expires - TYPING_EXPIRE_MS + TYPING_THROTTLE_MS:
+            typing_stats['throttled'] += 1
+            return False
+        typing_state[key] = now + TYPING_EXPIRE_MS
+        typing_state.move_to_end(key)
+        # Срок у всех записей одинаковый, поэтому истёкшие всегда в начале
+        while typing_state and (next(iter(typing_state.values())) <= now or len(typing_state) > TYPING_STATE_LIMIT):
+            typing_state.popitem(last=False)
+        typing_stats['accepted'] += 1
+        return True
+
+def announce_typing(channel_id, username):
+    """Поставить пользователя в ближайшую рассылку typing по каналу"""
+    global typing_flusher_started
+    with typing_lock:
+        pending_typing.setdefault(channel_id, {})[username] = None
+        if TYPING_WINDOW_MS and not typing_flusher_started:
+            typing_flusher_started = True
+            socketio.start_background_task(flush_typing)
+    if TYPING_WINDOW_MS:
+        typing_ready.set()
+    else:
+        send_typing()
+
+def send_typing():
+    """Разослать накопленное: одно событие на канал его зрителям"""
+    with typing_lock:
+        batches = dict(pending_typing)
+        pending_typing.clear()
+        typing_ready.clear()
+    
+    for channel_id, usernames in batches.items():
+        # Все, кто печатал, успели отправить сообщение - рассылать нечего
+        if not usernames:
+            continue
+        names = list(usernames)
+        socketio.emit('typing', {
+            'channel': channel_id,
+            'users': names[:TYPING_NAMES_LIMIT],
+            'count': len(names),
+            'expires_ms': TYPING_EXPIRE_MS
+        }, to=view_room(channel_id))
+
+def flush_typing():
+    """Фоновая рассылка typing раз в окно"""
+    while True:
+        typing_ready.wait()
+        socketio.sleep(TYPING_WINDOW_MS / 1000)
+        send_typing()
+
+def clear_typing(user_id, username, channel_id):
+    """Сообщение отправлено - индикатор не нужен, следующий typing принимается без ожидания"""
+    with typing_lock:
+        typing_state.pop((user_id, channel_id), None)
+        pending_typing.get(channel_id, {}).pop(username, None)
+
+# ==================== ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ ====================
+# Лимиты задаются как (токенов в секунду, размер корзины); None - без ограничения
+RATE_LIMITS = {
+    'register':            {'user': None,     'ip': (0.2, 3)},
+    'login':               {'user': None,     'ip': (0.5, 5)},
+    'send_message':        {'user': (5, 10),  'ip': (20, 40)},
+    'edit_message':        {'user': (2, 5),   'ip': (10, 20)},
+    'delete_message':      {'user': (2, 5),   'ip': (10, 20)},
+    'join_channel':        {'user': (3, 10),  'ip': (10, 30)},
+    'load_older':          {'user': (5, 15),  'ip': (20, 60)},
+    'create_private_chat': {'user': (0.2, 3), 'ip': (1, 5)},
+    'create_group':        {'user': (0.2, 3), 'ip': (1, 5)},
+    'rename_group':        {'user': (0.2, 3), 'ip': (1, 5)},
+    'clear_history':       {'user': (0.1, 2), 'ip': (0.5, 5)},
+    'search_messages':     {'user': (2, 5),   'ip': (10, 20)},
+    'mark_read':           {'user': (2, 10),  'ip': (10, 40)},
+    'typing':              {'user': (2, 10),  'ip': (20, 60)},
+}
+DEFAULT_RATE_LIMIT = {'user': (5, 20), 'ip': (20, 60)}
+RATE_LIMIT_EXEMPT = {None, 'connect', 'disconnect'}
+RATE_LIMIT_MAX_BUCKETS = 100000   # максимум корзин в памяти
+RATE_LIMIT_IDLE_SECONDS = 600     # корзина без обращений дольше этого удаляется
+
+rate_buckets = OrderedDict()      # (scope, key, event): [tokens, last_seen, notified]
+rate_limit_stats = {}             # event: сколько вызовов отклонено
+rate_limit_lock = threading.Lock()
+
+def get_rate_bucket(bucket_key, burst, now):
+    """Получить корзину токенов, создав её при первом обращении"""
+    bucket = rate_buckets.get(bucket_key)
+    if bucket is not None:
+        rate_buckets.move_to_end(bucket_key)
+        return bucket
+
+    bucket = [float(burst), now, False]
+    rate_buckets[bucket_key] = bucket
+
+    # Корзины упорядочены по последнему обращению: в начале самые старые
+    while rate_buckets:
+        oldest_key, oldest = next(iter(rate_buckets.items()))
+        if len(rate_buckets) <= RATE_LIMIT_MAX_BUCKETS and now - oldest[1] < RATE_LIMIT_IDLE_SECONDS:
+            break
+        del rate_buckets[oldest_key]
+    return bucket
+
+def check_rate_limit(event, sid, environ):
+    """Списать токены за событие; False, если клиент превысил лимит"""
+    if event in RATE_LIMIT_EXEMPT:
+        return True
+
+    limits = RATE_LIMITS.get(event, DEFAULT_RATE_LIMIT)
+    user = online_users.get(sid)
+    keys = []
+    if limits.get('user') and user:
+        keys.append((('user', user['username'], event), limits['user']))
+    if limits.get('ip') and environ:
+        keys.append((('ip', environ.get('REMOTE_ADDR'), event), limits['ip']))
+    if not keys:
+        return True
+
+    now = time.monotonic()
+    with rate_limit_lock:
+        buckets = []
+        for bucket_key, (rate, burst) in keys:
+            bucket = get_rate_bucket(bucket_key, burst, now)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            buckets.append((bucket, rate))
+
+        if all(bucket[0] >= 1 for bucket, _ in buckets):
+            for bucket, _ in buckets:
+                bucket[0] -= 1
+                bucket[2] = False
+            return True
+
+        rate_limit_stats[event] = rate_limit_stats.get(event, 0) + 1
+        retry_after = max((1 - bucket[0]) / rate for bucket, rate in buckets if bucket[0] < 1)
+        # Клиента уведомляем один раз за серию отказов, чтобы не усиливать флуд
+        notify = not all(bucket[2] for bucket, _ in buckets)
+        for bucket, _ in buckets:
+            bucket[2] = True
+
+    if notify:
+        socketio.emit('rate_limited', {'event': event, 'retry_after': round(retry_after, 2)}, to=sid)
+    return False
+
+# ==================== ДОПУСК ВХОДОВ ====================
+# После перезапуска все браузеры входят одновременно. Лишние входы - по паролю
+# и по токену - получают login_queued с паузой до повтора, а допущенные
+# откладывают загрузку списков и истории на случайное время, зависящее от числа
+# недавних входов. Пауза соблюдается сервером: ранние запросы возвращаются клиенту
+LOGIN_CONCURRENCY = 16          # входов, обрабатываемых одновременно
+LOGIN_RETRY_BASE_MS = 250       # пауза перед первым повтором, дальше удваивается
+LOGIN_RETRY_MAX_MS = 8000
+LOGIN_FETCH_SPREAD_MS = 5       # на каждый вход за последнюю секунду
+LOGIN_FETCH_SPREAD_MAX_MS = 5000
+
+login_slots = threading.BoundedSemaphore(LOGIN_CONCURRENCY)
+recent_admissions = deque()     # время допущенных входов за последнюю секунду
+admission_stats = {'admitted': 0, 'queued': 0}
+admission_lock = threading.Lock()
+
+def login_retry_delay(attempt):
+    """Пауза до повтора входа: экспонента со случайным разбросом в половину"""
+    ceiling = min(LOGIN_RETRY_MAX_MS, LOGIN_RETRY_BASE_MS * 2 ** min(attempt, 16))
+    return int(random.uniform(ceiling / 2, ceiling))
+
+def login_fetch_delay():
+    """На сколько клиенту отложить загрузку списков и истории после входа"""
+    now = time.monotonic()
+    with admission_lock:
+        admission_stats['admitted'] += 1
+        recent_admissions.append(now)
+        while recent_admissions[0] < now - 1:
+            recent_admissions.popleft()
+        spread = min(LOGIN_FETCH_SPREAD_MAX_MS, LOGIN_FETCH_SPREAD_MS * (len(recent_admissions) - 1))
+    return int(random.uniform(0, spread))
+
+def queue_login(attempt, **extra):
+    """Не допустить вход сейчас - клиент повторит его через паузу"""
+    attempt = attempt if isinstance(attempt, int) and attempt >= 0 else 0
+    with admission_lock:
+        admission_stats['queued'] += 1
+    emit('login_queued', dict(extra, retry_after_ms=login_retry_delay(attempt), attempt=attempt + 1))
+
+def fetch_deferred(event, data):
+    """Отклонить запрос, пришедший раньше назначенной паузы; True - клиент повторит его сам"""
+    remaining_ms = int((online_users[request.sid].get('fetch_after', 0) - time.monotonic()) * 1000)
+    if remaining_ms <= 0:
+        return False
+    emit('login_queued', {'retry_after_ms': remaining_ms, 'event': event, 'data': data})
+    return True
+
+# ==================== СЖАТИЕ WEBSOCKET ====================
+compression_stats = {}          # event: [кадров, байт до сжатия, байт отправлено, кадров без сжатия]
+compression_lock = threading.Lock()
+
+def get_frame_event(data, opcode):
+    """Имя события Socket.IO в исходящем кадре (для статистики)"""
+    if opcode is Opcode.BINARY:
+        try:
+            return msgpack.loads(data)['data'][0]
+        except Exception:
+            return '<binary>'
+    # Текстовый кадр Engine.IO: 42["event",...] или 42<ack id>["event",...]
+    if not data.startswith(b'42'):
+        return '<engineio>'
+    start = data.find(b'["', 2, 24)
+    end = data.find(b'"', start + 2, start + 66)
+    if start == -1 or end == -1:
+        return '<socketio>'
+    return data[start + 2:end].decode('utf-8', 'replace')
+
+def record_compression(event, raw_size, sent_size):
+    """Учесть кадр в статистике сжатия"""
+    with compression_lock:
+        stats = compression_stats.setdefault(event, [0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += raw_size
+        stats[2] += sent_size
+        if raw_size == sent_size:
+            stats[3] += 1
+
+if PerMessageDeflate is not None:
+    class ThresholdDeflate(PerMessageDeflate):
+        """permessage-deflate, который не сжимает сообщения меньше порога"""
+
+        def accept(self, offer):
+            if not WS_COMPRESSION_ENABLED:
+                return None
+            return super().accept(offer)
+
+        def frame_outbound(self, proto, opcode, rsv, data, fin):
+            if opcode not in (Opcode.TEXT, Opcode.BINARY) or not fin:
+                return super().frame_outbound(proto, opcode, rsv, data, fin)
+            
+            # RFC 7692 разрешает слать отдельные сообщения без сжатия (RSV1 = 0),
+            # контекст компрессора при этом не затрагивается
+            if len(data) < WS_COMPRESSION_THRESHOLD:
+                record_compression(get_frame_event(data, opcode), len(data), len(data))
+                return rsv, data
+            
+            rsv, compressed = super().frame_outbound(proto, opcode, rsv, data, fin)
+            record_compression(get_frame_event(data, opcode), len(data), len(compressed))
+            return rsv, compressed
+
+    # simple-websocket создаёт расширение сам, подменяем класс в его модуле
+    simple_websocket.ws.PerMessageDeflate = ThresholdDeflate
+
+# ==================== ИСХОДЯЩИЕ ОЧЕРЕДИ ====================
+# Engine.IO складывает пакеты каждого сокета в очередь без ограничения, и медленный
+# клиент копит их в памяти сервера. Очередь ниже разбирает пакеты по событию, только
+# когда в ней уже что-то лежит, поэтому для быстрых клиентов почти ничего не стоит
+OUTBOUND_QUEUE_LIMIT = 1000     # пакетов; дольше OUTBOUND_OVERFLOW_GRACE_S выше лимита - отключение
+OUTBOUND_HARD_LIMIT = 5000      # пакетов; отключение сразу
+OUTBOUND_OVERFLOW_GRACE_S = 10
+OUTBOUND_EPHEMERAL_DEPTH = 32   # глубже этого эфемерные события отбрасываются
+OUTBOUND_POLICIES = {
+    # В очереди остаётся только последнее состояние. Только для снимков:
+    # дельты вроде chat_list_delta склеивать нельзя - потеряется промежуточная
+    'users_update': 'coalesce',
+    # Устаревают раньше, чем дойдут
+    'presence_changed': 'drop',
+    'typing': 'drop',
+    'rate_limited': 'drop',
+}
+
+outbound_stats = {'coalesced': 0, 'dropped': 0, 'disconnected': 0}
+outbound_lock = threading.Lock()
+
+def outbound_event(pkt):
+    """Имя события Socket.IO в пакете Engine.IO; запоминается в самом пакете"""
+    event = getattr(pkt, 'outbound_event', None)
+    if event is not None:
+        return event
+    event = '<engineio>'
+    if pkt.packet_type == engineio_packet.MESSAGE:
+        data = pkt.data
+        if isinstance(data, str):
+            # 2["event",...], 2<ack id>["event",...] или 2/nsp,["event",...]
+            start = data.find('["', 1, 32)
+            end = data.find('"', start + 2, start + 66)
+            event = data[start + 2:end] if start != -1 and end != -1 else '<socketio>'
+        else:
+            try:
+                event = msgpack.loads(data)['data'][0]
+            except Exception:
+                event = '<binary>'
+    pkt.outbound_event = event
+    return event
+
+def count_outbound(action):
+    with outbound_lock:
+        outbound_stats[action] += 1
+
+class OutboundQueue(queue.Queue):
+    """Очередь исходящих пакетов одного сокета с политиками для переполнения"""
+
+    def __init__(self):
+        super().__init__()
+        self.over_limit_since = None
+        self.closed = False
+
+    def put(self, item, block=True, timeout=None):
+        if item is not None:
+            with self.mutex:
+                if self.closed:
+                    return
+                depth = len(self.queue)
+                if depth and not self.apply_policy(item, depth):
+                    return
+        super().put(item, block, timeout)
+
+    def apply_policy(self, item, depth):
+        """Решить судьбу пакета при непустой очереди; False - в очередь не ставить"""
+        policy = OUTBOUND_POLICIES.get(outbound_event(item))
+        if policy == 'coalesce':
+            for index, queued in enumerate(self.queue):
+                if queued is not None and outbound_event(queued) == item.outbound_event:
+                    self.queue[index] = item
+                    count_outbound('coalesced')
+                    return False
+        elif policy == 'drop' and depth >= OUTBOUND_EPHEMERAL_DEPTH:
+            count_outbound('dropped')
+            return False
+        
+        if depth < OUTBOUND_QUEUE_LIMIT:
+            self.over_limit_since = None
+            return True
+        now = time.monotonic()
+        if self.over_limit_since is None:
+            self.over_limit_since = now
+        if depth >= OUTBOUND_HARD_LIMIT or now - self.over_limit_since > OUTBOUND_OVERFLOW_GRACE_S:
+            # Клиент не успевает читать - освобождаем память и закрываем сокет
+            self.closed = True
+            self.queue.clear()
+            self.unfinished_tasks = 0
+            self.all_tasks_done.notify_all()
+            socketio.start_background_task(close_slow_socket, self, depth)
+            return False
+        return True
+
+def create_outbound_queue(*args, **kwargs):
+    return OutboundQueue()
+
+def close_slow_socket(outbound_queue, depth):
+    """Отключить клиента, чья очередь переполнилась"""
+    eio = socketio.server.eio
+    for eio_sid, eio_socket in list(eio.sockets.items()):
+        if eio_socket.queue is outbound_queue:
+            count_outbound('disconnected')
+            log_event(logging.WARNING, 'slow_client_disconnect', eio_sid=eio_sid, depth=depth)
+            eio_socket.close(wait=False, abort=True, reason=eio.reason.SERVER_DISCONNECT)
+            eio.sockets.pop(eio_sid, None)
+            return
+
+def outbound_depths():
+    """Глубины исходящих очередей всех сокетов"""
+    return [eio_socket.queue.qsize() for eio_socket in list(socketio.server.eio.sockets.values())]
+
+# Очереди создаёт сервер Engine.IO для каждого сокета; для других async_mode нужен свой тип очереди
+if socketio.server.eio.async_mode == 'threading':
+    socketio.server.eio.create_queue = create_outbound_queue
+
+# ==================== МЕТРИКИ ====================
+# Каждый поток пишет в свой набор счётчиков без блокировок,
+# /metrics складывает наборы при чтении
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # секунд
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)  # получателей
+
+metrics_shards = {}             # id потока: {'latency': {...}, 'errors': {...}, 'fanout': {...}}
+metrics_shards_lock = threading.Lock()  # нужен только при первом обращении потока
+
+def metrics_shard():
+    """Счётчики текущего потока"""
+    ident = threading.get_ident()
+    shard = metrics_shards.get(ident)
+    if shard is None:
+        # Номера потоков переиспользуются только после завершения прежнего владельца
+        shard = {'latency': {}, 'errors': {}, 'fanout': {}}
+        with metrics_shards_lock:
+            metrics_shards[ident] = shard
+    return shard
+
+def observe(histograms, key, buckets, value):
+    """Добавить значение в гистограмму: счётчики по корзинам (+Inf последней) и сумма"""
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(buckets) + 1) + [0]
+    histogram[bisect.bisect_left(buckets, value)] += 1
+    histogram[-1] += value
+
+def observe_event(event, seconds, failed):
+    """Учесть вызов обработчика события"""
+    shard = metrics_shard()
+    observe(shard['latency'], event, LATENCY_BUCKETS, seconds)
+    if failed:
+        shard['errors'][event] = shard['errors'].get(event, 0) + 1
+
+def observe_fanout(event, recipients):
+    """Учесть число получателей одной отправки"""
+    observe(metrics_shard()['fanout'], event, FANOUT_BUCKETS, recipients)
+
+def merge_metrics(kind):
+    """Сложить счётчики одного вида по всем потокам"""
+    totals = {}
+    for shard in list(metrics_shards.values()):
+        for key, value in list(shard[kind].items()):
+            if isinstance(value, list):
+                total = totals.setdefault(key, [0] * len(value))
+                for index, item in enumerate(value):
+                    total[index] += item
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+def metric_label(value):
+    """Экранировать значение метки для формата Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_histogram(lines, name, label, histograms, buckets):
+    """Гистограммы в текстовом формате Prometheus (корзины накопительные)"""
+    for key, histogram in sorted(histograms.items()):
+        tag = f'{label}="{metric_label(key)}"'
+        cumulative = 0
+        for bound, count in zip(buckets, histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{tag},le="{bound}"}} {cumulative}')
+        cumulative += histogram[len(buckets)]
+        lines.append(f'{name}_bucket{{{tag},le="+Inf"}} {cumulative}')
+        lines.append(f'{name}_sum{{{tag}}} {histogram[-1]}')
+        lines.append(f'{name}_count{{{tag}}} {cumulative}')
+
+def render_metrics():
+    """Все метрики сервера в текстовом формате Prometheus"""
+    lines = []
+    
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    
+    latency = merge_metrics('latency')
+    errors = merge_metrics('errors')
+    metric('messenger_events_total', 'counter', 'Вызовы обработчиков событий',
+           [(f'event="{metric_label(event)}"', sum(histogram[:-1])) for event, histogram in sorted(latency.items())])
+    metric('messenger_event_errors_total', 'counter', 'Обработчики, завершившиеся исключением',
+           [(f'event="{metric_label(event)}"', count) for event, count in sorted(errors.items())])
+    lines.append('# HELP messenger_event_duration_seconds Время обработки события')
+    lines.append('# TYPE messenger_event_duration_seconds histogram')
+    format_histogram(lines, 'messenger_event_duration_seconds', 'event', latency, LATENCY_BUCKETS)
+    lines.append('# HELP messenger_emit_fanout Получателей одной отправки')
+    lines.append('# TYPE messenger_emit_fanout histogram')
+    format_histogram(lines, 'messenger_emit_fanout', 'event', merge_metrics('fanout'), FANOUT_BUCKETS)
+    
+    sockets = socketio.server.manager.rooms.get('/', {}).get(None, ())
+    depths = outbound_depths()
+    metric('messenger_online_users', 'gauge', 'Авторизованные подключения', [('', len(online_users))])
+    metric('messenger_connected_sockets', 'gauge', 'Открытые Socket.IO подключения', [('', len(sockets))])
+    metric('messenger_store_size', 'gauge', 'Записей в хранилищах', [
+        ('store="messages"', len(messages)),
+        ('store="private_chats"', len(private_chats)),
+        ('store="group_chats"', len(group_chats)),
+        ('store="users_db"', len(users_db)),
+        ('store="history_changes"', len(history_changes)),
+        ('store="search_channels"', len(search_postings)),
+        ('store="rate_buckets"', len(rate_buckets)),
+        ('store="typing"', len(typing_state)),
+    ])
+    metric('messenger_queue_depth', 'gauge', 'Элементов, ожидающих обработки', [
+        ('queue="message_batches"', sum(len(batch) for batch in list(pending_batches.values()))),
+        ('queue="log"', sum(handler.queue.qsize() for handler in logger.handlers
+                            if isinstance(handler, logging.handlers.QueueHandler))),
+        ('queue="outbound"', sum(depths)),
+    ])
+    metric('messenger_outbound_queue_max_depth', 'gauge', 'Самая длинная исходящая очередь сокета',
+           [('', max(depths, default=0))])
+    metric('messenger_outbound_packets_total', 'counter', 'Исходящие пакеты, склеенные или отброшенные политиками',
+           [(f'action="{action}"', outbound_stats[action]) for action in ('coalesced', 'dropped')])
+    metric('messenger_slow_clients_disconnected_total', 'counter', 'Клиенты, отключённые из-за переполнения очереди',
+           [('', outbound_stats['disconnected'])])
+    metric('messenger_log_dropped_total', 'counter', 'Записи лога, отброшенные при переполнении очереди',
+           [('', log_stats['dropped'])])
+    metric('messenger_login_admission_total', 'counter', 'Входы: допущенные и отправленные на повтор',
+           [(f'result="{result}"', count) for result, count in sorted(admission_stats.items())])
+    metric('messenger_typing_total', 'counter', 'События typing: принятые и отброшенные троттлингом',
+           [(f'result="{result}"', count) for result, count in sorted(typing_stats.items())])
+    metric('messenger_rate_limited_total', 'counter', 'Вызовы, отклонённые ограничением частоты',
+           [(f'event="{metric_label(event)}"', count) for event, count in sorted(rate_limit_stats.items())])
+    
+    with compression_lock:
+        compression = sorted((event, list(stats)) for event, stats in compression_stats.items())
+    metric('messenger_ws_frames_total', 'counter', 'Отправленные кадры WebSocket',
+           [(f'event="{metric_label(event)}"', stats[0]) for event, stats in compression])
+    metric('messenger_ws_bytes_total', 'counter', 'Байт в кадрах WebSocket до и после сжатия',
+           [(f'event="{metric_label(event)}",stage="{stage}"', stats[index])
+            for event, stats in compression for stage, index in (('raw', 1), ('sent', 2))])
+    
+    lines.append('')
+    return '\n'.join(lines)
+
+# ==================== ПРОФИЛИРОВАНИЕ ====================
+# Включается из админ-панели (/prof start). Пока выключено, обработчики
+# вызываются как обычно: обёртка ставится на экземпляр socketio только на время замера
+PROFILE_INTERVAL_MS = 5         # период снятия стеков
+PROFILE_DIR = '.'               # куда сохранять .folded для flamegraph.pl / speedscope
+
+profile_state = {'running': False, 'started': None, 'interval': PROFILE_INTERVAL_MS, 'samples': 0}
+profile_handlers = {}           # event: [вызовов, суммарное время, максимум]
+profile_stacks = {}             # "event;файл:функция;...": число попаданий
+profile_active = {}             # id потока: событие, которое он сейчас обрабатывает
+profile_lock = threading.Lock()
+
+def profiled_handle_event(handler, message, namespace, sid, *args):
+    """Обработка события с замером времени и отметкой для сэмплера"""
+    ident = threading.get_ident()
+    profile_active[ident] = message
+    started = time.perf_counter()
+    try:
+        return MessengerSocketIO._handle_event(socketio, handler, message, namespace, sid, *args)
+    finally:
+        elapsed = time.perf_counter() - started
+        profile_active.pop(ident, None)
+        with profile_lock:
+            stats = profile_handlers.setdefault(message, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+def profile_sampler():
+    """Периодически снимать стеки потоков, занятых обработкой событий"""
+    while profile_state['running']:
+        frames = sys._current_frames()
+        for ident, event in list(profile_active.items()):
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code is profiled_handle_event.__code__:
+                    break
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                key = ';'.join([event] + stack[::-1])
+                with profile_lock:
+                    profile_stacks[key] = profile_stacks.get(key, 0) + 1
+        profile_state['samples'] += 1
+        time.sleep(profile_state['interval'] / 1000)
+
+def start_profiling(interval_ms=PROFILE_INTERVAL_MS):
+    """Начать замер: обнулить статистику, подменить обработку событий, запустить сэмплер"""
+    if profile_state['running']:
+        return False
+    with profile_lock:
+        profile_handlers.clear()
+        profile_stacks.clear()
+    profile_state.update(running=True, started=time.time(), interval=interval_ms, samples=0)
+    socketio._handle_event = profiled_handle_event
+    threading.Thread(target=profile_sampler, daemon=True, name='profile-sampler').start()
+    return True
+
+def stop_profiling():
+    """Закончить замер и сохранить стеки в формате folded; вернуть путь к файлу"""
+    if not profile_state['running']:
+        return None
+    profile_state['running'] = False
+    del socketio._handle_event
+    
+    started = datetime.datetime.fromtimestamp(profile_state['started'])
+    path = os.path.join(PROFILE_DIR, f'profile-{started:%Y%m%d-%H%M%S}.folded')
+    with profile_lock:
+        lines = [f'{stack} {count}\n' for stack, count in sorted(profile_stacks.items())]
+    with open(path, 'w', encoding='utf-8') as profile_file:
+        profile_file.writelines(lines)
+    return path
+
+def profile_top(limit=10):
+    """Обработчики по суммарному времени и самые частые функции в стеках"""
+    with profile_lock:
+        handlers = sorted(profile_handlers.items(), key=lambda item: -item[1][1])
+        stacks = list(profile_stacks.items())
+    
+    own = {}
+    inclusive = {}
+    for stack, count in stacks:
+        frames = stack.split(';')[1:]
+        own[frames[-1]] = own.get(frames[-1], 0) + count
+        for name in set(frames):
+            inclusive[name] = inclusive.get(name, 0) + count
+    total = sum(own.values()) or 1
+    
+    top_own = sorted(own.items(), key=lambda item: -item[1])[:limit]
+    top_inclusive = sorted(inclusive.items(), key=lambda item: -item[1])[:limit]
+    return handlers[:limit], [(name, count / total) for name, count in top_own], \
+        [(name, count / total) for name, count in top_inclusive]
+
+# ==================== СЕССИИ И ПЕРЕЗАПУСК ====================
+# Перезапуск без потерь: приём событий останавливается, клиентам уходит
+# server_restarting, состояние пишется в снимок, и процесс заменяется новым
+# (тот же PID), который восстанавливается из снимка. Клиенты переподключаются
+# с токеном сессии и входят без пароля; SERVER_EPOCH сохраняется, поэтому
+# кэши истории на клиентах остаются действительными
+SESSION_TOKEN_LIMIT = 100000    # выданных токенов; старые вытесняются
+SESSION_TOKEN_TTL_S = 24 * 3600 # токен живёт сутки с последнего входа по нему
+SNAPSHOT_PATH = CONFIG.snapshot
+SNAPSHOT_VERSION = 1
+RESTART_FLUSH_MS = 300          # пауза, чтобы server_restarting успел уйти клиентам
+RESTART_RECONNECT_MS = (500, 3000)  # клиенты переподключаются через случайное время из диапазона
+
+session_tokens = OrderedDict()  # токен: (username, истекает в) - в порядке истечения
+tokens_by_user = {}             # username: {токены} - отзыв без обхода всех токенов
+session_lock = threading.Lock()
+restored_online = set()         # кто был в сети до перезапуска - их возвращение не объявляется
+restart_state = {'draining': False, 'online': []}
+
+def issue_session_token(username):
+    """Выдать токен для входа без пароля после переподключения"""
+    token = secrets.token_urlsafe(24)
+    with session_lock:
+        store_session_token(token, username, time.time() + SESSION_TOKEN_TTL_S)
+    return token
+
+def store_session_token(token, username, expires_at):
+    """Записать токен в конец очереди и вытеснить истёкшие и лишние; под session_lock"""
+    session_tokens[token] = (username, expires_at)
+    session_tokens.move_to_end(token)
+    tokens_by_user.setdefault(username, set()).add(token)
+    now = time.time()
+    while session_tokens:
+        oldest, (_, oldest_expires) = next(iter(session_tokens.items()))
+        if oldest_expires > now and len(session_tokens) <= SESSION_TOKEN_LIMIT:
+            break
+        drop_session_token(oldest)
+
+def drop_session_token(token):
+    """Забыть один токен; под session_lock"""
+    entry = session_tokens.pop(token, None)
+    if entry is None:
+        return
+    tokens = tokens_by_user.get(entry[0])
+    if tokens is not None:
+        tokens.discard(token)
+        if not tokens:
+            del tokens_by_user[entry[0]]
+
+def resume_session_token(token):
+    """Владелец действующего токена или None; вход по токену продлевает его срок"""
+    with session_lock:
+        entry = session_tokens.get(token)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            drop_session_token(token)
+            return None
+        store_session_token(token, entry[0], time.time() + SESSION_TOKEN_TTL_S)
+        return entry[0]
+
+def revoke_session_token(token):
+    """Забыть токен, с которым пользователь вышел из аккаунта"""
+    with session_lock:
+        drop_session_token(token)
+
+def revoke_session_tokens(username):
+    """Забыть все токены пользователя (бан, кик, завершение сессии)"""
+    with session_lock:
+        for token in list(tokens_by_user.get(username, ())):
+            drop_session_token(token)
+
+def snapshot_state():
+    """Всё, что переживает перезапуск; поисковый индекс и usernames_by_id строятся заново"""
+    return {
+        'version': SNAPSHOT_VERSION,
+        'epoch': SERVER_EPOCH,
+        'users_db': users_db,
+        'messages': messages,
+        'last_seq': last_seq,
+        'changes_floor': changes_floor,
+        'history_changes': list(history_changes),
+        'private_chats': private_chats,
+        'group_chats': group_chats,
+        'user_chats': user_chats,
+        'chat_list_versions': chat_list_versions,
+        'chat_list_logs': {user_id: list(log) for user_id, log in chat_list_logs.items()},
+        'channel_message_ids': channel_message_ids,
+        'read_cursors': read_cursors,
+        'session_tokens': dict(session_tokens),
+        'online': restart_state['online'],
+    }
+
+def save_snapshot(path):
+    """Записать снимок состояния атомарно; вернуть размер в байтах"""
+    with history_lock, read_lock, chat_list_lock, session_lock:
+        data = pickle.dumps(snapshot_state(), protocol=pickle.HIGHEST_PROTOCOL)
+    temp_path = path + '.tmp'
+    # В снимке хэши паролей и токены - читать его может только владелец
+    descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'wb') as snapshot:
+        snapshot.write(data)
+    os.replace(temp_path, path)
+    return len(data)
+
+def load_snapshot(path):
+    """Восстановить состояние из снимка, записанного этим же сервером"""
+    global SERVER_EPOCH, last_seq, changes_floor
+    with open(path, 'rb') as snapshot:
+        state = pickle.load(snapshot)
+    if state.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"неподдерживаемая версия снимка: {state.get('version')}")
+    
+    SERVER_EPOCH = state['epoch']
+    last_seq = state['last_seq']
+    changes_floor = state['changes_floor']
+    messages[:] = state['messages']
+    history_changes.clear()
+    history_changes.extend(state['history_changes'])
+    for name in ('users_db', 'private_chats', 'group_chats', 'user_chats', 'chat_list_versions',
+                 'channel_message_ids', 'read_cursors'):
+        store = globals()[name]
+        store.clear()
+        store.update(state[name])
+    with session_lock:
+        session_tokens.clear()
+        tokens_by_user.clear()
+        for token, (username, expires_at) in sorted(state['session_tokens'].items(), key=lambda item: item[1][1]):
+            store_session_token(token, username, expires_at)
+    chat_list_logs.clear()
+    for user_id, log in state['chat_list_logs'].items():
+        chat_list_logs[user_id] = deque(log, maxlen=CHAT_LIST_LOG_LIMIT)
+    usernames_by_id.clear()
+    usernames_by_id.update((data['user_id'], username) for username, data in users_db.items())
+    restored_online.update(state['online'])
+    
+    # Индекс поиска строится в фоне, чтобы не задерживать приём подключений
+    threading.Thread(target=rebuild_search_index, args=(list(messages),), daemon=True).start()
+    log_event(logging.INFO, 'snapshot_restored', path=path, messages=len(messages), users=len(users_db))
+
+def rebuild_search_index(snapshot_messages):
+    """Проиндексировать сообщения, восстановленные из снимка"""
+    for message in snapshot_messages:
+        index_message(message)
+
+def restore_from_env():
+    """Восстановиться из снимка, если процесс запущен перезапуском; вернуть True, если так"""
+    path = os.environ.pop('MESSENGER_RESTORE', None)
+    if not path:
+        return False
+    started = time.perf_counter()
+    load_snapshot(path)
+    print(f"[INIT] Состояние восстановлено из {path} за {time.perf_counter() - started:.3f} с")
+    return True
+
+def state_digest():
+    """Контрольные суммы сохраняемого состояния - для проверки перезапуска"""
+    with history_lock, read_lock, chat_list_lock, session_lock:
+        state = snapshot_state()
+        state.pop('online')
+        # Вход по токену продлевает срок и двигает токен в очереди - сравниваются только владельцы
+        state['session_tokens'] = {token: username for token, (username, _) in sorted(state['session_tokens'].items())}
+        return {name: hashlib.sha256(json.dumps(value, ensure_ascii=False, default=list).encode()).hexdigest()
+                for name, value in state.items()}
+
+def restart_server():
+    """Плавный перезапуск: остановить приём, сохранить снимок и заменить процесс новым"""
+    if restart_state['draining']:
+        return False
+    restart_state['draining'] = True
+    restart_state['online'] = list(user_sessions)
+    started = time.perf_counter()
+    
+    low, high = RESTART_RECONNECT_MS
+    socketio.emit('server_restarting', {'reconnect_min_ms': low, 'reconnect_max_ms': high})
+    time.sleep(RESTART_FLUSH_MS / 1000)
+    
+    size = save_snapshot(SNAPSHOT_PATH)
+    log_event(logging.WARNING, 'restart', snapshot_bytes=size, users=len(users_db), messages=len(messages),
+              drain_ms=round((time.perf_counter() - started) * 1000))
+    stop_control_socket()
+    stop_logging()
+    
+    # werkzeug оставляет слушающий сокет наследуемым и пишет его номер в WERKZEUG_SERVER_FD;
+    # с WERKZEUG_RUN_MAIN новый процесс подхватит этот же сокет, и подключения на время
+    # exec ждут в очереди ядра, а не получают отказ
+    env = dict(os.environ, MESSENGER_RESTORE=SNAPSHOT_PATH)
+    if 'WERKZEUG_SERVER_FD' in env:
+        env['WERKZEUG_RUN_MAIN'] = 'true'
+    os.execve(sys.executable, sys.orig_argv, env)
+
+# ==================== HTML ШАБЛОН ====================
+HTML = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>MessengerProsto</title>
+    <link rel="stylesheet" href="{{ asset_urls['style.css'] }}">
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
 </head>
-<body>
+<body data-serializer="{{ serializer }}">
     <!-- Экран входа -->
     <div id="login-screen" class="login-screen">
         <h1><i class="fas fa-comments"></i> MessengerProsto</h1>
@@ -703,6 +1768,9 @@ HTML = '''
                     <div class="chat-info" id="channel-info"></div>
                 </div>
                 <div class="chat-actions">
+                    <button class="login-btn btn-purple" style="padding: 10px 20px;" onclick="showSearchModal()">
+                        <i class="fas fa-search"></i> Поиск
+                    </button>
                     <button class="login-btn btn-orange" id="clear-history-btn" onclick="clearHistory()" style="padding: 10px 20px; display: none;">
                         <i class="fas fa-trash"></i> Очистить историю
                     </button>
@@ -720,11 +1788,12 @@ HTML = '''
                     <p>Выберите канал слева, чтобы начать общение</p>
                 </div>
             </div>
+            <div id="typing-indicator" class="typing-indicator"></div>
             
             <!-- Поле ввода -->
             <div class="input-area">
                 <div class="input-container">
-                    <textarea id="message-input" placeholder="Напишите сообщение..." rows="1" onkeydown="handleKeyDown(event)" disabled></textarea>
+                    <textarea id="message-input" placeholder="Напишите сообщение..." rows="1" onkeydown="handleKeyDown(event)" oninput="notifyTyping()" disabled></textarea>
                     <button id="send-btn" onclick="sendMessage()" disabled><i class="fas fa-paper-plane"></i></button>
                 </div>
             </div>
@@ -743,758 +1812,189 @@ HTML = '''
             </div>
         </div>
     </div>
-    
-    <!-- Модальное окно создания группы -->
-    <div id="create-group-modal" class="modal hidden">
-        <div class="modal-content">
-            <h2 class="modal-title"><i class="fas fa-users"></i> Создать группу</h2>
-            <input type="text" id="group-name" class="modal-input" placeholder="Название группы" maxlength="20">
-            <textarea id="group-members" class="modal-input" placeholder="ID участников через запятую (6 цифр каждый)" rows="3"></textarea>
-            <div class="modal-buttons">
-                <button class="login-btn btn-purple" onclick="createGroup()">Создать</button>
-                <button class="login-btn btn-red" onclick="hideCreateGroupModal()">Отмена</button>
-            </div>
-        </div>
-    </div>
-    
-    <!-- Модальное окно редактирования сообщения -->
-    <div id="edit-message-modal" class="modal hidden">
-        <div class="modal-content">
-            <h2 class="modal-title"><i class="fas fa-edit"></i> Редактировать сообщение</h2>
-            <textarea id="edit-message-text" class="modal-input" rows="3" placeholder="Введите новый текст сообщения"></textarea>
-            <div class="modal-buttons">
-                <button class="login-btn btn-green" onclick="saveEditedMessage()">Сохранить</button>
-                <button class="login-btn btn-red" onclick="hideEditModal()">Отмена</button>
-            </div>
-        </div>
-    </div>
-
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.5.0/socket.io.min.js"></script>
-    <script>
-        // Глобальные переменные
-        let socket = null;
-        let currentUser = '';
-        let currentUserId = '';
-        let currentChannel = null;
-        let onlineUsers = [];
-        let isMuted = false;
-        let editingMessageId = null;
-        let isAdmin = false;
-        
-        // Инициализация при загрузке
-        document.addEventListener('DOMContentLoaded', function() {
-            socket = io();
-            setupSocketListeners();
-        });
-        
-        // Настройка обработчиков Socket.IO
-        function setupSocketListeners() {
-            socket.on('connect', () => {
-                console.log('Подключено к серверу');
-            });
-            
-            socket.on('disconnect', () => {
-                console.log('Отключено от сервера');
-            });
-            
-            socket.on('auth_success', handleAuthSuccess);
-            socket.on('auth_error', handleAuthError);
-            socket.on('register_success', handleRegisterSuccess);
-            socket.on('register_error', handleRegisterError);
-            
-            socket.on('new_message', handleNewMessage);
-            socket.on('chat_history', handleChatHistory);
-            
-            socket.on('users_update', handleUsersUpdate);
-            socket.on('user_joined', handleUserJoined);
-            socket.on('user_left', handleUserLeft);
-            
-            socket.on('user_banned', handleUserBanned);
-            socket.on('user_muted', handleUserMuted);
-            socket.on('user_kicked', handleUserKicked);
-            
-            socket.on('private_chat_created', handlePrivateChatCreated);
-            socket.on('private_chat_error', handlePrivateChatError);
-            socket.on('private_chats_list', handlePrivateChatsList);
-            socket.on('private_chat_deleted', handlePrivateChatDeleted);
-            
-            socket.on('group_created', handleGroupCreated);
-            socket.on('group_error', handleGroupError);
-            socket.on('groups_list', handleGroupsList);
-            
-            socket.on('message_deleted', handleMessageDeleted);
-            socket.on('message_edited', handleMessageEdited);
-            socket.on('history_cleared', handleHistoryCleared);
-        }
-        
-        // Обработчики событий
-        function handleAuthSuccess(data) {
-            currentUser = data.username;
-            currentUserId = data.user_id;
-            isMuted = data.is_muted || false;
-            isAdmin = data.is_admin || false;
-            
-            document.getElementById('current-user-display').textContent = `Вы: ${currentUser}`;
-            document.getElementById('current-user-id').textContent = currentUserId;
-            document.getElementById('login-screen').classList.add('hidden');
-            document.getElementById('main-interface').classList.remove('hidden');
-            
-            // Загружаем каналы
-            loadChannels();
-            
-            // Запрашиваем приватные чаты и группы
-            socket.emit('get_private_chats');
-            socket.emit('get_groups');
-            
-            // Присоединяемся к общему чату
-            joinChannel('general', '📝 Общий чат', 'public');
-            
-            showSystemMessage(`Добро пожаловать, ${currentUser}!`);
-            
-            console.log('Авторизация успешна:', currentUser, 'ID:', currentUserId, 'Admin:', isAdmin);
-        }
-        
-        function handleAuthError(data) {
-            showError(data.message);
-            console.log('Ошибка авторизации:', data.message);
-        }
-        
-        function handleRegisterSuccess(data) {
-            showSuccess('Регистрация успешна! Теперь войдите.');
-            document.getElementById('username-input').value = '';
-            document.getElementById('password-input').value = '';
-            console.log('Регистрация успешна');
-        }
-        
-        function handleRegisterError(data) {
-            showError(data.message);
-            console.log('Ошибка регистрации:', data.message);
-        }
-        
-        function handleNewMessage(data) {
-            if (currentChannel && data.channel === currentChannel.id) {
-                addMessageToChat(data);
-            }
-        }
-        
-        function handleChatHistory(data) {
-            const container = document.getElementById('messages-container');
-            container.innerHTML = '';
-            
-            if (data.messages.length === 0) {
-                container.innerHTML = `
-                    <div style="text-align: center; color: #999; padding: 40px;">
-                        <i class="fas fa-comment-dots" style="font-size: 48px; margin-bottom: 20px;"></i>
-                        <h3>Нет сообщений</h3>
-                        <p>Будьте первым!</p>
-                    </div>
-                `;
-            } else {
-                data.messages.forEach(msg => {
-                    addMessageToChat(msg);
-                });
-                scrollToBottom();
-            }
-        }
-        
-        function handleUsersUpdate(data) {
-            onlineUsers = data.users;
-            updateOnlineUsers();
-        }
-        
-        function handleUserJoined(data) {
-            if (data.username !== currentUser) {
-                showSystemMessage(`${data.username} подключился`);
-            }
-        }
-        
-        function handleUserLeft(data) {
-            if (data.username !== currentUser) {
-                showSystemMessage(`${data.username} отключился`);
-            }
-        }
-        
-        function handleUserBanned(data) {
-            if (data.username === currentUser) {
-                alert('Вы были забанены администратором!');
-                logout();
-            } else {
-                showSystemMessage(`${data.username} был забанен`);
-            }
-        }
-        
-        function handleUserMuted(data) {
-            if (data.username === currentUser) {
-                isMuted = true;
-                showSystemMessage('Вас заглушили администратором');
-                document.getElementById('message-input').placeholder = 'Вы заглушены!';
-                document.getElementById('message-input').disabled = true;
-                document.getElementById('send-btn').disabled = true;
-            } else {
-                showSystemMessage(`${data.username} был заглушен`);
-            }
-        }
-        
-        function handleUserKicked(data) {
-            if (data.username === currentUser) {
-                alert('Вас кикнули из чата!');
-                logout();
-            } else {
-                showSystemMessage(`${data.username} был кикнут`);
-            }
-        }
-        
-        function handlePrivateChatCreated(data) {
-            hideCreateChatModal();
-            showSystemMessage(`Создан приватный чат с пользователем ${data.other_user}`);
-            socket.emit('get_private_chats');
-            joinChannel(data.chat_id, `🔒 ${data.other_user}`, 'private');
-        }
-        
-        function handlePrivateChatError(data) {
-            showError(data.message);
-        }
-        
-        function handlePrivateChatsList(data) {
-            const container = document.getElementById('private-channels');
-            container.innerHTML = '';
-            
-            if (data.chats.length === 0) {
-                container.innerHTML = '<div style="color: #999; font-size: 12px; padding: 10px;">У вас нет приватных чатов</div>';
-            } else {
-                data.chats.forEach(chat => {
-                    const chatDiv = document.createElement('div');
-                    chatDiv.className = 'channel';
-                    chatDiv.innerHTML = `
-                        <div onclick="joinChannel('${chat.id}', '🔒 ${escapeHtml(chat.name)}', 'private')" style="flex: 1; display: flex; align-items: center;">
-                            <span class="channel-icon"><i class="fas fa-lock"></i></span>
-                            <span>${escapeHtml(chat.name)}</span>
-                        </div>
-                        <div class="channel-actions">
-                            <button class="channel-btn" onclick="leavePrivateChat('${chat.id}', event)" title="Выйти из чата">
-                                <i class="fas fa-sign-out-alt"></i>
-                            </button>
-                            ${chat.is_creator ? `<button class="channel-btn delete" onclick="deletePrivateChat('${chat.id}', event)" title="Удалить чат">
-                                <i class="fas fa-trash"></i>
-                            </button>` : ''}
-                        </div>
-                    `;
-                    
-                    container.appendChild(chatDiv);
-                });
-            }
-        }
-        
-        function handlePrivateChatDeleted(data) {
-            showSystemMessage('Приватный чат был удален');
-            socket.emit('get_private_chats');
-            if (currentChannel && currentChannel.id === data.chat_id) {
-                joinChannel('general', '📝 Общий чат', 'public');
-            }
-        }
-        
-        function handleGroupCreated(data) {
-            hideCreateGroupModal();
-            showSystemMessage(`Создана группа "${data.group_name}"`);
-            socket.emit('get_groups');
-            joinChannel(data.chat_id, `👥 ${data.group_name}`, 'group');
-        }
-        
-        function handleGroupError(data) {
-            showError(data.message);
-        }
-        
-        function handleGroupsList(data) {
-            const container = document.getElementById('group-channels');
-            container.innerHTML = '';
-            
-            if (data.groups.length === 0) {
-                container.innerHTML = '<div style="color: #999; font-size: 12px; padding: 10px;">У вас нет групп</div>';
-            } else {
-                data.groups.forEach(group => {
-                    const groupDiv = document.createElement('div');
-                    groupDiv.className = 'channel';
-                    groupDiv.innerHTML = `
-                        <div onclick="joinChannel('${group.id}', '👥 ${escapeHtml(group.name)}', 'group')" style="flex: 1; display: flex; align-items: center;">
-                            <span class="channel-icon"><i class="fas fa-users"></i></span>
-                            <span>${escapeHtml(group.name)}</span>
-                        </div>
-                        <div class="channel-actions">
-                            <button class="channel-btn" onclick="leaveGroup('${group.id}', event)" title="Выйти из группы">
-                                <i class="fas fa-sign-out-alt"></i>
-                            </button>
-                            ${group.is_creator ? `<button class="channel-btn delete" onclick="deleteGroup('${group.id}', event)" title="Удалить группу">
-                                <i class="fas fa-trash"></i>
-                            </button>` : ''}
-                        </div>
-                    `;
-                    
-                    container.appendChild(groupDiv);
-                });
-            }
-        }
-        
-        function handleMessageDeleted(data) {
-            if (currentChannel && currentChannel.id === data.channel) {
-                const messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
-                if (messageElement) {
-                    messageElement.remove();
-                }
-            }
-        }
-        
-        function handleMessageEdited(data) {
-            if (currentChannel && currentChannel.id === data.channel) {
-                const messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
-                if (messageElement) {
-                    const textElement = messageElement.querySelector('.message-text');
-                    if (textElement) {
-                        textElement.innerHTML = escapeHtml(data.message) + '<span class="message-edited"> (ред.)</span>';
-                    }
-                }
-            }
-        }
-        
-        function handleHistoryCleared(data) {
-            if (currentChannel && currentChannel.id === data.channel) {
-                const container = document.getElementById('messages-container');
-                container.innerHTML = `
-                    <div style="text-align: center; color: #999; padding: 40px;">
-                        <i class="fas fa-comment-dots" style="font-size: 48px; margin-bottom: 20px;"></i>
-                        <h3>История чата очищена</h3>
-                        <p>Начните общение заново!</p>
-                    </div>
-                `;
-            }
-        }
-        
-        // Функции UI
-        function showError(message) {
-            const element = document.getElementById('error-message');
-            element.textContent = message;
-            setTimeout(() => {
-                element.textContent = '';
-            }, 3000);
-        }
-        
-        function showSuccess(message) {
-            const element = document.getElementById('success-message');
-            element.textContent = message;
-            setTimeout(() => {
-                element.textContent = '';
-            }, 3000);
-        }
-        
-        function showSystemMessage(text) {
-            const container = document.getElementById('messages-container');
-            const placeholder = container.querySelector('div[style*="text-align: center"]');
-            if (placeholder) placeholder.remove();
-            
-            const messageDiv = document.createElement('div');
-            messageDiv.className = 'message system';
-            
-            const time = new Date().toLocaleTimeString('ru-RU', {
-                hour: '2-digit',
-                minute: '2-digit'
-            });
-            
-            messageDiv.innerHTML = `
-                <div class="message-header">
-                    <span class="message-username">SYSTEM</span>
-                    <span class="message-time">${time}</span>
-                </div>
-                <div class="message-text">${escapeHtml(text)}</div>
-            `;
-            
-            container.appendChild(messageDiv);
-            scrollToBottom();
-        }
-        
-        function addMessageToChat(data) {
-            const container = document.getElementById('messages-container');
-            const placeholder = container.querySelector('div[style*="text-align: center"]');
-            if (placeholder) placeholder.remove();
-            
-            const messageDiv = document.createElement('div');
-            messageDiv.className = `message ${data.type === 'system' ? 'system' : data.is_private ? 'private' : data.is_group ? 'group' : ''}`;
-            messageDiv.dataset.messageId = data.id;
-            
-            const time = new Date(data.timestamp).toLocaleTimeString('ru-RU', {
-                hour: '2-digit',
-                minute: '2-digit'
-            });
-            
-            const displayName = data.username === currentUser ? 'Вы' : data.username;
-            const isOwnMessage = data.username === currentUser;
-            const canDelete = isOwnMessage || isAdmin;
-            
-            const editedBadge = data.edited ? '<span class="message-edited"> (ред.)</span>' : '';
-            
-            messageDiv.innerHTML = `
-                <div class="message-header">
-                    <span class="message-username">${escapeHtml(displayName)}</span>
-                    <span class="message-time">${time}</span>
-                </div>
-                <div class="message-text">${escapeHtml(data.message)}${editedBadge}</div>
-                ${canDelete && data.type !== 'system' ? `
-                    <div class="message-actions">
-                        ${isOwnMessage ? `
-                        <button class="message-btn" onclick="editMessage(${data.id})" title="Редактировать">
-                            <i class="fas fa-edit"></i>
-                        </button>
-                        ` : ''}
-                        <button class="message-btn delete" onclick="deleteMessage(${data.id})" title="Удалить">
-                            <i class="fas fa-trash"></i>
-                        </button>
-                    </div>
-                ` : ''}
-            `;
-            
-            container.appendChild(messageDiv);
-            scrollToBottom();
-        }
-        
-        function scrollToBottom() {
-            const container = document.getElementById('messages-container');
-            container.scrollTop = container.scrollHeight;
-        }
-        
-        function loadChannels() {
-            // Публичные каналы
-            const publicContainer = document.getElementById('public-channels');
-            publicContainer.innerHTML = `
-                <div class="channel active" onclick="joinChannel('general', '📝 Общий чат', 'public')">
-                    <div>
-                        <span class="channel-icon">#</span>
-                        <span>Общий чат</span>
-                    </div>
-                </div>
-                <div class="channel" onclick="joinChannel('games', '🎮 Игры', 'public')">
-                    <div>
-                        <span class="channel-icon">#</span>
-                        <span>Игры</span>
-                    </div>
-                </div>
-                <div class="channel" onclick="joinChannel('music', '🎵 Музыка', 'public')">
-                    <div>
-                        <span class="channel-icon">#</span>
-                        <span>Музыка</span>
-                    </div>
-                </div>
-                <div class="channel" onclick="joinChannel('memes', '😂 Мемы', 'public')">
-                    <div>
-                        <span class="channel-icon">#</span>
-                        <span>Мемы</span>
-                    </div>
-                </div>
-            `;
-        }
-        
-        function updateOnlineUsers() {
-            const container = document.getElementById('online-users');
-            const countElement = document.getElementById('online-count');
-            
-            container.innerHTML = '';
-            countElement.textContent = onlineUsers.length;
-            
-            // Добавляем всех пользователей
-            onlineUsers.forEach(user => {
-                const userItem = document.createElement('div');
-                userItem.className = 'user-item';
-                const isCurrentUser = user.user_id === currentUserId;
-                
-                userItem.innerHTML = `
-                    <div>
-                        <div class="user-status online"></div>
-                        <span>${escapeHtml(user.username)}${isCurrentUser ? ' (Вы)' : ''}</span>
-                    </div>
-                    <div class="user-id-badge">${user.user_id}</div>
-                `;
-                container.appendChild(userItem);
-            });
-        }
-        
-        // Основные функции
-        function login() {
-            const username = document.getElementById('username-input').value.trim();
-            const password = document.getElementById('password-input').value;
-            
-            if (!username || !password) {
-                showError('Заполните все поля');
-                return;
-            }
-            
-            console.log('Попытка входа:', username);
-            socket.emit('login', {
-                username: username,
-                password: password
-            });
-        }
-        
-        function register() {
-            const username = document.getElementById('username-input').value.trim();
-            const password = document.getElementById('password-input').value;
-            
-            if (!username || !password) {
-                showError('Заполните все поля');
-                return;
-            }
-            
-            if (username.length < 3) {
-                showError('Имя должно быть не менее 3 символов');
-                return;
-            }
-            
-            console.log('Попытка регистрации:', username);
-            socket.emit('register', {
-                username: username,
-                password: password
-            });
-        }
-        
-        function logout() {
-            if (confirm('Выйти из аккаунта?')) {
-                socket.disconnect();
-                currentUser = '';
-                currentUserId = '';
-                document.getElementById('main-interface').classList.add('hidden');
-                document.getElementById('login-screen').classList.remove('hidden');
-                document.getElementById('username-input').value = '';
-                document.getElementById('password-input').value = '';
-                location.reload();
-            }
-        }
-        
-        function joinChannel(channelId, channelName, channelType) {
-            currentChannel = { id: channelId, name: channelName, type: channelType };
-            
-            // Обновляем UI
-            document.querySelectorAll('.channel').forEach(ch => ch.classList.remove('active'));
-            const activeChannel = Array.from(document.querySelectorAll('.channel')).find(ch => 
-                ch.textContent.includes(channelName.replace('🔒 ', '').replace('👥 ', '')) || 
-                (channelType === 'private' && ch.textContent.includes('🔒')) ||
-                (channelType === 'group' && ch.textContent.includes('👥'))
-            );
-            if (activeChannel) activeChannel.classList.add('active');
-            
-            document.getElementById('current-channel').textContent = channelName;
-            let channelInfo = '';
-            if (channelType === 'private') channelInfo = 'Приватный чат';
-            else if (channelType === 'group') channelInfo = 'Групповой чат';
-            else channelInfo = 'Публичный канал';
-            document.getElementById('channel-info').textContent = channelInfo;
-            
-            // Показываем кнопку очистки истории
-            const clearBtn = document.getElementById('clear-history-btn');
-            clearBtn.style.display = 'block';
-            
-            // Активируем поле ввода
-            document.getElementById('message-input').disabled = isMuted;
-            document.getElementById('send-btn').disabled = isMuted;
-            document.getElementById('message-input').placeholder = isMuted ? 'Вы заглушены!' : 'Напишите сообщение...';
-            
-            // Запрашиваем историю
-            socket.emit('join_channel', {
-                channel_id: channelId,
-                channel_type: channelType
-            });
-        }
-        
-        function sendMessage() {
-            const input = document.getElementById('message-input');
-            const message = input.value.trim();
-            
-            if (!message || !currentChannel || isMuted) return;
-            
-            socket.emit('send_message', {
-                channel: currentChannel.id,
-                message: message,
-                channel_type: currentChannel.type
-            });
-            
-            input.value = '';
-            input.style.height = 'auto';
-        }
-        
-        function handleKeyDown(event) {
-            if (event.key === 'Enter' && !event.shiftKey) {
-                event.preventDefault();
-                sendMessage();
-            }
-        }
-        
-        function showCreateChatModal() {
-            document.getElementById('create-chat-modal').classList.remove('hidden');
-            document.getElementById('invite-user-id').focus();
-        }
-        
-        function hideCreateChatModal() {
-            document.getElementById('create-chat-modal').classList.add('hidden');
-            document.getElementById('invite-user-id').value = '';
-        }
-        
-        function createPrivateChat() {
-            const userId = document.getElementById('invite-user-id').value.trim();
-            
-            if (!userId) {
-                showError('Введите ID пользователя');
-                return;
-            }
-            
-            if (userId === currentUserId) {
-                showError('Нельзя создать чат с самим собой');
-                return;
-            }
-            
-            socket.emit('create_private_chat', {
-                target_user_id: userId
-            });
-        }
-        
-        function showCreateGroupModal() {
-            document.getElementById('create-group-modal').classList.remove('hidden');
-            document.getElementById('group-name').focus();
-        }
-        
-        function hideCreateGroupModal() {
-            document.getElementById('create-group-modal').classList.add('hidden');
-            document.getElementById('group-name').value = '';
-            document.getElementById('group-members').value = '';
-        }
-        
-        function createGroup() {
-            const groupName = document.getElementById('group-name').value.trim();
-            const membersText = document.getElementById('group-members').value.trim();
-            
-            if (!groupName) {
-                showError('Введите название группы');
-                return;
-            }
-            
-            if (!membersText) {
-                showError('Введите ID участников');
-                return;
-            }
-            
-            const members = membersText.split(',').map(id => id.trim()).filter(id => id);
-            
-            if (members.length === 0) {
-                showError('Введите хотя бы одного участника');
-                return;
-            }
-            
-            socket.emit('create_group', {
-                group_name: groupName,
-                members: members
-            });
-        }
-        
-        function leavePrivateChat(chatId, event) {
-            event.stopPropagation();
-            if (confirm('Вы уверены, что хотите выйти из этого чата?')) {
-                socket.emit('leave_private_chat', { chat_id: chatId });
-            }
-        }
-        
-        function deletePrivateChat(chatId, event) {
-            event.stopPropagation();
-            if (confirm('Вы уверены, что хотите удалить этот чат? Это действие удалит чат для всех участников.')) {
-                socket.emit('delete_private_chat', { chat_id: chatId });
-            }
-        }
-        
-        function leaveGroup(chatId, event) {
-            event.stopPropagation();
-            if (confirm('Вы уверены, что хотите выйти из этой группы?')) {
-                socket.emit('leave_group', { chat_id: chatId });
-            }
-        }
-        
-        function deleteGroup(chatId, event) {
-            event.stopPropagation();
-            if (confirm('Вы уверены, что хотите удалить эту группу? Это действие удалит группу для всех участников.')) {
-                socket.emit('delete_group', { chat_id: chatId });
-            }
-        }
-        
-        function deleteMessage(messageId) {
-            if (confirm('Удалить это сообщение?')) {
-                socket.emit('delete_message', {
-                    message_id: messageId,
-                    channel: currentChannel.id
-                });
-            }
-        }
-        
-        function editMessage(messageId) {
-            const messageElement = document.querySelector(`[data-message-id="${messageId}"]`);
-            if (messageElement) {
-                const textElement = messageElement.querySelector('.message-text');
-                let text = textElement.textContent;
-                // Убираем "(ред.)" если есть
-                text = text.replace(' (ред.)', '');
-                document.getElementById('edit-message-text').value = text;
-                editingMessageId = messageId;
-                document.getElementById('edit-message-modal').classList.remove('hidden');
-            }
-        }
-        
-        function hideEditModal() {
-            document.getElementById('edit-message-modal').classList.add('hidden');
-            editingMessageId = null;
-        }
-        
-        function saveEditedMessage() {
-            const newText = document.getElementById('edit-message-text').value.trim();
-            if (!newText) {
-                showError('Введите текст сообщения');
-                return;
-            }
-            
-            if (editingMessageId) {
-                socket.emit('edit_message', {
-                    message_id: editingMessageId,
-                    channel: currentChannel.id,
-                    message: newText
-                });
-                hideEditModal();
-            }
-        }
-        
-        function clearHistory() {
-            if (confirm('Очистить всю историю этого чата? Это действие нельзя отменить.')) {
-                socket.emit('clear_history', {
-                    channel: currentChannel.id,
-                    channel_type: currentChannel.type
-                });
-            }
-        }
-        
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
-        }
-    </script>
+    
+    <!-- Модальное окно создания группы -->
+    <div id="create-group-modal" class="modal hidden">
+        <div class="modal-content">
+            <h2 class="modal-title"><i class="fas fa-users"></i> Создать группу</h2>
+            <input type="text" id="group-name" class="modal-input" placeholder="Название группы" maxlength="20">
+            <textarea id="group-members" class="modal-input" placeholder="ID участников через запятую (6 цифр каждый)" rows="3"></textarea>
+            <div class="modal-buttons">
+                <button class="login-btn btn-purple" onclick="createGroup()">Создать</button>
+                <button class="login-btn btn-red" onclick="hideCreateGroupModal()">Отмена</button>
+            </div>
+        </div>
+    </div>
+    
+    <!-- Модальное окно поиска -->
+    <div id="search-modal" class="modal hidden">
+        <div class="modal-content">
+            <h2 class="modal-title"><i class="fas fa-search"></i> Поиск сообщений</h2>
+            <input type="text" id="search-query" class="modal-input" placeholder="Что ищем?" maxlength="200" onkeydown="if (event.key === 'Enter') searchMessages()">
+            <label style="display: block; margin-bottom: 15px; color: #999;">
+                <input type="checkbox" id="search-all-channels"> Во всех чатах
+            </label>
+            <div id="search-results" class="search-results"></div>
+            <div class="modal-buttons">
+                <button class="login-btn btn-green" onclick="searchMessages()">Найти</button>
+                <button class="login-btn btn-purple hidden" id="search-more-btn" onclick="emitSearch()">Ещё</button>
+                <button class="login-btn btn-red" onclick="hideSearchModal()">Закрыть</button>
+            </div>
+        </div>
+    </div>
+    
+    <!-- Модальное окно редактирования сообщения -->
+    <div id="edit-message-modal" class="modal hidden">
+        <div class="modal-content">
+            <h2 class="modal-title"><i class="fas fa-edit"></i> Редактировать сообщение</h2>
+            <textarea id="edit-message-text" class="modal-input" rows="3" placeholder="Введите новый текст сообщения"></textarea>
+            <div class="modal-buttons">
+                <button class="login-btn btn-green" onclick="saveEditedMessage()">Сохранить</button>
+                <button class="login-btn btn-red" onclick="hideEditModal()">Отмена</button>
+            </div>
+        </div>
+    </div>
+
+    <script src="{{ asset_urls['socket.io.min.js'] }}"></script>
+    {% if serializer == 'msgpack' %}<script src="{{ asset_urls['msgpack-parser.js'] }}"></script>{% endif %}
+    <script src="{{ asset_urls['app.js'] }}"></script>
 </body>
 </html>
 '''
 
+# ==================== ПРЕДСОБРАННЫЕ ОТВЕТЫ ====================
+precompiled = {}        # path: {content_type, etag, variants: {encoding: bytes}}
+
+def precompile(path, body, content_type):
+    """Один раз подготовить тело ответа и его сжатые варианты"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    
+    variants = {'identity': body}
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(compressed) < len(body):
+        variants['gzip'] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=11)
+        if len(compressed) < len(body):
+            variants['br'] = compressed
+    
+    precompiled[path] = {
+        'content_type': content_type,
+        'etag': hashlib.sha256(body).hexdigest()[:32],
+        'variants': variants
+    }
+    return precompiled[path]
+
+def send_precompiled(entry, cache_control):
+    """Отдать предсобранный ответ с учётом Accept-Encoding и If-None-Match"""
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in entry['variants'] and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    
+    # У каждого варианта сжатия свой строгий ETag
+    etag = entry['etag'] if encoding == 'identity' else f"{entry['etag']}-{encoding}"
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding'
+    }
+    
+    if request.if_none_match.contains(etag) or request.if_none_match.star_tag:
+        return Response(status=304, headers=headers)
+    
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(entry['variants'][encoding], content_type=entry['content_type'],
+                    headers=headers, direct_passthrough=True)
+
+# ==================== СТАТИЧЕСКИЕ ФАЙЛЫ КЛИЕНТА ====================
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_ASSETS = {
+    'style.css': 'text/css; charset=utf-8',
+    'app.js': 'application/javascript; charset=utf-8',
+    'socket.io.min.js': 'application/javascript; charset=utf-8',
+    'msgpack-parser.js': 'application/javascript; charset=utf-8',
+}
+asset_urls = {}         # имя файла: /assets/<имя с хэшем содержимого>
+
+def load_static_assets():
+    """Прочитать файлы клиента и зарегистрировать их под именами с хэшем"""
+    for name, content_type in STATIC_ASSETS.items():
+        with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+            body = f.read()
+        stem, ext = os.path.splitext(name)
+        path = f'/assets/{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}'
+        precompile(path, body, content_type)
+        asset_urls[name] = path
+
 # ==================== ВЕБ-ОБРАБОТЧИКИ ====================
+# Страница зависит только от имён файлов, поэтому рендерим её один раз при запуске
+load_static_assets()
+with app.app_context():
+    precompile('/', render_template_string(HTML, asset_urls=asset_urls, serializer=SOCKETIO_SERIALIZER),
+               'text/html; charset=utf-8')
+
 @app.route('/')
 def index():
-    return render_template_string(HTML)
+    return send_precompiled(precompiled['/'], 'no-cache')
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/assets/<name>')
+def asset(name):
+    entry = precompiled.get(f'/assets/{name}')
+    if entry is None:
+        abort(404)
+    # Имя меняется вместе с содержимым, поэтому файл можно кэшировать навсегда
+    return send_precompiled(entry, 'public, max-age=31536000, immutable')
 
 # ==================== SOCKET.IO ОБРАБОТЧИКИ ====================
 
 # ---------- АВТОРИЗАЦИЯ ----------
+@socketio.on('connect')
+def handle_connect(auth=None):
+    # Во время перезапуска подключения не принимаются - клиент повторит попытку к новому процессу
+    if restart_state['draining']:
+        return False
+    
+    # Переподключение с токеном - вход без пароля
+    token = auth.get('token') if isinstance(auth, dict) else None
+    if isinstance(token, str):
+        resume_session(token, 0)
+
+@socketio.on('resume_session')
+def handle_resume_session(data):
+    """Повтор входа по токену после login_queued"""
+    token = data.get('token')
+    if request.sid in online_users or not isinstance(token, str):
+        return
+    
+    resume_session(token, data.get('attempt'))
+
+def resume_session(token, attempt):
+    """Вход по токену через тот же допуск, что и вход по паролю"""
+    if not login_slots.acquire(blocking=False):
+        queue_login(attempt, resume=True)
+        return
+    try:
+        username = resume_session_token(token)
+        if username is None or username not in users_db or is_user_banned(username):
+            emit('session_expired', {})
+            return
+        start_session(username, token, resumed=True)
+    finally:
+        login_slots.release()
+
 @socketio.on('register')
 def handle_register(data):
     username = data.get('username', '').strip()
     password = data.get('password', '').strip()
     
-    print(f"[DEBUG] Регистрация: {username}")
-    
     if not username or not password:
         emit('register_error', {'message': 'Заполните все поля'})
         return
@@ -1519,20 +2019,30 @@ def handle_register(data):
         'muted_until': None,
         'admin': (username == 'admin')
     }
+    usernames_by_id[user_id] = username
     
-    print(f"[DEBUG] Зарегистрирован: {username}, ID: {user_id}")
+    log_event(logging.INFO, 'register', username=username, user_id=user_id)
     
     emit('register_success', {'message': 'Регистрация успешна! Теперь войдите.'})
 
 @socketio.on('login')
 def handle_login(data):
+    # Все слоты заняты - клиент повторит вход сам через retry_after_ms
+    if not login_slots.acquire(blocking=False):
+        queue_login(data.get('attempt'))
+        return
+    try:
+        process_login(data)
+    finally:
+        login_slots.release()
+
+def process_login(data):
+    """Проверка пароля и вход после допуска"""
     username = data.get('username', '').strip()
     password = data.get('password', '').strip()
     
-    print(f"[DEBUG] Попытка входа: {username}")
-    
     if username not in users_db:
-        print(f"[DEBUG] Пользователь {username} не найден")
+        log_event(logging.INFO, 'login_failed', username=username, reason='unknown_user')
         emit('auth_error', {'message': 'Пользователь не найден'})
         return
     
@@ -1541,59 +2051,114 @@ def handle_login(data):
     input_hash = hash_password(password)
     
     if input_hash != stored_hash:
-        print(f"[DEBUG] Неверный пароль для {username}")
+        log_event(logging.INFO, 'login_failed', username=username, reason='bad_password')
         emit('auth_error', {'message': 'Неверный пароль'})
         return
     
     if is_user_banned(username):
-        print(f"[DEBUG] Пользователь {username} забанен")
+        log_event(logging.INFO, 'login_failed', username=username, reason='banned')
         emit('auth_error', {'message': 'Вы забанены'})
         return
     
-    # Авторизация успешна
-    online_users[request.sid] = {
-        'username': username,
-        'user_id': users_db[username]['user_id'],
-        'joined_at': datetime.datetime.now().isoformat()
-    }
-    
-    print(f"[DEBUG] Успешный вход: {username}, ID: {users_db[username]['user_id']}")
+    start_session(username, issue_session_token(username))
+
+def start_session(username, token, resumed=False):
+    """Общая часть входа по паролю и по токену после переподключения"""
+    # С другого устройства пользователь может быть уже в сети
+    first_session = add_session(request.sid, username)
+    fetch_delay_ms = login_fetch_delay()
+    session = online_users[request.sid]
+    session['session_token'] = token
+    # Списки, история и счётчики непрочитанного - не раньше назначенной паузы
+    session['fetch_after'] = time.monotonic() + fetch_delay_ms / 1000
+    session['counts_pending'] = True
+    
+    log_event(logging.INFO, 'session_resumed' if resumed else 'login',
+              username=username, user_id=users_db[username]['user_id'], sid=request.sid)
     
     emit('auth_success', {
         'username': username,
         'user_id': users_db[username]['user_id'],
         'is_muted': is_user_muted(username),
-        'is_admin': is_user_admin(username)
+        'is_admin': is_user_admin(username),
+        'fetch_delay_ms': fetch_delay_ms,
+        'session_token': token,
+        'resumed': resumed
     })
     
-    # Уведомляем всех о новом пользователе
-    emit('user_joined', {'username': username}, broadcast=True, skip_sid=request.sid)
-    
-    # Обновляем список онлайн пользователей
-    update_online_users()
-    
-    # Отправляем системное сообщение
-    broadcast_system_message(f'👋 {username} присоединился к чату')
+    # Новичку список онлайн сразу, остальным - вместе с другими входами за окно.
+    # Вернувшихся после перезапуска сервера не объявляем: для остальных они не уходили
+    update_online_users(to=request.sid)
+    if username in restored_online:
+        restored_online.discard(username)
+        first_session = False
+    announce_presence(username, 'joined' if first_session else None)
 
 # ---------- ЧАТЫ ----------
 @socketio.on('join_channel')
 def handle_join_channel(data):
-    if request.sid not in online_users:
+    if request.sid not in online_users or fetch_deferred('join_channel', data):
         return
     
     username = online_users[request.sid]['username']
     channel_id = data.get('channel_id')
     channel_type = data.get('channel_type')
     
-    print(f"[DEBUG] {username} присоединился к каналу {channel_id}")
+    if not can_read_channel(online_users[request.sid]['user_id'], channel_id):
+        emit('system_message', {'message': 'Нет доступа к этому чату'})
+        return
+    
+    log_event(logging.DEBUG, 'join_channel', username=username, channel=channel_id)
+    set_viewing(request.sid, channel_id)
+    
+    # Клиент с кэшем присылает последний известный номер - отдаём только дельту
+    last_id = data.get('last_id')
+    delta = None
+    if isinstance(last_id, int) and data.get('epoch') == SERVER_EPOCH:
+        delta = get_history_delta(channel_id, last_id)
+    
+    if delta is not None:
+        new_messages, changes, cursor = delta
+        emit('chat_history', {
+            'channel': channel_id,
+            'messages': new_messages,
+            'changes': changes,
+            'cursor': cursor,
+            'epoch': SERVER_EPOCH,
+            'reset': False
+        })
+        return
     
     # Отправляем историю сообщений для этого канала
-    if channel_type == 'public':
-        channel_messages = [msg for msg in messages if msg.get('channel') == channel_id]
-    else:  # private или group
-        channel_messages = [msg for msg in messages if msg.get('channel') == channel_id]
+    cursor = last_seq
+    channel_messages = [msg for msg in messages if msg.get('channel') == channel_id]
+    
+    emit('chat_history', {
+        'channel': channel_id,
+        'messages': channel_messages[-HISTORY_LIMIT:],
+        'cursor': cursor,
+        'epoch': SERVER_EPOCH,
+        'reset': True
+    })
+
+@socketio.on('load_older')
+def handle_load_older(data):
+    """Следующая страница истории при прокрутке вверх"""
+    if request.sid not in online_users:
+        return
+    
+    channel_id = data.get('channel_id')
+    before_id = data.get('before_id')
+    if not isinstance(before_id, int) or not can_read_channel(online_users[request.sid]['user_id'], channel_id):
+        return
     
-    emit('chat_history', {'messages': channel_messages[-50:]})
+    older, next_before_id = get_older_messages(channel_id, before_id)
+    emit('older_messages', {
+        'channel': channel_id,
+        'messages': older,
+        'has_more': next_before_id is not None,
+        'before_id': next_before_id
+    })
 
 @socketio.on('send_message')
 def handle_send_message(data):
@@ -1606,8 +2171,6 @@ def handle_send_message(data):
     message_text = data.get('message', '').strip()
     channel_type = data.get('channel_type', 'public')
     
-    print(f"[DEBUG] Сообщение от {username} в {channel}: {message_text}")
-    
     # Проверка на мут
     if is_user_muted(username):
         emit('system_message', {'message': 'Вы заглушены и не можете отправлять сообщения'})
@@ -1634,33 +2197,30 @@ def handle_send_message(data):
             emit('system_message', {'message': 'Чат не найден'})
             return
     
-    # Определяем тип чата для сообщения
-    is_private = False
-    is_group = False
-    if channel_type == 'private':
-        is_private = True
-    elif channel_type == 'group':
-        is_group = True
-    
-    # Создаем сообщение
+    # Создаем сообщение; поля со значениями по умолчанию (type='message',
+    # is_private/is_group/edited=False) не храним и не передаём клиентам
     message = {
-        'id': get_next_message_id(),
         'username': username,
         'message': message_text,
-        'timestamp': datetime.datetime.now().isoformat(),
-        'type': 'message',
-        'channel': channel,
-        'is_private': is_private,
-        'is_group': is_group,
-        'edited': False
+        'timestamp': now_ms(),
+        'channel': channel
     }
+    if channel_type == 'private':
+        message['is_private'] = True
+    elif channel_type == 'group':
+        message['is_group'] = True
     
-    # Сохраняем сообщение
-    messages.append(message)
+    # Сохраняем сообщение; своё сообщение автор уже прочитал
+    store_message(message)
+    index_message(message)
+    set_read_cursor(user_id, channel, message['id'])
+    clear_typing(user_id, username, channel)
+    log_event(logging.DEBUG, 'send_message', username=username, channel=channel,
+              message_id=message['id'], length=len(message_text))
     
     # Отправляем сообщение
     if channel_type == 'public':
-        emit('new_message', message, broadcast=True)
+        deliver_message(message)
     else:  # private или group
         # Определяем список участников
         participants = []
@@ -1669,11 +2229,24 @@ def handle_send_message(data):
         elif channel in group_chats:
             participants = group_chats[channel]['users']
         
-        # Отправляем только участникам
+        # Отправляем только участникам - на все их устройства
         for participant_id in participants:
-            for sid, user_data in online_users.items():
-                if user_data['user_id'] == participant_id:
-                    emit('new_message', message, room=sid)
+            for sid in get_user_sids(participant_id):
+                deliver_message(message, room=sid)
+
+@socketio.on('typing')
+def handle_typing(data):
+    """Пользователь печатает в открытом канале - сообщить тем, кто его тоже открыл"""
+    user = online_users.get(request.sid)
+    if user is None or not isinstance(data, dict):
+        return
+    
+    # Доступ к каналу проверен при join_channel; печатать можно только в открытом
+    channel_id = data.get('channel')
+    if channel_id is None or viewing.get(request.sid) != channel_id or is_user_muted(user['username']):
+        return
+    if claim_typing(user['user_id'], channel_id, now_ms()):
+        announce_typing(channel_id, user['username'])
 
 # ---------- ПРИВАТНЫЕ ЧАТЫ ----------
 @socketio.on('create_private_chat')
@@ -1685,8 +2258,6 @@ def handle_create_private_chat(data):
     user_id = online_users[request.sid]['user_id']
     target_user_id = data.get('target_user_id', '').strip()
     
-    print(f"[DEBUG] {username} создает приватный чат с ID: {target_user_id}")
-    
     # Проверяем, существует ли целевой пользователь
     target_username, target_data = get_user_by_id(target_user_id)
     if not target_username:
@@ -1714,7 +2285,7 @@ def handle_create_private_chat(data):
         'type': 'private'
     }
     
-    print(f"[DEBUG] Создан приватный чат {chat_id} между {username} и {target_username}")
+    log_event(logging.INFO, 'private_chat_created', chat_id=chat_id, creator=username, other_user=target_username)
     
     # Уведомляем создателя
     emit('private_chat_created', {
@@ -1723,46 +2294,35 @@ def handle_create_private_chat(data):
     })
     
     # Уведомляем второго пользователя, если он онлайн
-    for sid, user_data in online_users.items():
-        if user_data['user_id'] == target_user_id:
-            emit('private_chat_created', {
-                'chat_id': chat_id,
-                'other_user': username
-            }, room=sid)
-            break
-    
-    # Отправляем обновленный список приватных чатов обоим пользователям
-    send_private_chats_to_user(request.sid)
-    for sid, user_data in online_users.items():
-        if user_data['user_id'] == target_user_id:
-            send_private_chats_to_user(sid)
-            break
+    for sid in get_user_sids(target_user_id):
+        emit('private_chat_created', {
+            'chat_id': chat_id,
+            'other_user': username
+        }, room=sid)
+    
+    # Добавляем чат в списки обоих пользователей
+    push_chat_list_change([user_id, target_user_id], 'add', chat_id, 'private')
 
-@socketio.on('get_private_chats')
-def handle_get_private_chats():
-    if request.sid not in online_users:
+# ---------- СПИСОК ЧАТОВ ----------
+@socketio.on('get_chat_list')
+def handle_get_chat_list(data=None):
+    if request.sid not in online_users or fetch_deferred('get_chat_list', data):
         return
     
-    send_private_chats_to_user(request.sid)
+    # Первый запрос списка после входа - заодно счётчики непрочитанного
+    if online_users[request.sid].pop('counts_pending', False):
+        send_initial_unread_counts(request.sid)
+    send_chat_list(request.sid, (data or {}).get('version'))
 
-def send_private_chats_to_user(sid):
-    """Отправить список приватных чатов пользователю"""
-    user_id = online_users[sid]['user_id']
-    user_chats = []
-    
-    for chat_id, chat_data in private_chats.items():
-        if user_id in chat_data['users'] and chat_data['type'] == 'private':
-            # Находим имя другого пользователя
-            other_user_id = chat_data['users'][0] if chat_data['users'][1] == user_id else chat_data['users'][1]
-            other_username, _ = get_user_by_id(other_user_id)
-            
-            user_chats.append({
-                'id': chat_id,
-                'name': other_username if other_username else 'Неизвестный',
-                'is_creator': (chat_data['creator_id'] == user_id)
-            })
+@socketio.on('chat_list_ack')
+def handle_chat_list_ack(data):
+    if request.sid not in online_users:
+        return
     
-    emit('private_chats_list', {'chats': user_chats}, room=sid)
+    version = data.get('version')
+    if isinstance(version, int):
+        online_users[request.sid]['chat_list_version'] = version
+        trim_chat_list_log(online_users[request.sid]['user_id'])
 
 @socketio.on('leave_private_chat')
 def handle_leave_private_chat(data):
@@ -1773,7 +2333,7 @@ def handle_leave_private_chat(data):
     user_id = online_users[request.sid]['user_id']
     chat_id = data.get('chat_id')
     
-    print(f"[DEBUG] {username} выходит из приватного чата {chat_id}")
+    log_event(logging.INFO, 'leave_private_chat', username=username, chat_id=chat_id)
     
     if chat_id not in private_chats:
         emit('system_message', {'message': 'Приватный чат не найден'})
@@ -1788,31 +2348,20 @@ def handle_leave_private_chat(data):
     
     # Удаляем пользователя из списка участников
     chat_data['users'].remove(user_id)
+    push_chat_list_change([user_id], 'remove', chat_id, 'private')
     
     # Если в чате остался только один участник или никого, удаляем чат
     if len(chat_data['users']) <= 1:
         # Уведомляем оставшегося участника (если есть)
         for participant_id in chat_data['users']:
-            for sid, user_data in online_users.items():
-                if user_data['user_id'] == participant_id:
-                    emit('private_chat_deleted', {'chat_id': chat_id}, room=sid)
-                    break
+            for sid in get_user_sids(participant_id):
+                emit('private_chat_deleted', {'chat_id': chat_id}, room=sid)
+        push_chat_list_change(chat_data['users'], 'remove', chat_id, 'private')
         
         # Удаляем чат
         del private_chats[chat_id]
         # Удаляем все сообщения этого чата
-        global messages
-        messages = [msg for msg in messages if msg.get('channel') != chat_id]
-    else:
-        # Обновляем список приватных чатов для всех участников
-        for participant_id in chat_data['users']:
-            for sid, user_data in online_users.items():
-                if user_data['user_id'] == participant_id:
-                    send_private_chats_to_user(sid)
-                    break
-    
-    # Обновляем список для вышедшего пользователя
-    send_private_chats_to_user(request.sid)
+        clear_channel_messages(chat_id)
     
     emit('system_message', {'message': 'Вы вышли из приватного чата'})
 
@@ -1825,8 +2374,6 @@ def handle_delete_private_chat(data):
     user_id = online_users[request.sid]['user_id']
     chat_id = data.get('chat_id')
     
-    print(f"[DEBUG] {username} удаляет приватный чат {chat_id}")
-    
     if chat_id not in private_chats:
         emit('system_message', {'message': 'Приватный чат не найден'})
         return
@@ -1840,20 +2387,16 @@ def handle_delete_private_chat(data):
     
     # Уведомляем всех участников об удалении чата
     for participant_id in chat_data['users']:
-        for sid, user_data in online_users.items():
-            if user_data['user_id'] == participant_id:
-                emit('private_chat_deleted', {'chat_id': chat_id}, room=sid)
-                # Обновляем список приватных чатов
-                send_private_chats_to_user(sid)
-                break
+        for sid in get_user_sids(participant_id):
+            emit('private_chat_deleted', {'chat_id': chat_id}, room=sid)
+    push_chat_list_change(chat_data['users'], 'remove', chat_id, 'private')
     
     # Удаляем чат
     del private_chats[chat_id]
     # Удаляем все сообщения этого чата
-    global messages
-    messages = [msg for msg in messages if msg.get('channel') != chat_id]
+    clear_channel_messages(chat_id)
     
-    print(f"[DEBUG] Приватный чат {chat_id} удален пользователем {username}")
+    log_event(logging.INFO, 'private_chat_deleted', chat_id=chat_id, username=username)
 
 # ---------- ГРУППЫ ----------
 @socketio.on('create_group')
@@ -1866,8 +2409,6 @@ def handle_create_group(data):
     group_name = data.get('group_name', '').strip()
     members = data.get('members', [])
     
-    print(f"[DEBUG] {username} создает группу: {group_name}")
-    
     if not group_name:
         emit('group_error', {'message': 'Введите название группы'})
         return
@@ -1902,7 +2443,7 @@ def handle_create_group(data):
         'type': 'group'
     }
     
-    print(f"[DEBUG] Создана группа {chat_id}: {group_name} с {len(valid_members)} участниками")
+    log_event(logging.INFO, 'group_created', chat_id=chat_id, creator=username, members=len(valid_members))
     
     # Уведомляем создателя
     emit('group_created', {
@@ -1913,42 +2454,39 @@ def handle_create_group(data):
     # Уведомляем участников, если они онлайн
     for member_id in valid_members:
         if member_id != user_id:  # Создателя уже уведомили
-            for sid, user_data in online_users.items():
-                if user_data['user_id'] == member_id:
-                    emit('group_created', {
-                        'chat_id': chat_id,
-                        'group_name': group_name
-                    }, room=sid)
-                    break
-    
-    # Отправляем обновленный список групп всем участникам
-    for member_id in valid_members:
-        for sid, user_data in online_users.items():
-            if user_data['user_id'] == member_id:
-                send_groups_to_user(sid)
-                break
+            for sid in get_user_sids(member_id):
+                emit('group_created', {
+                    'chat_id': chat_id,
+                    'group_name': group_name
+                }, room=sid)
+    
+    # Добавляем группу в списки всех участников
+    push_chat_list_change(valid_members, 'add', chat_id, 'group')
 
-@socketio.on('get_groups')
-def handle_get_groups():
+@socketio.on('rename_group')
+def handle_rename_group(data):
     if request.sid not in online_users:
         return
     
-    send_groups_to_user(request.sid)
-
-def send_groups_to_user(sid):
-    """Отправить список групп пользователю"""
-    user_id = online_users[sid]['user_id']
-    user_groups = []
+    user_id = online_users[request.sid]['user_id']
+    chat_id = data.get('chat_id')
+    group_name = data.get('group_name', '').strip()
+    
+    if chat_id not in group_chats:
+        emit('system_message', {'message': 'Группа не найдена'})
+        return
+    
+    chat_data = group_chats[chat_id]
+    if chat_data['creator_id'] != user_id:
+        emit('system_message', {'message': 'Только создатель группы может ее переименовать'})
+        return
     
-    for chat_id, chat_data in group_chats.items():
-        if user_id in chat_data['users'] and chat_data['type'] == 'group':
-            user_groups.append({
-                'id': chat_id,
-                'name': chat_data['name'],
-                'is_creator': (chat_data['creator_id'] == user_id)
-            })
+    if not group_name:
+        emit('group_error', {'message': 'Введите название группы'})
+        return
     
-    emit('groups_list', {'groups': user_groups}, room=sid)
+    chat_data['name'] = group_name
+    push_chat_list_change(chat_data['users'], 'rename', chat_id, 'group')
 
 @socketio.on('leave_group')
 def handle_leave_group(data):
@@ -1959,7 +2497,7 @@ def handle_leave_group(data):
     user_id = online_users[request.sid]['user_id']
     chat_id = data.get('chat_id')
     
-    print(f"[DEBUG] {username} выходит из группы {chat_id}")
+    log_event(logging.INFO, 'leave_group', username=username, chat_id=chat_id)
     
     if chat_id not in group_chats:
         emit('system_message', {'message': 'Группа не найдена'})
@@ -1979,30 +2517,19 @@ def handle_leave_group(data):
     
     # Удаляем пользователя из списка участников
     chat_data['users'].remove(user_id)
+    push_chat_list_change([user_id], 'remove', chat_id, 'group')
     
     # Если в группе остался только один участник, удаляем группу
     if len(chat_data['users']) <= 1:
         # Уведомляем оставшегося участника (создателя)
-        for sid, user_data in online_users.items():
-            if user_data['user_id'] == chat_data['creator_id']:
-                emit('system_message', {'message': f'Группа "{chat_data["name"]}" удалена, так как все вышли'}, room=sid)
-                break
+        for sid in get_user_sids(chat_data['creator_id']):
+            emit('system_message', {'message': f'Группа "{chat_data["name"]}" удалена, так как все вышли'}, room=sid)
+        push_chat_list_change(chat_data['users'], 'remove', chat_id, 'group')
         
         # Удаляем группу
         del group_chats[chat_id]
         # Удаляем все сообщения этой группы
-        global messages
-        messages = [msg for msg in messages if msg.get('channel') != chat_id]
-    else:
-        # Обновляем список групп для всех участников
-        for participant_id in chat_data['users']:
-            for sid, user_data in online_users.items():
-                if user_data['user_id'] == participant_id:
-                    send_groups_to_user(sid)
-                    break
-    
-    # Обновляем список для вышедшего пользователя
-    send_groups_to_user(request.sid)
+        clear_channel_messages(chat_id)
     
     emit('system_message', {'message': f'Вы вышли из группы "{chat_data["name"]}"'})
 
@@ -2015,8 +2542,6 @@ def handle_delete_group(data):
     user_id = online_users[request.sid]['user_id']
     chat_id = data.get('chat_id')
     
-    print(f"[DEBUG] {username} удаляет группу {chat_id}")
-    
     if chat_id not in group_chats:
         emit('system_message', {'message': 'Группа не найдена'})
         return
@@ -2030,20 +2555,16 @@ def handle_delete_group(data):
     
     # Уведомляем всех участников об удалении группы
     for participant_id in chat_data['users']:
-        for sid, user_data in online_users.items():
-            if user_data['user_id'] == participant_id:
-                emit('system_message', {'message': f'Группа "{chat_data["name"]}" была удалена создателем'}, room=sid)
-                # Обновляем список групп
-                send_groups_to_user(sid)
-                break
+        for sid in get_user_sids(participant_id):
+            emit('system_message', {'message': f'Группа "{chat_data["name"]}" была удалена создателем'}, room=sid)
+    push_chat_list_change(chat_data['users'], 'remove', chat_id, 'group')
     
     # Удаляем группу
     del group_chats[chat_id]
     # Удаляем все сообщения этой группы
-    global messages
-    messages = [msg for msg in messages if msg.get('channel') != chat_id]
+    clear_channel_messages(chat_id)
     
-    print(f"[DEBUG] Группа {chat_id} удалена пользователем {username}")
+    log_event(logging.INFO, 'group_deleted', chat_id=chat_id, username=username)
 
 # ---------- УДАЛЕНИЕ И РЕДАКТИРОВАНИЕ СООБЩЕНИЙ ----------
 @socketio.on('delete_message')
@@ -2055,16 +2576,10 @@ def handle_delete_message(data):
     message_id = data.get('message_id')
     channel = data.get('channel')
     
-    print(f"[DEBUG] {username} удаляет сообщение {message_id} в канале {channel}")
-    
     # Находим сообщение
-    message_to_delete = None
-    for msg in messages:
-        if msg['id'] == message_id and msg['channel'] == channel:
-            message_to_delete = msg
-            break
+    message_to_delete = find_message(message_id) if isinstance(message_id, int) else None
     
-    if not message_to_delete:
+    if not message_to_delete or message_to_delete['channel'] != channel:
         emit('system_message', {'message': 'Сообщение не найдено'})
         return
     
@@ -2073,16 +2588,20 @@ def handle_delete_message(data):
         emit('system_message', {'message': 'Вы можете удалять только свои сообщения'})
         return
     
-    # Удаляем сообщение
-    messages.remove(message_to_delete)
+    # Удаляем сообщение; параллельный запрос мог удалить его раньше
+    seq = remove_message(message_to_delete)
+    if seq is None:
+        return
+    unindex_message(message_to_delete)
     
     # Рассылаем событие об удалении сообщения
-    emit('message_deleted', {
+    deliver_change('message_deleted', {
         'message_id': message_id,
-        'channel': channel
-    }, broadcast=True)
+        'channel': channel,
+        'seq': seq
+    })
     
-    print(f"[DEBUG] Сообщение {message_id} удалено пользователем {username}")
+    log_event(logging.INFO, 'message_deleted', message_id=message_id, channel=channel, username=username)
 
 @socketio.on('edit_message')
 def handle_edit_message(data):
@@ -2094,20 +2613,14 @@ def handle_edit_message(data):
     channel = data.get('channel')
     new_text = data.get('message', '').strip()
     
-    print(f"[DEBUG] {username} редактирует сообщение {message_id}")
-    
     if not new_text:
         emit('system_message', {'message': 'Сообщение не может быть пустым'})
         return
     
     # Находим сообщение
-    message_to_edit = None
-    for msg in messages:
-        if msg['id'] == message_id and msg['channel'] == channel:
-            message_to_edit = msg
-            break
+    message_to_edit = find_message(message_id) if isinstance(message_id, int) else None
     
-    if not message_to_edit:
+    if not message_to_edit or message_to_edit['channel'] != channel:
         emit('system_message', {'message': 'Сообщение не найдено'})
         return
     
@@ -2117,17 +2630,21 @@ def handle_edit_message(data):
         return
     
     # Обновляем сообщение
+    unindex_message(message_to_edit)
     message_to_edit['message'] = new_text
     message_to_edit['edited'] = True
+    index_message(message_to_edit)
+    seq = record_change(channel, 'edit', message_id, new_text)
     
     # Рассылаем событие об редактировании сообщения
-    emit('message_edited', {
+    deliver_change('message_edited', {
         'message_id': message_id,
         'channel': channel,
-        'message': new_text
-    }, broadcast=True)
+        'message': new_text,
+        'seq': seq
+    })
     
-    print(f"[DEBUG] Сообщение {message_id} отредактировано пользователем {username}")
+    log_event(logging.DEBUG, 'message_edited', message_id=message_id, channel=channel, username=username)
 
 @socketio.on('clear_history')
 def handle_clear_history(data):
@@ -2139,8 +2656,6 @@ def handle_clear_history(data):
     channel = data.get('channel')
     channel_type = data.get('channel_type')
     
-    print(f"[DEBUG] {username} очищает историю канала {channel}")
-    
     # Проверяем права
     if channel_type == 'public':
         # Для публичных каналов только администратор
@@ -2165,28 +2680,86 @@ def handle_clear_history(data):
             return
     
     # Удаляем все сообщения канала
-    global messages
-    messages = [msg for msg in messages if msg.get('channel') != channel]
+    seq = clear_channel_messages(channel)
     
     # Рассылаем событие об очистке истории
-    emit('history_cleared', {'channel': channel}, broadcast=True)
+    deliver_change('history_cleared', {'channel': channel, 'seq': seq})
+    
+    log_event(logging.INFO, 'history_cleared', channel=channel, username=username)
+
+# ---------- ПРОЧИТАННЫЕ ----------
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    """Клиент присылает накопленные курсоры пачкой, а не на каждое сообщение"""
+    if request.sid not in online_users:
+        return
+    
+    user_id = online_users[request.sid]['user_id']
+    cursors = data.get('cursors')
+    if not isinstance(cursors, dict):
+        return
+    
+    moved = []
+    for channel, message_id in list(cursors.items())[:READ_CURSORS_PER_REQUEST]:
+        if isinstance(message_id, int) and can_read_channel(user_id, channel):
+            if set_read_cursor(user_id, channel, message_id):
+                moved.append(channel)
+    
+    # Остальные устройства пользователя обновляют свои счётчики
+    if moved:
+        for sid in get_user_sids(user_id):
+            if sid != request.sid:
+                send_unread_counts(sid, moved)
+
+# ---------- ПОИСК ----------
+@socketio.on('search_messages')
+def handle_search_messages(data):
+    if request.sid not in online_users:
+        return
     
-    print(f"[DEBUG] История канала {channel} очищена пользователем {username}")
+    user_id = online_users[request.sid]['user_id']
+    query = str(data.get('query', ''))[:200]
+    channel = data.get('channel')
+    offset = data.get('offset', 0)
+    if not isinstance(offset, int) or offset < 0:
+        offset = 0
+    
+    # Без канала ищем по всем доступным: публичным и чатам пользователя
+    if channel:
+        if not can_read_channel(user_id, channel):
+            emit('system_message', {'message': 'Нет доступа к этому чату'})
+            return
+        channel_ids = [channel]
+    else:
+        channel_ids = [item['id'] for item in channels] + list(user_chats.get(user_id, ()))
+    
+    results, total = search_channels(channel_ids, query, offset)
+    emit('search_results', {
+        'query': query,
+        'channel': channel,
+        'results': results,
+        'offset': offset,
+        'total': total,
+        'has_more': offset + len(results) < total
+    })
 
 # ---------- ПОЛЬЗОВАТЕЛИ ----------
+@socketio.on('logout')
+def handle_logout():
+    if request.sid not in online_users:
+        return
+    
+    # После выхода токен этого устройства не должен пускать без пароля
+    revoke_session_token(online_users[request.sid]['session_token'])
+
 @socketio.on('disconnect')
 def handle_disconnect():
-    if request.sid in online_users:
-        username = online_users[request.sid]['username']
-        del online_users[request.sid]
-        
-        print(f"[DEBUG] Пользователь отключился: {username}")
+    username, still_online = remove_session(request.sid)
+    if username is not None and not restart_state['draining']:
+        log_event(logging.INFO, 'disconnect', username=username, sid=request.sid)
         
-        # Уведомляем остальных об отключении
-        emit('user_left', {'username': username}, broadcast=True)
-        
-        # Обновляем список онлайн пользователей
-        update_online_users()
+        # Об уходе объявляем, только когда закрылось последнее устройство
+        announce_presence(username, None if still_online else 'left')
 
 # ==================== АДМИН-КОМАНДЫ (в терминале) ====================
 
@@ -2205,6 +2778,12 @@ def admin_commands():
     print("  /unmute <ник>   - Снять мут")
     print("  /prog kill <ник> - Принудительно завершить сессию")
     print("  /broadcast <текст> - Отправить сообщение всем")
+    print("  /limits         - Статистика ограничения запросов")
+    print("  /compression    - Статистика сжатия WebSocket")
+    print("  /prof start [мс] - Начать профилирование обработчиков")
+    print("  /prof stop      - Остановить и сохранить стеки (.folded)")
+    print("  /prof top [N]   - Самые дорогие обработчики и функции")
+    print("  /restart        - Перезапуск без потери состояния и сессий")
     print("  /help           - Показать эту справку")
     print("  /exit           - Выйти из админ-панели")
     print("="*50)
@@ -2228,6 +2807,12 @@ def admin_commands():
                 print("  /unmute <ник>   - Снять мут")
                 print("  /prog kill <ник> - Принудительно завершить сессию")
                 print("  /broadcast <текст> - Отправить сообщение всем")
+                print("  /limits         - Статистика ограничения запросов")
+                print("  /compression    - Статистика сжатия WebSocket")
+                print("  /prof start [мс] - Начать профилирование обработчиков")
+                print("  /prof stop      - Остановить и сохранить стеки (.folded)")
+                print("  /prof top [N]   - Самые дорогие обработчики и функции")
+                print("  /restart        - Перезапуск без потери состояния и сессий")
                 print("  /help           - Показать эту справку")
                 print("  /exit           - Выйти из админ-панели")
                 
@@ -2245,6 +2830,63 @@ def admin_commands():
                 for sid, data in online_users.items():
                     print(f"  {data['username']} (ID: {data['user_id']}, sid: {sid[:8]}...)")
                     
+            elif command == "/limits":
+                print(f"\nКорзин в памяти: {len(rate_buckets)} (максимум {RATE_LIMIT_MAX_BUCKETS})")
+                if not rate_limit_stats:
+                    print("  Отклонённых запросов нет")
+                for event, count in sorted(rate_limit_stats.items(), key=lambda item: -item[1]):
+                    print(f"  {event}: отклонено {count}")
+                    
+            elif command == "/compression":
+                print(f"\nПорог сжатия: {WS_COMPRESSION_THRESHOLD} байт")
+                if not compression_stats:
+                    print("  Кадров ещё не было")
+                for event, (frames, raw, sent, plain) in sorted(compression_stats.items(), key=lambda item: -item[1][1]):
+                    ratio = sent / raw if raw else 1
+                    print(f"  {event}: кадров {frames} (без сжатия {plain}), {raw} -> {sent} байт, коэффициент {ratio:.2f}")
+                    
+            elif command == "/prof start" or command.startswith("/prof start "):
+                parts = command.split()
+                try:
+                    interval = int(parts[2]) if len(parts) > 2 else PROFILE_INTERVAL_MS
+                except ValueError:
+                    print("Использование: /prof start [период в мс]")
+                    continue
+                if start_profiling(max(interval, 1)):
+                    print(f"Профилирование запущено, стеки снимаются каждые {max(interval, 1)} мс")
+                else:
+                    print("Профилирование уже идёт")
+                    
+            elif command == "/prof stop":
+                path = stop_profiling()
+                if path:
+                    print(f"Профилирование остановлено, снимков: {profile_state['samples']}")
+                    print(f"Стеки сохранены в {path} (flamegraph.pl, speedscope)")
+                else:
+                    print("Профилирование не запущено")
+                    
+            elif command == "/prof top" or command.startswith("/prof top "):
+                parts = command.split()
+                limit = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 10
+                handlers, top_own, top_inclusive = profile_top(limit)
+                if not handlers:
+                    print("Данных нет: запустите /prof start")
+                    continue
+                print("\nОбработчики (суммарное время):")
+                for event, (calls, total, longest) in handlers:
+                    print(f"  {event}: вызовов {calls}, всего {total * 1000:.1f} мс, "
+                          f"в среднем {total / calls * 1000:.2f} мс, максимум {longest * 1000:.2f} мс")
+                print("\nФункции (собственное время по снимкам):")
+                for name, share in top_own:
+                    print(f"  {share:6.1%}  {name}")
+                print("\nФункции (вместе с вызванными):")
+                for name, share in top_inclusive:
+                    print(f"  {share:6.1%}  {name}")
+                    
+            elif command == "/restart":
+                print("Перезапуск: сохраняю состояние...")
+                restart_server()
+                    
             elif command.startswith("/ban "):
                 parts = command.split(" ", 1)
                 if len(parts) == 2:
@@ -2312,143 +2954,268 @@ def admin_commands():
                 print(f"Неизвестная команда: {command}")
                 print("Введите /help для списка команд")
                 
+        except EOFError:
+            # stdin закрыт (запуск из службы или с перенаправлением) - панель не нужна
+            break
         except Exception as e:
             print(f"Ошибка: {e}")
 
+def apply_ban(username):
+    """Забанить и отключить все устройства пользователя, без объявлений"""
+    if username not in users_db:
+        return False
+    users_db[username]['banned'] = True
+    revoke_session_tokens(username)
+    for sid in get_sessions(username):
+        socketio.emit('user_banned', {'username': username}, room=sid)
+        socketio.server.disconnect(sid)
+        remove_session(sid)
+    return True
+
+def apply_unban(username):
+    """Снять бан, без объявлений"""
+    if username not in users_db:
+        return False
+    users_db[username]['banned'] = False
+    return True
+
+def apply_kick(username):
+    """Отключить все устройства пользователя; False - его нет в сети"""
+    revoke_session_tokens(username)
+    sessions = get_sessions(username)
+    for sid in sessions:
+        socketio.emit('user_kicked', {'username': username}, room=sid)
+        socketio.server.disconnect(sid)
+        remove_session(sid)
+    return bool(sessions)
+
+def apply_mute(username, minutes):
+    """Заглушить пользователя и уведомить его устройства, без объявлений"""
+    if username not in users_db:
+        return False
+    muted_until = datetime.datetime.now() + datetime.timedelta(minutes=minutes)
+    users_db[username]['muted_until'] = muted_until.isoformat()
+    for sid in get_sessions(username):
+        socketio.emit('user_muted', {'username': username}, room=sid)
+    return True
+
+def apply_unmute(username):
+    """Снять мут, без объявлений"""
+    if username not in users_db:
+        return False
+    users_db[username]['muted_until'] = None
+    return True
+
+def apply_kill(username):
+    """Завершить все сессии пользователя; False - его нет в сети"""
+    revoke_session_tokens(username)
+    sessions = get_sessions(username)
+    for sid in sessions:
+        socketio.emit('system_message', {'message': 'Ваша сессия была завершена администратором'}, room=sid)
+        socketio.server.disconnect(sid)
+        remove_session(sid)
+    return bool(sessions)
+
+# действие: (функция, объявление для одного, для нескольких, меняет ли список онлайн)
+MODERATION_ACTIONS = {
+    'ban': (apply_ban, '🚫 Пользователь {names} был забанен администратором',
+            '🚫 Администратор забанил пользователей: {names}', True),
+    'unban': (apply_unban, None, None, False),
+    'kick': (apply_kick, '👢 Пользователь {names} был кикнут администратором',
+             '👢 Администратор кикнул пользователей: {names}', True),
+    'mute': (apply_mute, '🔇 Пользователь {names} заглушен на {minutes} минут',
+             '🔇 Заглушены на {minutes} минут: {names}', False),
+    'unmute': (apply_unmute, None, None, False),
+    'kill': (apply_kill, '🔌 Сессия пользователя {names} была завершена администратором',
+             '🔌 Администратор завершил сессии пользователей: {names}', True),
+}
+ANNOUNCE_NAMES_LIMIT = 20       # сколько имён перечислять в объявлении о массовом действии
+
+def moderate(action, usernames, **options):
+    """Применить действие ко всем пользователям, затем одно объявление и одно обновление онлайна"""
+    apply, single, plural, presence = MODERATION_ACTIONS[action]
+    done, missing = [], []
+    with presence_batch():
+        for username in dict.fromkeys(usernames):
+            (done if apply(username, **options) else missing).append(username)
+        if done and presence:
+            announce_presence()
+    
+    if done and single:
+        names = ', '.join(done[:ANNOUNCE_NAMES_LIMIT])
+        if len(done) > ANNOUNCE_NAMES_LIMIT:
+            names += f' и ещё {len(done) - ANNOUNCE_NAMES_LIMIT}'
+        template = single if len(done) == 1 else plural
+        broadcast_system_message(template.format(names=names, **options))
+    
+    log_event(logging.INFO, 'moderation', action=action, done=len(done), missing=len(missing))
+    return {'done': done, 'missing': missing}
+
 def ban_user(username):
     """Забанить пользователя"""
-    if username in users_db:
-        users_db[username]['banned'] = True
-        
-        # Отключаем пользователя если он онлайн
-        for sid, data in list(online_users.items()):
-            if data['username'] == username:
-                socketio.emit('user_banned', {'username': username}, room=sid)
-                # Отключаем пользователя
-                socketio.server.disconnect(sid)
-                if sid in online_users:
-                    del online_users[sid]
-                break
-        
-        broadcast_system_message(f'🚫 Пользователь {username} был забанен администратором')
+    if moderate('ban', [username])['done']:
         print(f'Пользователь {username} забанен')
-        update_online_users()
         return True
-    else:
-        print(f'Пользователь {username} не найден')
-        return False
+    print(f'Пользователь {username} не найден')
+    return False
 
 def unban_user(username):
     """Разбанить пользователя"""
-    if username in users_db:
-        users_db[username]['banned'] = False
+    if moderate('unban', [username])['done']:
         print(f'Пользователь {username} разбанен')
         return True
-    else:
-        print(f'Пользователь {username} не найден')
-        return False
+    print(f'Пользователь {username} не найден')
+    return False
 
 def kick_user(username):
     """Кикнуть пользователя"""
-    # Ищем пользователя онлайн
-    kicked = False
-    for sid, data in list(online_users.items()):
-        if data['username'] == username:
-            socketio.emit('user_kicked', {'username': username}, room=sid)
-            # Отключаем пользователя
-            socketio.server.disconnect(sid)
-            del online_users[sid]
-            kicked = True
-            break
-    
-    if kicked:
-        broadcast_system_message(f'👢 Пользователь {username} был кикнут администратором')
+    if moderate('kick', [username])['done']:
         print(f'Пользователь {username} кикнут')
-        update_online_users()
         return True
-    else:
-        print(f'Пользователь {username} не в сети')
-        return False
+    print(f'Пользователь {username} не в сети')
+    return False
 
 def mute_user(username, minutes):
     """Заглушить пользователя"""
-    if username in users_db:
-        muted_until = datetime.datetime.now() + datetime.timedelta(minutes=minutes)
-        users_db[username]['muted_until'] = muted_until.isoformat()
-        
-        # Уведомляем пользователя если он онлайн
-        for sid, data in online_users.items():
-            if data['username'] == username:
-                socketio.emit('user_muted', {'username': username}, room=sid)
-                break
-        
-        broadcast_system_message(f'🔇 Пользователь {username} заглушен на {minutes} минут')
+    if moderate('mute', [username], minutes=minutes)['done']:
         print(f'Пользователь {username} заглушен на {minutes} минут')
         return True
-    else:
-        print(f'Пользователь {username} не найден')
-        return False
+    print(f'Пользователь {username} не найден')
+    return False
 
 def unmute_user(username):
     """Снять мут с пользователя"""
-    if username in users_db:
-        users_db[username]['muted_until'] = None
+    if moderate('unmute', [username])['done']:
         print(f'Мут снят с пользователя {username}')
         return True
-    else:
-        print(f'Пользователь {username} не найден')
-        return False
+    print(f'Пользователь {username} не найден')
+    return False
 
 def kill_session(username):
     """Принудительно завершить сессию пользователя"""
-    killed = False
-    for sid, data in list(online_users.items()):
-        if data['username'] == username:
-            # Отправляем сообщение пользователю
-            socketio.emit('system_message', {'message': 'Ваша сессия была завершена администратором'}, room=sid)
-            # Отключаем пользователя
-            socketio.server.disconnect(sid)
-            del online_users[sid]
-            killed = True
-            break
-    
-    if killed:
-        broadcast_system_message(f'🔌 Сессия пользователя {username} была завершена администратором')
+    if moderate('kill', [username])['done']:
         print(f'Сессия пользователя {username} завершена')
-        update_online_users()
         return True
-    else:
-        print(f'Пользователь {username} не в сети')
-        return False
+    print(f'Пользователь {username} не в сети')
+    return False
+
+# ==================== УПРАВЛЯЮЩИЙ СОКЕТ ====================
+# Локальный Unix-сокет для скриптов: одна строка JSON - запрос, одна строка JSON - ответ.
+# Клиент: python adminctl.py ban --file users.txt
+CONTROL_SOCKET = CONFIG.control_socket     # None - выключен
+CONTROL_MAX_REQUEST = 4 * 1024 * 1024   # байт в одном запросе
+
+control_server = None
+
+def handle_control_command(command):
+    """Выполнить запрос управляющего сокета и вернуть ответ"""
+    cmd = command.get('cmd')
+    if cmd == 'ping':
+        return {'ok': True}
+    if cmd == 'restart':
+        # Ответ уходит до замены процесса
+        threading.Thread(target=restart_server, daemon=True).start()
+        return {'ok': True}
+    if cmd == 'state_digest':
+        return {'ok': True, 'digest': state_digest(), 'pid': os.getpid()}
+    if cmd == 'online':
+        return {'ok': True, 'users': {username: len(sessions) for username, sessions in user_sessions.items()}}
+    if cmd == 'broadcast':
+        text = str(command.get('text', '')).strip()
+        if not text:
+            return {'ok': False, 'error': 'пустой текст'}
+        broadcast_system_message(f"📢 АДМИНИСТРАТОР: {text}")
+        return {'ok': True}
+    if cmd in MODERATION_ACTIONS:
+        usernames = command.get('users')
+        if not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+            return {'ok': False, 'error': 'users должен быть списком имён'}
+        options = {}
+        if cmd == 'mute':
+            minutes = command.get('minutes')
+            if not isinstance(minutes, int) or minutes <= 0:
+                return {'ok': False, 'error': 'minutes должен быть положительным числом'}
+            options['minutes'] = minutes
+        return dict(moderate(cmd, [name.strip() for name in usernames if name.strip()], **options), ok=True)
+    return {'ok': False, 'error': f'неизвестная команда: {cmd}'}
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    """Соединение управляющего сокета: запросы построчно"""
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline(CONTROL_MAX_REQUEST)
+            if not line:
+                return
+            try:
+                command = json.loads(line)
+                if not isinstance(command, dict):
+                    raise ValueError('ожидался объект JSON')
+                response = handle_control_command(command)
+            except ValueError as e:
+                response = {'ok': False, 'error': f'некорректный запрос: {e}'}
+            except Exception as e:
+                log_event(logging.ERROR, 'control_error', error=repr(e))
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+def start_control_socket():
+    """Открыть управляющий сокет, если он включён и поддерживается системой"""
+    global control_server
+    if not CONTROL_SOCKET or not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+        return None
+    if os.path.exists(CONTROL_SOCKET):
+        os.unlink(CONTROL_SOCKET)
+    # Доступ только владельцу процесса
+    old_umask = os.umask(0o177)
+    try:
+        control_server = socketserver.ThreadingUnixStreamServer(CONTROL_SOCKET, ControlRequestHandler)
+    finally:
+        os.umask(old_umask)
+    control_server.daemon_threads = True
+    threading.Thread(target=control_server.serve_forever, daemon=True).start()
+    atexit.register(stop_control_socket)
+    log_event(logging.INFO, 'control_socket', path=CONTROL_SOCKET)
+    return CONTROL_SOCKET
+
+def stop_control_socket():
+    """Закрыть управляющий сокет и удалить его файл"""
+    global control_server
+    if control_server is not None:
+        control_server.shutdown()
+        control_server.server_close()
+        control_server = None
+        if os.path.exists(CONTROL_SOCKET):
+            os.unlink(CONTROL_SOCKET)
 
 # ==================== ЗАПУСК СЕРВЕРА ====================
-def open_browser():
+def open_browser(url):
     time.sleep(1)
-    webbrowser.open('http://localhost:5000')
+    webbrowser.open(url)
 
 def start_admin_panel():
     """Запуск админ-панели в отдельном потоке"""
-    time.sleep(2)
     admin_commands()
 
-if __name__ == '__main__':
+def run_server(config):
+    """Запуск с параметрами командной строки; debug и браузер - только с --dev"""
+    url = f"http://{'localhost' if config.host in ('0.0.0.0', '::') else config.host}:{config.port}"
     print("=" * 60)
     print("MESSENGERPROSTO - ЗАПУСК")
     print("=" * 60)
-    print("Совместим с Python 3.12")
-    print("Использует threading mode")
-    print("=" * 60)
-    print("Адрес: http://localhost:5000")
-    print("=" * 60)
-    print("Тестовый аккаунт: admin / admin123")
-    print("АДМИН-ПАНЕЛЬ доступна в терминале!")
+    print(f"Режим: {config.async_mode}{', разработка (debug)' if config.dev else ''}")
+    print(f"Адрес: {url} (слушает {config.host}:{config.port})")
+    print(f"Проверка соединения: каждые {config.ping_interval:g} с, ожидание {config.ping_timeout:g} с")
     print("=" * 60)
     
+    # После /restart процесс запущен заново и восстанавливает состояние из снимка
+    restored = restore_from_env()
+    
     # Создаем тестового пользователя admin если его нет
     if 'admin' not in users_db:
         admin_hash = hash_password('admin123')
         admin_id = generate_user_id()
-        print(f"[INIT] Создаю пользователя admin (ID: {admin_id})")
+        print(f"[INIT] Создаю пользователя admin (ID: {admin_id}), пароль admin123")
         users_db['admin'] = {
             'password_hash': admin_hash,
             'user_id': admin_id,
@@ -2457,20 +3224,31 @@ if __name__ == '__main__':
             'muted_until': None,
             'admin': True
         }
+        usernames_by_id[admin_id] = 'admin'
     else:
         print(f"[INIT] Пользователь admin уже существует")
     
-    # Автоматически открываем браузер
-    threading.Thread(target=open_browser, daemon=True).start()
+    # Браузер открываем только при разработке (после перезапуска вкладки уже открыты)
+    if config.dev and not restored:
+        threading.Thread(target=open_browser, args=(url,), daemon=True).start()
     
-    # Запускаем админ-панель в отдельном потоке
-    admin_thread = threading.Thread(target=start_admin_panel, daemon=True)
-    admin_thread.start()
+    # Админ-панель - если есть терминал; без него управление через управляющий сокет
+    if config.console:
+        print("АДМИН-ПАНЕЛЬ доступна в терминале!")
+        threading.Thread(target=start_admin_panel, daemon=True).start()
     
-    # Запускаем сервер
-    try:
-        socketio.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=False, allow_unsafe_werkzeug=True)
-    except Exception as e:
-        print(f"Ошибка запуска сервера: {e}")
-        print("Попробуйте изменить порт на 5001")
-        socketio.run(app, host='0.0.0.0', port=5001, debug=True, use_reloader=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # Управляющий сокет для скриптов
+    control_path = start_control_socket()
+    if control_path:
+        print(f"Управляющий сокет: {control_path}")
+    
+    # Время от старта процесса до готовности принимать подключения
+    log_event(logging.WARNING, 'startup', host=config.host, port=config.port, async_mode=config.async_mode,
+              restored=restored, init_ms=round((time.perf_counter() - PROCESS_STARTED) * 1000))
+    
+    # werkzeug сам сообщает о занятом порте и завершает процесс с кодом 1
+    socketio.run(app, host=config.host, port=config.port, debug=config.dev, use_reloader=False,
+                 log_output=config.dev, allow_unsafe_werkzeug=True)
+
+if __name__ == '__main__':
+    run_server(CONFIG)
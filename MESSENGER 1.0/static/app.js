@@ -0,0 +1,1531 @@
+// Глобальные переменные
+let socket = null;
+let currentUser = '';
+let currentUserId = '';
+let currentChannel = null;
+let onlineUsers = [];
+let isMuted = false;
+let editingMessageId = null;
+let isAdmin = false;
+
+// Кэш истории каналов: channelId -> {cursor, epoch, messages}
+const CACHE_LIMIT = 200;
+let channelCache = {};
+let cacheDb = null;
+let cacheReady = Promise.resolve();
+const cacheSaveTimers = {};
+
+// Приватные чаты и группы: id -> {id, kind, name, is_creator}
+const chatList = new Map();
+let chatListVersion = null;     // версия, до которой список применён
+let chatListLoading = false;    // идёт приём страниц полного списка
+let chatListResyncing = false;  // запрошены пропущенные дельты
+let pendingChatDeltas = [];     // дельты, пришедшие во время загрузки страниц
+let chatListAckTimer = null;
+
+// Непрочитанные сообщения: channelId -> число и последний прочитанный ID
+const READ_FLUSH_DELAY = 1000;  // курсоры копим и отправляем пачкой
+let unreadCounts = {};
+let readCursors = {};
+let pendingReadCursors = {};
+let readFlushTimer = null;
+
+// Текущий поисковый запрос и сколько результатов уже показано
+let searchState = { query: '', channel: null, offset: 0 };
+
+// Виртуальный список сообщений текущего канала
+const HISTORY_PAGE_SIZE = 50;       // столько сообщений сервер отдаёт за раз
+const LIST_BUFFER = 15;             // строк запаса над и под видимой областью
+const ESTIMATED_ROW_HEIGHT = 80;    // высота ещё не измеренной строки, px
+const OLDER_PAGE_THRESHOLD = 300;   // px до верха, когда подгружаем старые сообщения
+const ROW_POOL_LIMIT = 100;
+const messageList = {
+    messages: [],           // модель: все сообщения текущего канала
+    heights: new Map(),     // id -> измеренная высота строки
+    rows: new Map(),        // id -> элемент в DOM
+    pool: [],               // элементы для повторного использования
+    placeholder: '',
+    hasMore: false,
+    olderBefore: null,      // с какого ID продолжать подгрузку старых
+    loadingOlder: false,
+    stickToBottom: true,
+    rowGap: null,
+    frame: 0,
+    elements: null
+};
+let localMessageCounter = 0;
+
+// Индикатор набора: свой typing не чаще раза в окно, чужие гаснут сами
+const TYPING_THROTTLE_MS = 8000;    // то же окно, что и на сервере
+let lastTypingSent = { channel: null, at: 0 };
+const typingUsers = new Map();      // username -> таймер, гасящий индикатор
+let typingCrowd = { count: 0, timer: null };    // печатающие сверх переданных имён
+let sessionToken = null;       // вход без пароля при переподключении
+let restartPending = false;
+let pendingLogin = null;        // вход, ожидающий ответа или повтора после login_queued
+let loginRetryTimer = null;
+
+// Инициализация при загрузке
+document.addEventListener('DOMContentLoaded', function() {
+    // Токен сессии уходит при каждом (пере)подключении - после перезапуска
+    // сервера вход восстанавливается без пароля
+    const options = { auth: callback => callback(sessionToken ? { token: sessionToken } : {}) };
+    // Формат пакетов задаёт сервер при сборке страницы
+    if (document.body.dataset.serializer === 'msgpack') options.parser = msgpackParser;
+    socket = io(options);
+    setupSocketListeners();
+});
+
+// Настройка обработчиков Socket.IO
+function setupSocketListeners() {
+    socket.on('connect', () => {
+        restartPending = false;
+        console.log('Подключено к серверу');
+    });
+
+    // Сервер отклоняет подключения, пока сохраняет состояние - пробуем ещё раз
+    socket.on('connect_error', () => {
+        if (restartPending && !socket.active) {
+            setTimeout(() => socket.connect(), 1000);
+        }
+    });
+
+    socket.on('disconnect', () => {
+        // Ответ на запрос пропущенных дельт мог потеряться вместе с соединением
+        chatListResyncing = false;
+        console.log('Отключено от сервера');
+    });
+
+    socket.on('auth_success', handleAuthSuccess);
+    socket.on('auth_error', handleAuthError);
+    socket.on('login_queued', handleLoginQueued);
+    socket.on('session_expired', handleSessionExpired);
+    socket.on('server_restarting', handleServerRestarting);
+    socket.on('register_success', handleRegisterSuccess);
+    socket.on('register_error', handleRegisterError);
+
+    socket.on('new_message', handleNewMessage);
+    socket.on('messages_batch', handleMessagesBatch);
+    socket.on('chat_history', handleChatHistory);
+    socket.on('older_messages', handleOlderMessages);
+
+    socket.on('users_update', handleUsersUpdate);
+    socket.on('presence_changed', handlePresenceChanged);
+    socket.on('typing', handleTyping);
+
+    socket.on('user_banned', handleUserBanned);
+    socket.on('user_muted', handleUserMuted);
+    socket.on('user_kicked', handleUserKicked);
+
+    socket.on('private_chat_created', handlePrivateChatCreated);
+    socket.on('private_chat_error', handlePrivateChatError);
+    socket.on('private_chat_deleted', handlePrivateChatDeleted);
+
+    socket.on('group_created', handleGroupCreated);
+    socket.on('group_error', handleGroupError);
+
+    socket.on('chat_list_page', handleChatListPage);
+    socket.on('chat_list_delta', handleChatListDelta);
+
+    socket.on('message_deleted', handleMessageDeleted);
+    socket.on('message_edited', handleMessageEdited);
+    socket.on('history_cleared', handleHistoryCleared);
+
+    socket.on('search_results', handleSearchResults);
+    socket.on('unread_counts', handleUnreadCounts);
+
+    socket.on('rate_limited', handleRateLimited);
+}
+
+// Обработчики событий
+function handleAuthSuccess(data) {
+    sessionToken = data.session_token;
+    if (data.resumed && currentUser === data.username) {
+        resumeSession(data);
+        return;
+    }
+    currentUser = data.username;
+    currentUserId = data.user_id;
+    isMuted = data.is_muted || false;
+    isAdmin = data.is_admin || false;
+
+    document.getElementById('current-user-display').textContent = `Вы: ${currentUser}`;
+    document.getElementById('current-user-id').textContent = currentUserId;
+    document.getElementById('login-screen').classList.add('hidden');
+    document.getElementById('main-interface').classList.remove('hidden');
+
+    // Загружаем каналы и сохранённую историю
+    loadChannels();
+    cacheReady = loadChannelCache();
+
+    // После перезапуска сервера входят все сразу - списки и историю
+    // запрашиваем с паузой, которую назначил сервер
+    pendingLogin = null;
+    setTimeout(() => {
+        // Запрашиваем приватные чаты и группы
+        requestChatList();
+
+        // Присоединяемся к общему чату
+        joinChannel('general', '📝 Общий чат', 'public');
+    }, data.fetch_delay_ms || 0);
+
+    showSystemMessage(`Добро пожаловать, ${currentUser}!`);
+
+    console.log('Авторизация успешна:', currentUser, 'ID:', currentUserId, 'Admin:', isAdmin);
+}
+
+// Переподключение с токеном: интерфейс уже на месте, догоняем списки и текущий канал
+function resumeSession(data) {
+    isMuted = data.is_muted || false;
+    setTimeout(() => {
+        requestChatList();
+        if (currentChannel) {
+            joinChannel(currentChannel.id, currentChannel.name, currentChannel.type);
+        }
+    }, data.fetch_delay_ms || 0);
+    console.log('Сессия восстановлена:', currentUser);
+}
+
+function handleSessionExpired() {
+    sessionToken = null;
+    if (currentUser) {
+        alert('Сессия завершена, войдите снова');
+        location.reload();
+    }
+}
+
+// Сервер сохраняет состояние и перезапускается: отключаемся сами, чтобы
+// неотправленные сообщения дождались нового процесса в буфере клиента
+function handleServerRestarting(data) {
+    restartPending = true;
+    socket.disconnect();
+    showSystemMessage('Сервер перезапускается, переподключение...');
+    const delay = data.reconnect_min_ms + Math.random() * (data.reconnect_max_ms - data.reconnect_min_ms);
+    setTimeout(() => socket.connect(), delay);
+}
+
+function handleLoginQueued(data) {
+    // Список или историю запросили раньше паузы после входа - повторяем, если ещё нужно
+    if (data.event) {
+        setTimeout(() => {
+            if (data.event === 'join_channel' && (!currentChannel || currentChannel.id !== data.data.channel_id)) return;
+            socket.emit(data.event, data.data);
+        }, data.retry_after_ms);
+        return;
+    }
+    // Вход по токену после переподключения ждёт своей очереди, как и по паролю
+    if (data.resume) {
+        setTimeout(() => {
+            if (sessionToken) socket.emit('resume_session', { token: sessionToken, attempt: data.attempt });
+        }, data.retry_after_ms);
+        return;
+    }
+    if (!pendingLogin) return;
+    pendingLogin.attempt = data.attempt;
+    showSuccess(`Сервер занят, повторный вход через ${Math.ceil(data.retry_after_ms / 1000)} с`);
+    clearTimeout(loginRetryTimer);
+    loginRetryTimer = setTimeout(sendLogin, data.retry_after_ms);
+}
+
+function handleAuthError(data) {
+    pendingLogin = null;
+    showError(data.message);
+    console.log('Ошибка авторизации:', data.message);
+}
+
+function handleRegisterSuccess(data) {
+    showSuccess('Регистрация успешна! Теперь войдите.');
+    document.getElementById('username-input').value = '';
+    document.getElementById('password-input').value = '';
+    console.log('Регистрация успешна');
+}
+
+function handleRegisterError(data) {
+    showError(data.message);
+    console.log('Ошибка регистрации:', data.message);
+}
+
+function handleNewMessage(data) {
+    const fresh = rememberMessages(data.channel, [data]);
+    countUnread(fresh);
+    if (currentChannel && data.channel === currentChannel.id && fresh.length > 0) {
+        addMessageToChat(data);
+        stopTyping(data.username);
+    }
+}
+
+function handleChatHistory(data) {
+    const cache = channelCache[data.channel];
+    const isCurrent = currentChannel && currentChannel.id === data.channel;
+
+    if (data.reset || !cache) {
+        channelCache[data.channel] = {
+            cursor: data.cursor,
+            epoch: data.epoch,
+            messages: data.messages.slice(-CACHE_LIMIT)
+        };
+        saveChannelCache(data.channel);
+        if (isCurrent) renderHistory(data.messages);
+        return;
+    }
+
+    // Дельта: новые сообщения и правки/удаления с момента последнего визита
+    const fresh = rememberMessages(data.channel, data.messages);
+    data.changes.forEach(change => {
+        applyChangeToCache(data.channel, change);
+        if (!isCurrent) return;
+        if (change.kind === 'edit') showEditedMessage(change.message_id, change.message);
+        else if (change.kind === 'delete') removeMessageElement(change.message_id);
+    });
+    cache.cursor = Math.max(cache.cursor, data.cursor);
+    saveChannelCache(data.channel);
+
+    if (isCurrent && fresh.length > 0) {
+        appendMessages(fresh);
+    }
+}
+
+function renderHistory(list) {
+    setMessages(list, `
+        <div style="text-align: center; color: #999; padding: 40px;">
+            <i class="fas fa-comment-dots" style="font-size: 48px; margin-bottom: 20px;"></i>
+            <h3>Нет сообщений</h3>
+            <p>Будьте первым!</p>
+        </div>
+    `);
+}
+
+function handleOlderMessages(data) {
+    if (!currentChannel || currentChannel.id !== data.channel) return;
+    messageList.loadingOlder = false;
+    messageList.hasMore = data.has_more;
+    messageList.olderBefore = data.before_id;
+
+    const known = new Set(messageList.messages.map(msg => msg.id));
+    const older = data.messages.filter(msg => !known.has(msg.id));
+    if (older.length === 0) {
+        // Сервер просмотрел одни удалённые - продолжаем с его места
+        maybeLoadOlder();
+        return;
+    }
+
+    // Старые сообщения добавляются сверху, видимая часть не должна сдвигаться
+    const { container } = getMessageListElements();
+    const heightBefore = container.scrollHeight;
+    messageList.messages = older.concat(messageList.messages);
+    messageList.stickToBottom = false;
+    renderMessageList();
+    container.scrollTop += container.scrollHeight - heightBefore;
+}
+
+function handleMessagesBatch(data) {
+    const byChannel = {};
+    data.messages.forEach(msg => {
+        (byChannel[msg.channel] = byChannel[msg.channel] || []).push(msg);
+    });
+    Object.keys(byChannel).forEach(channelId => {
+        const fresh = rememberMessages(channelId, byChannel[channelId]);
+        countUnread(fresh);
+        if (currentChannel && currentChannel.id === channelId && fresh.length > 0) {
+            appendMessages(fresh);
+            fresh.forEach(msg => stopTyping(msg.username));
+        }
+    });
+}
+
+function handleUsersUpdate(data) {
+    onlineUsers = data.users;
+    updateOnlineUsers();
+}
+
+// Входы и выходы за окно приходят одним событием; в историю канала не попадают
+function handlePresenceChanged(data) {
+    describePresence(data.joined, data.joined_count, 'подключился', 'Подключились');
+    describePresence(data.left, data.left_count, 'отключился', 'Отключились');
+}
+
+// Кто начал печатать в открытом канале за окно; сервер присылает только его
+function handleTyping(data) {
+    if (!currentChannel || data.channel !== currentChannel.id) return;
+    const others = data.users.filter(name => name !== currentUser);
+    others.forEach(name => {
+        clearTimeout(typingUsers.get(name));
+        typingUsers.set(name, setTimeout(() => stopTyping(name), data.expires_ms));
+    });
+    const unnamed = data.count - data.users.length;
+    if (unnamed > 0) {
+        clearTimeout(typingCrowd.timer);
+        typingCrowd = { count: unnamed, timer: setTimeout(() => {
+            typingCrowd = { count: 0, timer: null };
+            renderTypingIndicator();
+        }, data.expires_ms) };
+    }
+    renderTypingIndicator();
+}
+
+function stopTyping(username) {
+    if (!typingUsers.has(username)) return;
+    clearTimeout(typingUsers.get(username));
+    typingUsers.delete(username);
+    renderTypingIndicator();
+}
+
+function clearTypingIndicator() {
+    typingUsers.forEach(timer => clearTimeout(timer));
+    typingUsers.clear();
+    clearTimeout(typingCrowd.timer);
+    typingCrowd = { count: 0, timer: null };
+    renderTypingIndicator();
+}
+
+function renderTypingIndicator() {
+    const names = Array.from(typingUsers.keys());
+    let text = '';
+    if (names.length > 3 || typingCrowd.count > 0) text = 'Несколько человек печатают…';
+    else if (names.length === 1) text = `${names[0]} печатает…`;
+    else if (names.length > 1) {
+        text = `${names.slice(0, -1).join(', ')} и ${names[names.length - 1]} печатают…`;
+    }
+    document.getElementById('typing-indicator').textContent = text;
+}
+
+function describePresence(names, count, singular, plural) {
+    const others = names.filter(name => name !== currentUser);
+    const total = count - (names.length - others.length);
+    if (total <= 0) return;
+    if (total === 1 && others.length === 1) {
+        showSystemMessage(`${others[0]} ${singular}`);
+        return;
+    }
+    const rest = total - others.length;
+    showSystemMessage(`${plural} ${total}: ${others.join(', ')}${rest > 0 ? ` и ещё ${rest}` : ''}`);
+}
+
+function handleUserBanned(data) {
+    if (data.username === currentUser) {
+        alert('Вы были забанены администратором!');
+        logout();
+    } else {
+        showSystemMessage(`${data.username} был забанен`);
+    }
+}
+
+function handleUserMuted(data) {
+    if (data.username === currentUser) {
+        isMuted = true;
+        showSystemMessage('Вас заглушили администратором');
+        document.getElementById('message-input').placeholder = 'Вы заглушены!';
+        document.getElementById('message-input').disabled = true;
+        document.getElementById('send-btn').disabled = true;
+    } else {
+        showSystemMessage(`${data.username} был заглушен`);
+    }
+}
+
+function handleUserKicked(data) {
+    if (data.username === currentUser) {
+        alert('Вас кикнули из чата!');
+        logout();
+    } else {
+        showSystemMessage(`${data.username} был кикнут`);
+    }
+}
+
+function handlePrivateChatCreated(data) {
+    hideCreateChatModal();
+    showSystemMessage(`Создан приватный чат с пользователем ${data.other_user}`);
+    joinChannel(data.chat_id, `🔒 ${data.other_user}`, 'private');
+}
+
+function handlePrivateChatError(data) {
+    showError(data.message);
+}
+
+// ---------- Синхронизация списка чатов ----------
+function requestChatList() {
+    socket.emit('get_chat_list', { version: chatListVersion });
+}
+
+function handleChatListPage(data) {
+    if (data.first) {
+        chatList.clear();
+        chatListLoading = true;
+    }
+    data.chats.forEach(chat => chatList.set(chat.id, chat));
+    if (!data.done) return;
+
+    chatListLoading = false;
+    chatListResyncing = false;
+    chatListVersion = data.version;
+    const deltas = pendingChatDeltas;
+    pendingChatDeltas = [];
+    deltas.forEach(delta => applyChatListDelta(delta));
+    renderChatLists();
+    scheduleChatListAck();
+}
+
+function handleChatListDelta(delta) {
+    if (chatListLoading) {
+        pendingChatDeltas.push(delta);
+        return;
+    }
+    if (chatListVersion === null) return;
+
+    if (delta.version > chatListVersion + 1) {
+        // Пропустили изменения - просим сервер прислать недостающие.
+        // Разрыв внутри ответа на запрос значит, что тот ответ тоже неполон
+        if (!chatListResyncing || delta.replay) {
+            chatListResyncing = true;
+            requestChatList();
+        }
+        return;
+    }
+    if (applyChatListDelta(delta)) {
+        chatListResyncing = false;
+        renderChatLists();
+        scheduleChatListAck();
+    }
+}
+
+function applyChatListDelta(delta) {
+    if (delta.version !== chatListVersion + 1) return false;
+    if (delta.op === 'remove') {
+        chatList.delete(delta.chat.id);
+    } else {
+        chatList.set(delta.chat.id, delta.chat);
+        if (delta.op === 'rename' && currentChannel && currentChannel.id === delta.chat.id) {
+            currentChannel.name = `👥 ${delta.chat.name}`;
+            document.getElementById('current-channel').textContent = currentChannel.name;
+        }
+    }
+    chatListVersion = delta.version;
+    return true;
+}
+
+// Подтверждения версии склеиваем: серверу достаточно последней
+function scheduleChatListAck() {
+    if (chatListAckTimer) return;
+    chatListAckTimer = setTimeout(() => {
+        chatListAckTimer = null;
+        socket.emit('chat_list_ack', { version: chatListVersion });
+    }, 1000);
+}
+
+function renderChatLists() {
+    const chats = Array.from(chatList.values());
+    renderPrivateChats(chats.filter(chat => chat.kind === 'private'));
+    renderGroups(chats.filter(chat => chat.kind === 'group'));
+}
+
+function renderPrivateChats(chats) {
+    scheduleListUpdate('private-channels', () => reconcileList(
+        'private-channels',
+        chats,
+        chat => chat.id,
+        chat => `
+            <div onclick="joinChannel('${chat.id}', '🔒 ${escapeHtml(chat.name)}', 'private')" style="flex: 1; display: flex; align-items: center;">
+                <span class="channel-icon"><i class="fas fa-lock"></i></span>
+                <span>${escapeHtml(chat.name)}</span>
+            </div>
+            ${unreadBadgeHtml(chat.id)}
+            <div class="channel-actions">
+                <button class="channel-btn" onclick="leavePrivateChat('${chat.id}', event)" title="Выйти из чата">
+                    <i class="fas fa-sign-out-alt"></i>
+                </button>
+                ${chat.is_creator ? `<button class="channel-btn delete" onclick="deletePrivateChat('${chat.id}', event)" title="Удалить чат">
+                    <i class="fas fa-trash"></i>
+                </button>` : ''}
+            </div>
+        `,
+        'channel',
+        '<div style="color: #999; font-size: 12px; padding: 10px;">У вас нет приватных чатов</div>'
+    ));
+}
+
+function handlePrivateChatDeleted(data) {
+    showSystemMessage('Приватный чат был удален');
+    if (currentChannel && currentChannel.id === data.chat_id) {
+        joinChannel('general', '📝 Общий чат', 'public');
+    }
+}
+
+function handleGroupCreated(data) {
+    hideCreateGroupModal();
+    showSystemMessage(`Создана группа "${data.group_name}"`);
+    joinChannel(data.chat_id, `👥 ${data.group_name}`, 'group');
+}
+
+function handleGroupError(data) {
+    showError(data.message);
+}
+
+function renderGroups(groups) {
+    scheduleListUpdate('group-channels', () => reconcileList(
+        'group-channels',
+        groups,
+        group => group.id,
+        group => `
+            <div onclick="joinChannel('${group.id}', '👥 ${escapeHtml(group.name)}', 'group')" style="flex: 1; display: flex; align-items: center;">
+                <span class="channel-icon"><i class="fas fa-users"></i></span>
+                <span>${escapeHtml(group.name)}</span>
+            </div>
+            ${unreadBadgeHtml(group.id)}
+            <div class="channel-actions">
+                <button class="channel-btn" onclick="leaveGroup('${group.id}', event)" title="Выйти из группы">
+                    <i class="fas fa-sign-out-alt"></i>
+                </button>
+                ${group.is_creator ? `<button class="channel-btn" onclick="renameGroup('${group.id}', event)" title="Переименовать группу">
+                    <i class="fas fa-pen"></i>
+                </button>` : ''}
+                ${group.is_creator ? `<button class="channel-btn delete" onclick="deleteGroup('${group.id}', event)" title="Удалить группу">
+                    <i class="fas fa-trash"></i>
+                </button>` : ''}
+            </div>
+        `,
+        'channel',
+        '<div style="color: #999; font-size: 12px; padding: 10px;">У вас нет групп</div>'
+    ));
+}
+
+function handleMessageDeleted(data) {
+    applyChangeToCache(data.channel, { kind: 'delete', message_id: data.message_id });
+    if (currentChannel && currentChannel.id === data.channel) {
+        removeMessageElement(data.message_id);
+    }
+}
+
+function handleMessageEdited(data) {
+    applyChangeToCache(data.channel, { kind: 'edit', message_id: data.message_id, message: data.message });
+    if (currentChannel && currentChannel.id === data.channel) {
+        showEditedMessage(data.message_id, data.message);
+    }
+}
+
+function removeMessageElement(messageId) {
+    messageList.messages = messageList.messages.filter(msg => msg.id !== messageId);
+    messageList.heights.delete(messageId);
+    releaseRow(messageId);
+    scheduleRender();
+}
+
+function showEditedMessage(messageId, text) {
+    const msg = messageList.messages.find(item => item.id === messageId);
+    if (!msg) return;
+    msg.message = text;
+    msg.edited = true;
+
+    const row = messageList.rows.get(messageId);
+    if (row) {
+        fillMessageElement(row, msg);
+        messageList.heights.delete(messageId);
+        scheduleRender();
+    }
+}
+
+function handleHistoryCleared(data) {
+    const cache = channelCache[data.channel];
+    if (cache) {
+        cache.messages = [];
+        saveChannelCache(data.channel);
+    }
+    if (currentChannel && currentChannel.id === data.channel) {
+        setMessages([], `
+            <div style="text-align: center; color: #999; padding: 40px;">
+                <i class="fas fa-comment-dots" style="font-size: 48px; margin-bottom: 20px;"></i>
+                <h3>История чата очищена</h3>
+                <p>Начните общение заново!</p>
+            </div>
+        `);
+    }
+}
+
+function handleRateLimited(data) {
+    // Индикатор набора не важен - отказ по нему не показываем
+    if (data.event === 'typing') return;
+    if (data.event === 'load_older') {
+        messageList.loadingOlder = false;
+    }
+    const text = `Слишком много запросов, подождите ${Math.ceil(data.retry_after)} с`;
+    if (currentUser) {
+        showSystemMessage(text);
+    } else {
+        showError(text);
+    }
+}
+
+// Функции UI
+function showError(message) {
+    const element = document.getElementById('error-message');
+    element.textContent = message;
+    setTimeout(() => {
+        element.textContent = '';
+    }, 3000);
+}
+
+function showSuccess(message) {
+    const element = document.getElementById('success-message');
+    element.textContent = message;
+    setTimeout(() => {
+        element.textContent = '';
+    }, 3000);
+}
+
+function showSystemMessage(text) {
+    // Локальное сообщение: живёт только в текущем списке, в кэш не попадает
+    localMessageCounter++;
+    messageList.messages.push({
+        id: `local-${localMessageCounter}`,
+        username: 'SYSTEM',
+        message: text,
+        timestamp: Date.now(),
+        type: 'system'
+    });
+    scrollToBottom();
+}
+
+function addMessageToChat(data) {
+    appendMessages([data]);
+}
+
+// Пачка сообщений попадает в DOM за один проход отрисовки
+function appendMessages(list) {
+    messageList.messages.push(...list);
+    if (isNearBottom(getMessageListElements().container) || list.some(msg => msg.username === currentUser)) {
+        messageList.stickToBottom = true;
+    }
+    scheduleRender();
+}
+
+// ---------- Виртуальный список сообщений ----------
+// В DOM держим только видимые сообщения и запас сверху и снизу,
+// остальное место занимают распорки с суммарной высотой строк
+function getMessageListElements() {
+    if (messageList.elements) return messageList.elements;
+
+    const container = document.getElementById('messages-container');
+    container.innerHTML = '';
+    const placeholder = document.createElement('div');
+    const top = document.createElement('div');
+    const rows = document.createElement('div');
+    const bottom = document.createElement('div');
+    container.append(placeholder, top, rows, bottom);
+
+    container.addEventListener('scroll', () => {
+        messageList.stickToBottom = isNearBottom(container);
+        scheduleRender();
+        maybeLoadOlder();
+    });
+    window.addEventListener('resize', scheduleRender);
+
+    messageList.elements = { container, placeholder, top, rows, bottom };
+    return messageList.elements;
+}
+
+function setMessages(list, placeholderHtml) {
+    messageList.messages = list.slice();
+    messageList.placeholder = placeholderHtml;
+    messageList.hasMore = list.length >= HISTORY_PAGE_SIZE;
+    messageList.olderBefore = null;
+    messageList.loadingOlder = false;
+    messageList.stickToBottom = true;
+    Array.from(messageList.rows.keys()).forEach(releaseRow);
+    renderMessageList();
+}
+
+function isNearBottom(container) {
+    return container.scrollHeight - container.scrollTop - container.clientHeight < 40;
+}
+
+function scheduleRender() {
+    if (!messageList.frame) {
+        messageList.frame = requestAnimationFrame(renderMessageList);
+    }
+}
+
+function releaseRow(messageId) {
+    const row = messageList.rows.get(messageId);
+    if (!row) return;
+    row.remove();
+    messageList.rows.delete(messageId);
+    if (messageList.pool.length < ROW_POOL_LIMIT) {
+        messageList.pool.push(row);
+    }
+}
+
+function renderMessageList() {
+    if (messageList.frame) cancelAnimationFrame(messageList.frame);
+    messageList.frame = 0;
+
+    const { container, placeholder, top, rows, bottom } = getMessageListElements();
+    const list = messageList.messages;
+    placeholder.innerHTML = list.length === 0 && messageList.placeholder ? messageList.placeholder : '';
+
+    const heightOf = index => messageList.heights.get(list[index].id) || ESTIMATED_ROW_HEIGHT;
+    let total = 0;
+    for (let i = 0; i < list.length; i++) total += heightOf(i);
+
+    // Находим видимый диапазон по известным (или оценочным) высотам строк
+    const viewport = container.clientHeight;
+    const viewTop = messageList.stickToBottom ? Math.max(0, total - viewport) : container.scrollTop;
+    let first = 0;
+    let offset = 0;
+    while (first < list.length && offset + heightOf(first) <= viewTop) {
+        offset += heightOf(first);
+        first++;
+    }
+    let last = first;
+    while (last < list.length && offset < viewTop + viewport) {
+        offset += heightOf(last);
+        last++;
+    }
+    const start = Math.max(0, first - LIST_BUFFER);
+    const end = Math.min(list.length, last + LIST_BUFFER);
+
+    // Строки вне окна возвращаем в пул, новые берём из пула
+    const visible = new Set();
+    for (let i = start; i < end; i++) visible.add(list[i].id);
+    Array.from(messageList.rows.keys()).forEach(id => {
+        if (!visible.has(id)) releaseRow(id);
+    });
+
+    const fragment = document.createDocumentFragment();
+    for (let i = start; i < end; i++) {
+        const msg = list[i];
+        let row = messageList.rows.get(msg.id);
+        if (!row) {
+            row = fillMessageElement(messageList.pool.pop() || document.createElement('div'), msg);
+            messageList.rows.set(msg.id, row);
+        }
+        fragment.appendChild(row);
+    }
+    rows.appendChild(fragment);
+
+    // Измеряем отрисованные строки одним проходом после всех изменений DOM
+    for (let i = start; i < end; i++) {
+        const row = messageList.rows.get(list[i].id);
+        if (messageList.rowGap === null) {
+            messageList.rowGap = parseFloat(getComputedStyle(row).marginBottom) || 0;
+        }
+        messageList.heights.set(list[i].id, row.offsetHeight + messageList.rowGap);
+    }
+
+    let topHeight = 0;
+    for (let i = 0; i < start; i++) topHeight += heightOf(i);
+    let bottomHeight = 0;
+    for (let i = end; i < list.length; i++) bottomHeight += heightOf(i);
+    top.style.height = `${topHeight}px`;
+    bottom.style.height = `${bottomHeight}px`;
+
+    // Всё, что пользователь увидел, считается прочитанным
+    if (currentChannel && !document.hidden) {
+        for (let i = last - 1; i >= first; i--) {
+            if (typeof list[i].id === 'number') {
+                markRead(currentChannel.id, list[i].id);
+                break;
+            }
+        }
+    }
+
+    if (messageList.stickToBottom) {
+        container.scrollTop = container.scrollHeight;
+    }
+}
+
+function maybeLoadOlder() {
+    const { container } = getMessageListElements();
+    if (!currentChannel || !messageList.hasMore || messageList.loadingOlder) return;
+    if (container.scrollTop > OLDER_PAGE_THRESHOLD) return;
+
+    const oldest = messageList.messages.find(msg => typeof msg.id === 'number');
+    const beforeId = messageList.olderBefore !== null ? messageList.olderBefore : oldest && oldest.id;
+    if (!beforeId) return;
+    messageList.loadingOlder = true;
+    socket.emit('load_older', { channel_id: currentChannel.id, before_id: beforeId });
+}
+
+function createMessageElement(data) {
+    return fillMessageElement(document.createElement('div'), data);
+}
+
+function fillMessageElement(messageDiv, data) {
+    messageDiv.className = `message ${data.type === 'system' ? 'system' : data.is_private ? 'private' : data.is_group ? 'group' : ''}`;
+    messageDiv.dataset.messageId = data.id;
+
+    const time = new Date(data.timestamp).toLocaleTimeString('ru-RU', {
+        hour: '2-digit',
+        minute: '2-digit'
+    });
+
+    const displayName = data.username === currentUser ? 'Вы' : data.username;
+    const isOwnMessage = data.username === currentUser;
+    const canDelete = isOwnMessage || isAdmin;
+
+    const editedBadge = data.edited ? '<span class="message-edited"> (ред.)</span>' : '';
+
+    messageDiv.innerHTML = `
+        <div class="message-header">
+            <span class="message-username">${escapeHtml(displayName)}</span>
+            <span class="message-time">${time}</span>
+        </div>
+        <div class="message-text">${escapeHtml(data.message)}${editedBadge}</div>
+        ${canDelete && data.type !== 'system' ? `
+            <div class="message-actions">
+                ${isOwnMessage ? `
+                <button class="message-btn" onclick="editMessage(${data.id})" title="Редактировать">
+                    <i class="fas fa-edit"></i>
+                </button>
+                ` : ''}
+                <button class="message-btn delete" onclick="deleteMessage(${data.id})" title="Удалить">
+                    <i class="fas fa-trash"></i>
+                </button>
+            </div>
+        ` : ''}
+    `;
+
+    return messageDiv;
+}
+
+function scrollToBottom() {
+    messageList.stickToBottom = true;
+    scheduleRender();
+}
+
+function loadChannels() {
+    // Публичные каналы
+    const publicContainer = document.getElementById('public-channels');
+    publicContainer.innerHTML = `
+        <div class="channel active" onclick="joinChannel('general', '📝 Общий чат', 'public')">
+            <div>
+                <span class="channel-icon">#</span>
+                <span>Общий чат</span>
+            </div>
+            ${unreadBadgeHtml('general')}
+        </div>
+        <div class="channel" onclick="joinChannel('games', '🎮 Игры', 'public')">
+            <div>
+                <span class="channel-icon">#</span>
+                <span>Игры</span>
+            </div>
+            ${unreadBadgeHtml('games')}
+        </div>
+        <div class="channel" onclick="joinChannel('music', '🎵 Музыка', 'public')">
+            <div>
+                <span class="channel-icon">#</span>
+                <span>Музыка</span>
+            </div>
+            ${unreadBadgeHtml('music')}
+        </div>
+        <div class="channel" onclick="joinChannel('memes', '😂 Мемы', 'public')">
+            <div>
+                <span class="channel-icon">#</span>
+                <span>Мемы</span>
+            </div>
+            ${unreadBadgeHtml('memes')}
+        </div>
+    `;
+}
+
+function updateOnlineUsers() {
+    const users = onlineUsers;
+    scheduleListUpdate('online-users', () => {
+        document.getElementById('online-count').textContent = users.length;
+        reconcileList(
+            'online-users',
+            users,
+            user => user.socket_id,
+            user => `
+                <div>
+                    <div class="user-status online"></div>
+                    <span>${escapeHtml(user.username)}${user.user_id === currentUserId ? ' (Вы)' : ''}</span>
+                </div>
+                <div class="user-id-badge">${user.user_id}</div>
+            `,
+            'user-item',
+            ''
+        );
+    });
+}
+
+// ---------- Списки боковой панели ----------
+// Строки списков связаны с ключами: при обновлении вставляем, удаляем или
+// перерисовываем только изменившиеся строки, все списки - за один кадр
+const listStates = {};          // id контейнера -> {rows: Map(ключ -> {element, html}), empty}
+const pendingListUpdates = {};  // id контейнера -> последнее отложенное обновление
+let listFrame = 0;
+
+function scheduleListUpdate(containerId, update) {
+    pendingListUpdates[containerId] = update;
+    if (!listFrame) {
+        listFrame = requestAnimationFrame(flushListUpdates);
+    }
+}
+
+function flushListUpdates() {
+    listFrame = 0;
+    Object.keys(pendingListUpdates).forEach(containerId => {
+        const update = pendingListUpdates[containerId];
+        delete pendingListUpdates[containerId];
+        update();
+    });
+}
+
+function reconcileList(containerId, items, keyOf, htmlOf, className, emptyHtml) {
+    const container = document.getElementById(containerId);
+    let state = listStates[containerId];
+    if (!state) {
+        container.innerHTML = '';
+        state = listStates[containerId] = { rows: new Map(), empty: null };
+    }
+
+    // Удаляем строки, которых больше нет
+    const keys = new Set(items.map(keyOf));
+    state.rows.forEach((row, key) => {
+        if (!keys.has(key)) {
+            row.element.remove();
+            state.rows.delete(key);
+        }
+    });
+
+    if (items.length === 0) {
+        if (!state.empty && emptyHtml) {
+            state.empty = document.createElement('div');
+            state.empty.innerHTML = emptyHtml;
+            container.appendChild(state.empty);
+        }
+        return;
+    }
+    if (state.empty) {
+        state.empty.remove();
+        state.empty = null;
+    }
+
+    // Проходим по новому порядку: узлы на своём месте не трогаем
+    let cursor = container.firstChild;
+    items.forEach(item => {
+        const key = keyOf(item);
+        const html = htmlOf(item);
+        let row = state.rows.get(key);
+        if (!row) {
+            const element = document.createElement('div');
+            element.className = className;
+            element.innerHTML = html;
+            row = { element, html };
+            state.rows.set(key, row);
+        } else if (row.html !== html) {
+            row.element.innerHTML = html;
+            row.html = html;
+        }
+
+        if (row.element === cursor) {
+            cursor = cursor.nextSibling;
+        } else {
+            container.insertBefore(row.element, cursor);
+        }
+    });
+}
+
+// Основные функции
+function login() {
+    const username = document.getElementById('username-input').value.trim();
+    const password = document.getElementById('password-input').value;
+
+    if (!username || !password) {
+        showError('Заполните все поля');
+        return;
+    }
+
+    console.log('Попытка входа:', username);
+    clearTimeout(loginRetryTimer);
+    pendingLogin = { username: username, password: password, attempt: 0 };
+    sendLogin();
+}
+
+function sendLogin() {
+    if (pendingLogin) {
+        socket.emit('login', pendingLogin);
+    }
+}
+
+function register() {
+    const username = document.getElementById('username-input').value.trim();
+    const password = document.getElementById('password-input').value;
+
+    if (!username || !password) {
+        showError('Заполните все поля');
+        return;
+    }
+
+    if (username.length < 3) {
+        showError('Имя должно быть не менее 3 символов');
+        return;
+    }
+
+    console.log('Попытка регистрации:', username);
+    socket.emit('register', {
+        username: username,
+        password: password
+    });
+}
+
+function logout() {
+    if (confirm('Выйти из аккаунта?')) {
+        socket.emit('logout');
+        sessionToken = null;
+        socket.disconnect();
+        currentUser = '';
+        currentUserId = '';
+        document.getElementById('main-interface').classList.add('hidden');
+        document.getElementById('login-screen').classList.remove('hidden');
+        document.getElementById('username-input').value = '';
+        document.getElementById('password-input').value = '';
+        location.reload();
+    }
+}
+
+function joinChannel(channelId, channelName, channelType) {
+    currentChannel = { id: channelId, name: channelName, type: channelType };
+    clearTypingIndicator();
+
+    // Обновляем UI
+    document.querySelectorAll('.channel').forEach(ch => ch.classList.remove('active'));
+    const activeChannel = Array.from(document.querySelectorAll('.channel')).find(ch =>
+        ch.textContent.includes(channelName.replace('🔒 ', '').replace('👥 ', '')) ||
+        (channelType === 'private' && ch.textContent.includes('🔒')) ||
+        (channelType === 'group' && ch.textContent.includes('👥'))
+    );
+    if (activeChannel) activeChannel.classList.add('active');
+
+    document.getElementById('current-channel').textContent = channelName;
+    unreadCounts[channelId] = 0;
+    updateUnreadBadge(channelId);
+    let channelInfo = '';
+    if (channelType === 'private') channelInfo = 'Приватный чат';
+    else if (channelType === 'group') channelInfo = 'Групповой чат';
+    else channelInfo = 'Публичный канал';
+    document.getElementById('channel-info').textContent = channelInfo;
+
+    // Показываем кнопку очистки истории
+    const clearBtn = document.getElementById('clear-history-btn');
+    clearBtn.style.display = 'block';
+
+    // Активируем поле ввода
+    document.getElementById('message-input').disabled = isMuted;
+    document.getElementById('send-btn').disabled = isMuted;
+    document.getElementById('message-input').placeholder = isMuted ? 'Вы заглушены!' : 'Напишите сообщение...';
+
+    // Показываем кэш сразу и запрашиваем у сервера только то, что изменилось
+    cacheReady.then(() => {
+        if (!currentChannel || currentChannel.id !== channelId) return;
+
+        const request = { channel_id: channelId, channel_type: channelType };
+        const cache = channelCache[channelId];
+        if (cache) {
+            renderHistory(cache.messages);
+            request.last_id = cache.cursor;
+            request.epoch = cache.epoch;
+        }
+        socket.emit('join_channel', request);
+    });
+}
+
+function sendMessage() {
+    const input = document.getElementById('message-input');
+    const message = input.value.trim();
+
+    if (!message || !currentChannel || isMuted) return;
+
+    socket.emit('send_message', {
+        channel: currentChannel.id,
+        message: message,
+        channel_type: currentChannel.type
+    });
+
+    input.value = '';
+    input.style.height = 'auto';
+    // Сервер сбрасывает окно после сообщения - следующий набор виден сразу
+    lastTypingSent = { channel: null, at: 0 };
+}
+
+function notifyTyping() {
+    const input = document.getElementById('message-input');
+    if (!currentChannel || isMuted || !input.value.trim()) return;
+    const now = Date.now();
+    if (lastTypingSent.channel === currentChannel.id && now - lastTypingSent.at < TYPING_THROTTLE_MS) return;
+    lastTypingSent = { channel: currentChannel.id, at: now };
+    socket.emit('typing', { channel: currentChannel.id });
+}
+
+function handleKeyDown(event) {
+    if (event.key === 'Enter' && !event.shiftKey) {
+        event.preventDefault();
+        sendMessage();
+    }
+}
+
+function showCreateChatModal() {
+    document.getElementById('create-chat-modal').classList.remove('hidden');
+    document.getElementById('invite-user-id').focus();
+}
+
+function hideCreateChatModal() {
+    document.getElementById('create-chat-modal').classList.add('hidden');
+    document.getElementById('invite-user-id').value = '';
+}
+
+function createPrivateChat() {
+    const userId = document.getElementById('invite-user-id').value.trim();
+
+    if (!userId) {
+        showError('Введите ID пользователя');
+        return;
+    }
+
+    if (userId === currentUserId) {
+        showError('Нельзя создать чат с самим собой');
+        return;
+    }
+
+    socket.emit('create_private_chat', {
+        target_user_id: userId
+    });
+}
+
+function showCreateGroupModal() {
+    document.getElementById('create-group-modal').classList.remove('hidden');
+    document.getElementById('group-name').focus();
+}
+
+function hideCreateGroupModal() {
+    document.getElementById('create-group-modal').classList.add('hidden');
+    document.getElementById('group-name').value = '';
+    document.getElementById('group-members').value = '';
+}
+
+function createGroup() {
+    const groupName = document.getElementById('group-name').value.trim();
+    const membersText = document.getElementById('group-members').value.trim();
+
+    if (!groupName) {
+        showError('Введите название группы');
+        return;
+    }
+
+    if (!membersText) {
+        showError('Введите ID участников');
+        return;
+    }
+
+    const members = membersText.split(',').map(id => id.trim()).filter(id => id);
+
+    if (members.length === 0) {
+        showError('Введите хотя бы одного участника');
+        return;
+    }
+
+    socket.emit('create_group', {
+        group_name: groupName,
+        members: members
+    });
+}
+
+function leavePrivateChat(chatId, event) {
+    event.stopPropagation();
+    if (confirm('Вы уверены, что хотите выйти из этого чата?')) {
+        socket.emit('leave_private_chat', { chat_id: chatId });
+    }
+}
+
+function deletePrivateChat(chatId, event) {
+    event.stopPropagation();
+    if (confirm('Вы уверены, что хотите удалить этот чат? Это действие удалит чат для всех участников.')) {
+        socket.emit('delete_private_chat', { chat_id: chatId });
+    }
+}
+
+function leaveGroup(chatId, event) {
+    event.stopPropagation();
+    if (confirm('Вы уверены, что хотите выйти из этой группы?')) {
+        socket.emit('leave_group', { chat_id: chatId });
+    }
+}
+
+function renameGroup(chatId, event) {
+    event.stopPropagation();
+    const group = chatList.get(chatId);
+    const groupName = prompt('Новое название группы:', group ? group.name : '');
+    if (groupName && groupName.trim()) {
+        socket.emit('rename_group', { chat_id: chatId, group_name: groupName.trim() });
+    }
+}
+
+function deleteGroup(chatId, event) {
+    event.stopPropagation();
+    if (confirm('Вы уверены, что хотите удалить эту группу? Это действие удалит группу для всех участников.')) {
+        socket.emit('delete_group', { chat_id: chatId });
+    }
+}
+
+function deleteMessage(messageId) {
+    if (confirm('Удалить это сообщение?')) {
+        socket.emit('delete_message', {
+            message_id: messageId,
+            channel: currentChannel.id
+        });
+    }
+}
+
+function editMessage(messageId) {
+    const msg = messageList.messages.find(item => item.id === messageId);
+    if (msg) {
+        document.getElementById('edit-message-text').value = msg.message;
+        editingMessageId = messageId;
+        document.getElementById('edit-message-modal').classList.remove('hidden');
+    }
+}
+
+// ---------- Непрочитанные сообщения ----------
+function handleUnreadCounts(data) {
+    Object.keys(data.cursors).forEach(channelId => {
+        readCursors[channelId] = Math.max(readCursors[channelId] || 0, data.cursors[channelId]);
+        unreadCounts[channelId] = 0;
+    });
+    Object.keys(data.counts).forEach(channelId => {
+        unreadCounts[channelId] = data.counts[channelId];
+    });
+    Object.keys(data.cursors).concat(Object.keys(data.counts)).forEach(updateUnreadBadge);
+}
+
+function countUnread(list) {
+    list.forEach(msg => {
+        if (msg.username === currentUser || msg.id <= (readCursors[msg.channel] || 0)) return;
+        if (currentChannel && currentChannel.id === msg.channel) return;
+        unreadCounts[msg.channel] = (unreadCounts[msg.channel] || 0) + 1;
+        updateUnreadBadge(msg.channel);
+    });
+}
+
+// Курсор двигаем сразу, а серверу отправляем не чаще раза в READ_FLUSH_DELAY
+function markRead(channelId, messageId) {
+    if (messageId <= (readCursors[channelId] || 0)) return;
+    readCursors[channelId] = messageId;
+    pendingReadCursors[channelId] = messageId;
+    if (unreadCounts[channelId]) {
+        unreadCounts[channelId] = 0;
+        updateUnreadBadge(channelId);
+    }
+    if (!readFlushTimer) {
+        readFlushTimer = setTimeout(flushReadCursors, READ_FLUSH_DELAY);
+    }
+}
+
+function flushReadCursors() {
+    readFlushTimer = null;
+    const cursors = pendingReadCursors;
+    pendingReadCursors = {};
+    socket.emit('mark_read', { cursors: cursors });
+}
+
+function unreadBadgeHtml(channelId) {
+    const count = unreadCounts[channelId] || 0;
+    return `<span class="unread-badge${count ? '' : ' hidden'}" data-unread-channel="${channelId}">${count > 99 ? '99+' : count}</span>`;
+}
+
+function updateUnreadBadge(channelId) {
+    const badge = document.querySelector(`[data-unread-channel="${channelId}"]`);
+    if (!badge) return;
+    const count = unreadCounts[channelId] || 0;
+    badge.textContent = count > 99 ? '99+' : count;
+    badge.classList.toggle('hidden', count === 0);
+}
+
+// ---------- Поиск сообщений ----------
+function showSearchModal() {
+    document.getElementById('search-modal').classList.remove('hidden');
+    document.getElementById('search-query').focus();
+}
+
+function hideSearchModal() {
+    document.getElementById('search-modal').classList.add('hidden');
+}
+
+function searchMessages() {
+    const query = document.getElementById('search-query').value.trim();
+    if (!query) return;
+
+    const allChannels = document.getElementById('search-all-channels').checked;
+    searchState = {
+        query: query,
+        channel: allChannels || !currentChannel ? null : currentChannel.id,
+        offset: 0
+    };
+    document.getElementById('search-results').innerHTML = '';
+    emitSearch();
+}
+
+function emitSearch() {
+    socket.emit('search_messages', {
+        query: searchState.query,
+        channel: searchState.channel,
+        offset: searchState.offset
+    });
+}
+
+function handleSearchResults(data) {
+    // Ответ на устаревший запрос не показываем
+    if (data.query !== searchState.query || data.channel !== searchState.channel || data.offset !== searchState.offset) return;
+
+    const container = document.getElementById('search-results');
+    if (data.offset === 0 && data.results.length === 0) {
+        container.innerHTML = '<div style="color: #999; padding: 10px;">Ничего не найдено</div>';
+    }
+
+    const fragment = document.createDocumentFragment();
+    data.results.forEach(msg => {
+        const chat = chatList.get(msg.channel);
+        const where = chat ? chat.name : `#${msg.channel}`;
+        const time = new Date(msg.timestamp).toLocaleString('ru-RU', {
+            day: '2-digit',
+            month: '2-digit',
+            hour: '2-digit',
+            minute: '2-digit'
+        });
+
+        const resultDiv = document.createElement('div');
+        resultDiv.className = 'search-result';
+        resultDiv.innerHTML = `
+            <div class="message-header">
+                <span class="message-username">${escapeHtml(msg.username)}</span>
+                <span class="message-time">${escapeHtml(where)} · ${time}</span>
+            </div>
+            <div class="message-text">${escapeHtml(msg.message)}</div>
+        `;
+        fragment.appendChild(resultDiv);
+    });
+    container.appendChild(fragment);
+
+    searchState.offset += data.results.length;
+    document.getElementById('search-more-btn').classList.toggle('hidden', !data.has_more);
+}
+
+function hideEditModal() {
+    document.getElementById('edit-message-modal').classList.add('hidden');
+    editingMessageId = null;
+}
+
+function saveEditedMessage() {
+    const newText = document.getElementById('edit-message-text').value.trim();
+    if (!newText) {
+        showError('Введите текст сообщения');
+        return;
+    }
+
+    if (editingMessageId) {
+        socket.emit('edit_message', {
+            message_id: editingMessageId,
+            channel: currentChannel.id,
+            message: newText
+        });
+        hideEditModal();
+    }
+}
+
+function clearHistory() {
+    if (confirm('Очистить всю историю этого чата? Это действие нельзя отменить.')) {
+        socket.emit('clear_history', {
+            channel: currentChannel.id,
+            channel_type: currentChannel.type
+        });
+    }
+}
+
+// ---------- Кэш истории каналов ----------
+function rememberMessages(channelId, list) {
+    // Возвращает сообщения, которых ещё не было в кэше. Курсор двигает только ответ
+    // chat_history: до живого события могли потеряться другие, например при обрыве связи
+    const cache = channelCache[channelId];
+    if (!cache) return list;
+
+    const known = new Set(cache.messages.map(msg => msg.id));
+    const fresh = list.filter(msg => !known.has(msg.id));
+    if (fresh.length > 0) {
+        cache.messages = cache.messages.concat(fresh).slice(-CACHE_LIMIT);
+    }
+    saveChannelCache(channelId);
+    return fresh;
+}
+
+function applyChangeToCache(channelId, change) {
+    const cache = channelCache[channelId];
+    if (!cache) return;
+
+    if (change.kind === 'delete') {
+        cache.messages = cache.messages.filter(msg => msg.id !== change.message_id);
+    } else if (change.kind === 'edit') {
+        const msg = cache.messages.find(item => item.id === change.message_id);
+        if (msg) {
+            msg.message = change.message;
+            msg.edited = true;
+        }
+    }
+    saveChannelCache(channelId);
+}
+
+function openCacheDb() {
+    return new Promise(resolve => {
+        if (!window.indexedDB) return resolve(null);
+        const request = indexedDB.open('messenger-cache', 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore('channels', { keyPath: 'key' });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => resolve(null);
+    });
+}
+
+function loadChannelCache() {
+    // Кэш хранится отдельно для каждого пользователя
+    const prefix = `${currentUserId}:`;
+    return openCacheDb().then(db => {
+        cacheDb = db;
+        if (!db) return;
+        return new Promise(resolve => {
+            const request = db.transaction('channels').objectStore('channels').getAll();
+            request.onsuccess = () => {
+                request.result
+                    .filter(entry => entry.key.startsWith(prefix))
+                    .forEach(entry => {
+                        channelCache[entry.channel] = {
+                            cursor: entry.cursor,
+                            epoch: entry.epoch,
+                            messages: entry.messages
+                        };
+                    });
+                resolve();
+            };
+            request.onerror = () => resolve();
+        });
+    });
+}
+
+function saveChannelCache(channelId) {
+    // Пишем в IndexedDB не чаще раза в секунду на канал
+    if (!cacheDb || cacheSaveTimers[channelId]) return;
+    cacheSaveTimers[channelId] = setTimeout(() => {
+        delete cacheSaveTimers[channelId];
+        const cache = channelCache[channelId];
+        if (!cache) return;
+        cacheDb.transaction('channels', 'readwrite').objectStore('channels').put({
+            key: `${currentUserId}:${channelId}`,
+            channel: channelId,
+            cursor: cache.cursor,
+            epoch: cache.epoch,
+            messages: cache.messages
+        });
+    }, 1000);
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
@@ -0,0 +1,244 @@
+// Парсер пакетов Socket.IO в формате MessagePack (совместим с serializer='msgpack'
+// в python-socketio). Пакет {type, data, nsp, id} кодируется одним бинарным кадром.
+(function (global) {
+    const utf8Encoder = new TextEncoder();
+    const utf8Decoder = new TextDecoder();
+
+    // ---------- Кодирование ----------
+    function encode(value) {
+        const chunks = [];
+        let size = 0;
+
+        function push(bytes) {
+            chunks.push(bytes);
+            size += bytes.length;
+        }
+
+        function header(prefix, length, bytesCount) {
+            const bytes = new Uint8Array(1 + bytesCount);
+            const view = new DataView(bytes.buffer);
+            bytes[0] = prefix;
+            if (bytesCount === 1) view.setUint8(1, length);
+            else if (bytesCount === 2) view.setUint16(1, length);
+            else if (bytesCount === 4) view.setUint32(1, length);
+            push(bytes);
+        }
+
+        function writeNumber(num) {
+            if (Number.isInteger(num) && num >= 0 && num < 0x80) {
+                push(Uint8Array.of(num));
+            } else if (Number.isInteger(num) && num < 0 && num >= -32) {
+                push(Uint8Array.of(num & 0xff));
+            } else if (Number.isInteger(num) && num >= 0 && num <= 0xffffffff) {
+                if (num <= 0xff) header(0xcc, num, 1);
+                else if (num <= 0xffff) header(0xcd, num, 2);
+                else header(0xce, num, 4);
+            } else if (Number.isInteger(num) && num < 0 && num >= -0x80000000) {
+                const bytes = new Uint8Array(5);
+                bytes[0] = 0xd2;
+                new DataView(bytes.buffer).setInt32(1, num);
+                push(bytes);
+            } else if (Number.isSafeInteger(num)) {
+                // Большие целые (например, метки времени в мс) - uint64/int64
+                const bytes = new Uint8Array(9);
+                const view = new DataView(bytes.buffer);
+                const high = Math.floor(num / 0x100000000);
+                bytes[0] = num >= 0 ? 0xcf : 0xd3;
+                view.setInt32(1, high);
+                view.setUint32(5, num - high * 0x100000000);
+                push(bytes);
+            } else {
+                const bytes = new Uint8Array(9);
+                bytes[0] = 0xcb;
+                new DataView(bytes.buffer).setFloat64(1, num);
+                push(bytes);
+            }
+        }
+
+        function write(item) {
+            if (item === null || item === undefined) {
+                push(Uint8Array.of(0xc0));
+            } else if (item === false) {
+                push(Uint8Array.of(0xc2));
+            } else if (item === true) {
+                push(Uint8Array.of(0xc3));
+            } else if (typeof item === 'number') {
+                writeNumber(item);
+            } else if (typeof item === 'string') {
+                const bytes = utf8Encoder.encode(item);
+                if (bytes.length < 32) push(Uint8Array.of(0xa0 | bytes.length));
+                else if (bytes.length <= 0xff) header(0xd9, bytes.length, 1);
+                else if (bytes.length <= 0xffff) header(0xda, bytes.length, 2);
+                else header(0xdb, bytes.length, 4);
+                push(bytes);
+            } else if (item instanceof ArrayBuffer || ArrayBuffer.isView(item)) {
+                const bytes = item instanceof ArrayBuffer
+                    ? new Uint8Array(item)
+                    : new Uint8Array(item.buffer, item.byteOffset, item.byteLength);
+                if (bytes.length <= 0xff) header(0xc4, bytes.length, 1);
+                else if (bytes.length <= 0xffff) header(0xc5, bytes.length, 2);
+                else header(0xc6, bytes.length, 4);
+                push(bytes);
+            } else if (Array.isArray(item)) {
+                if (item.length < 16) push(Uint8Array.of(0x90 | item.length));
+                else if (item.length <= 0xffff) header(0xdc, item.length, 2);
+                else header(0xdd, item.length, 4);
+                item.forEach(write);
+            } else {
+                const keys = Object.keys(item).filter(key => item[key] !== undefined);
+                if (keys.length < 16) push(Uint8Array.of(0x80 | keys.length));
+                else if (keys.length <= 0xffff) header(0xde, keys.length, 2);
+                else header(0xdf, keys.length, 4);
+                keys.forEach(key => {
+                    write(key);
+                    write(item[key]);
+                });
+            }
+        }
+
+        write(value);
+        const result = new Uint8Array(size);
+        let offset = 0;
+        chunks.forEach(chunk => {
+            result.set(chunk, offset);
+            offset += chunk.length;
+        });
+        return result;
+    }
+
+    // ---------- Декодирование ----------
+    function decode(buffer) {
+        const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function readString(length) {
+            const value = utf8Decoder.decode(bytes.subarray(offset, offset + length));
+            offset += length;
+            return value;
+        }
+
+        function readBinary(length) {
+            const value = bytes.slice(offset, offset + length);
+            offset += length;
+            return value;
+        }
+
+        function readArray(length) {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) value[i] = read();
+            return value;
+        }
+
+        function readMap(length) {
+            const value = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                value[key] = read();
+            }
+            return value;
+        }
+
+        function readUint(bytesCount) {
+            let value;
+            if (bytesCount === 1) value = view.getUint8(offset);
+            else if (bytesCount === 2) value = view.getUint16(offset);
+            else if (bytesCount === 4) value = view.getUint32(offset);
+            else value = view.getUint32(offset) * 0x100000000 + view.getUint32(offset + 4);
+            offset += bytesCount;
+            return value;
+        }
+
+        function readInt(bytesCount) {
+            let value;
+            if (bytesCount === 1) value = view.getInt8(offset);
+            else if (bytesCount === 2) value = view.getInt16(offset);
+            else if (bytesCount === 4) value = view.getInt32(offset);
+            else value = view.getInt32(offset) * 0x100000000 + view.getUint32(offset + 4);
+            offset += bytesCount;
+            return value;
+        }
+
+        function read() {
+            const prefix = bytes[offset++];
+            if (prefix < 0x80) return prefix;
+            if (prefix < 0x90) return readMap(prefix & 0x0f);
+            if (prefix < 0xa0) return readArray(prefix & 0x0f);
+            if (prefix < 0xc0) return readString(prefix & 0x1f);
+            if (prefix >= 0xe0) return prefix - 0x100;
+
+            let value;
+            switch (prefix) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return readBinary(readUint(1));
+                case 0xc5: return readBinary(readUint(2));
+                case 0xc6: return readBinary(readUint(4));
+                case 0xca:
+                    value = view.getFloat32(offset);
+                    offset += 4;
+                    return value;
+                case 0xcb:
+                    value = view.getFloat64(offset);
+                    offset += 8;
+                    return value;
+                case 0xcc: return readUint(1);
+                case 0xcd: return readUint(2);
+                case 0xce: return readUint(4);
+                case 0xcf: return readUint(8);
+                case 0xd0: return readInt(1);
+                case 0xd1: return readInt(2);
+                case 0xd2: return readInt(4);
+                case 0xd3: return readInt(8);
+                case 0xd9: return readString(readUint(1));
+                case 0xda: return readString(readUint(2));
+                case 0xdb: return readString(readUint(4));
+                case 0xdc: return readArray(readUint(2));
+                case 0xdd: return readArray(readUint(4));
+                case 0xde: return readMap(readUint(2));
+                case 0xdf: return readMap(readUint(4));
+            }
+            throw new Error(`msgpack: неподдерживаемый тип 0x${prefix.toString(16)}`);
+        }
+
+        return read();
+    }
+
+    // ---------- Интерфейс парсера для socket.io-client ----------
+    class Encoder {
+        encode(packet) {
+            return [encode(packet)];
+        }
+    }
+
+    class Decoder {
+        constructor() {
+            this.listeners = {};
+        }
+
+        on(event, listener) {
+            (this.listeners[event] = this.listeners[event] || []).push(listener);
+            return this;
+        }
+
+        off(event, listener) {
+            this.listeners[event] = (this.listeners[event] || []).filter(item => item !== listener);
+            return this;
+        }
+
+        add(data) {
+            const packet = decode(data);
+            if (typeof packet.type !== 'number' || typeof packet.nsp !== 'string') {
+                throw new Error('msgpack: некорректный пакет');
+            }
+            (this.listeners.decoded || []).forEach(listener => listener(packet));
+        }
+
+        destroy() {
+            this.listeners = {};
+        }
+    }
+
+    global.msgpackParser = { protocol: 5, Encoder, Decoder };
+})(window);